@@ -1,13 +1,36 @@
-from flask import Flask, request
+from flask import Flask, request, g, Response
 from flask_socketio import SocketIO, emit, join_room, leave_room
 from flask_cors import CORS
-from utils.jwt_helper import decode_token
+from utils.jwt_helper import decode_token, token_cache_stats
 from datetime import datetime
 from config import Config
 from models import db, User, Conversation, Message
 from functools import wraps
 from flask import jsonify
-from utils.database import get_or_create_conversation, save_message, mark_message_delivered,get_undelivered_messages,get_conversation_messages,mark_messages_as_read
+from utils.database import get_or_create_conversation_id, save_message, get_conversation_messages,mark_messages_as_read,get_user_conversations,get_conversation_messages_page,get_conversation_message_count,iter_undelivered_message_chunks,count_undelivered_messages
+from utils.database import (get_conversation_for_user, create_group, add_group_members, remove_group_member,
+                            get_group_member, get_group_members, get_group_member_ids, get_user_group_ids,
+                            iter_undelivered_group_message_chunks, mark_group_messages_delivered,
+                            advance_delivered_watermarks, mark_group_read, get_last_seen,
+                            search_user_messages, get_changes_since, get_user_version,
+                            get_conversation_version, get_conversation_id, conversation_partners)
+from utils.connections import connections
+from utils.routing import router, conversation_room
+from utils.presence import presence
+from utils.delivery import delivery
+from utils.ratelimit import send_limits
+from utils.httpcache import response_cache, conditional_json
+from utils.replica import replicas
+from utils.pool import configure_engines, pool_stats
+from utils.bulk import validate_bulk, send_bulk, import_bulk
+from migrations import upgrade_database
+from utils.pagination import encode_cursor, decode_cursor, encode_rank_cursor, decode_rank_cursor
+from utils.persistence import init_message_writer, get_message_writer, PipelineFull
+from utils.metrics import metrics, timed, events_total, http_request_seconds
+from utils.log import configure_logging, log_event
+import atexit
+import time
+from typing import Optional
 
 
 socketio = SocketIO()
@@ -18,62 +41,114 @@ def create_app():
     
     # Load configuration
     app.config.from_object(Config)
+
+    # Structured logging off the event loop
+    configure_logging(
+        level=app.config['LOG_LEVEL'],
+        fmt=app.config['LOG_FORMAT'],
+        sample_rates=app.config['LOG_SAMPLE_RATES'],
+        include_content=app.config['LOG_MESSAGE_CONTENT']
+    )
     
-    # Initialize database
+    # Initialize database with tuned, instrumented pools; list and history reads may go to replicas
+    configure_engines(app)
     db.init_app(app)
+    replicas.init_app(app)
     
     # Initialize SocketIO
     socketio.init_app(app, cors_allowed_origins="*")
+
+    # Route deliveries and presence between nodes
+    router.init_app(app, socketio)
+
+    # Batched typing / presence broadcasts; pending last-seen times are written on exit
+    presence.init_app(app, socketio)
+    atexit.register(presence.stop)
+
+    # 1:1 deliveries wait for the client's ack; acks are written in batches
+    delivery.init_app(app, socketio)
+    atexit.register(delivery.stop)
+
+    # Token buckets for send_message
+    send_limits.init_app(app)
+
+    # Serialized bodies of conditional GETs
+    response_cache.init_app(app)
     
-    # Create tables
-    with app.app_context():
-        db.create_all()
-        print("✅ Database tables created")
+    # Create tables / apply pending migrations
+    if app.config['AUTO_MIGRATE']:
+        with app.app_context():
+            upgrade_database()
+            log_event('schema_ready')
+
+    # Optional write-behind persistence; drained on interpreter exit
+    writer = init_message_writer(app, start_task=socketio.start_background_task,
+                                 on_failed=notify_persist_failed)
+    if writer:
+        atexit.register(writer.stop)
+
+    # Metrics: hot-path histograms are recorded only when enabled
+    metrics.enabled = app.config['METRICS_ENABLED']
+    register_gauges(app)
+
+    @app.before_request
+    def start_request_timer():
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def record_request_time(response):
+        started = g.get('request_started')
+        if started is not None and request.endpoint != 'prometheus_metrics':
+            http_request_seconds.observe(time.perf_counter() - started,
+                                         request.endpoint or 'unknown', str(response.status_code))
+        return response
     
     @app.route('/health')
     def health():
         return {'status': 'ok', 'database': 'connected'}
 
+    @app.route('/metrics')
+    def prometheus_metrics():
+        """Prometheus text exposition of counters, histograms and gauges"""
+        if not metrics.enabled:
+            return jsonify({'error': 'Metrics are disabled'}), 404
+        return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
     @app.route('/api/conversations', methods=['GET'])
     @jwt_required
     def get_conversations(user_id):
         """
-        Get all conversations for the authenticated user
+        Get the authenticated user's conversations, most recently active first.
+        Query params: limit, before (cursor from a previous page's next_cursor)
+        Supports If-None-Match / If-Modified-Since (304 Not Modified).
         """
         try:
-            conversations = Conversation.query.filter(
-                (Conversation.user1_id == user_id) | (Conversation.user2_id == user_id)
-            ).all()
-            result = []
-
-            for conv in conversations:
-                other_user_id = conv.user2_id if conv.user1_id == user_id else conv.user1_id
-                last_message = Message.query.filter_by(
-                    conversation_id=conv.id
-                ).order_by(Message.sent_at.desc()).first()
-
-                unread_count = Message.query.filter(
-                    Message.conversation_id == conv.id,
-                    Message.sender_id != user_id,
-                    Message.read_at.is_(None)
-                ).count()
-
-                conv_data = {
-                    'conversation_id': conv.id,
-                    'other_user_id': other_user_id,
-                    'last_message': None,
-                    'unread_count': unread_count,
-                    'updated_at': conv.updated_at.isoformat()
-                }
+            limit = min(request.args.get('limit', default=50, type=int), 200)
+            before = request.args.get('before')
+
+            try:
+                before_key = decode_cursor(before) if before else None
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
 
-                if last_message:
-                    conv_data['last_message'] = {
-                        'content': last_message.content,
-                        'sent_at': last_message.sent_at.isoformat(),
-                        'sender_id': last_message.sender_id
-                    }
-                result.append(conv_data)
-            return jsonify({'conversations': result}), 200
+            def build():
+                rows, has_more = get_user_conversations(user_id, limit, before_key)
+
+                next_cursor = None
+                if has_more and rows:
+                    next_cursor = encode_cursor(rows[-1].updated_at, rows[-1].id)
+
+                return {
+                    'conversations': [row.to_dict(user_id) for row in rows],
+                    'has_more': has_more,
+                    'next_cursor': next_cursor
+                }, [row.id for row in rows]
+
+            # Validators and body from the same database, so a cached body always matches its ETag
+            with replicas.reading(user_id):
+                seq, last_modified = get_user_version(user_id) or (None, None)
+                return conditional_json((user_id, 'conversations', limit, before), seq, last_modified,
+                                        app.config['SYNC_SETTLE_SECONDS'], build)
 
         except Exception as e:
             return jsonify({'error': str(e)}), 500
@@ -83,38 +158,186 @@ def create_app():
     def get_messages(user_id):
         """
         Get message history for a conversation with pagination.
-        Query params: conversation_id,limit,offset
+        Query params: conversation_id, limit, and either
+          - before / after: cursors from a previous page (keyset mode, default)
+          - offset: legacy offset pagination
+        include_total=true adds a cached message count in keyset mode.
+        Supports If-None-Match / If-Modified-Since (304 Not Modified).
         """
         try:
             conversation_id = request.args.get('conversation_id', type=int)
-            limit = request.args.get('limit', default=50, type=int)
-            offset = request.args.get('offset', default=0, type=int)
+            limit = min(request.args.get('limit', default=50, type=int), 200)
 
             if not conversation_id:
                 return jsonify({'error': 'conversation_id is required'}), 400
 
             # Check if user is part of this conversation
-            conversation = Conversation.query.filter(
-                Conversation.id == conversation_id,
-                ((Conversation.user1_id == user_id) | (Conversation.user2_id == user_id))
-            ).first()
+            conversation = get_conversation_for_user(conversation_id, user_id)
 
             if not conversation:
                 return jsonify({'error': 'Conversation not found or access denied'}), 404
 
-            # Get messages
-            messages, total = get_conversation_messages(conversation_id, limit, offset)
+            key = (user_id, 'messages', tuple(sorted(request.args.items())))
+            settle_seconds = app.config['SYNC_SETTLE_SECONDS']
+
+            if 'offset' in request.args:
+                offset = request.args.get('offset', default=0, type=int)
+
+                def build_offset_page():
+                    messages, total = get_conversation_messages(conversation_id, limit, offset)
+                    return {
+                        'messages': [msg.to_dict() for msg in messages],
+                        'total': total,
+                        'has_more': (offset + limit) < total
+                    }, [conversation_id]
+
+                with replicas.reading(user_id):
+                    seq, last_modified = get_conversation_version(conversation_id)
+                    return conditional_json(key, seq, last_modified, settle_seconds, build_offset_page)
+
+            before = request.args.get('before')
+            after = request.args.get('after')
+            try:
+                before_key = decode_cursor(before) if before else None
+                after_key = decode_cursor(after) if after else None
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+
+            def build():
+                messages, has_more = get_conversation_messages_page(
+                    conversation_id, limit, before=before_key, after=after_key
+                )
+
+                result = {
+                    'messages': [msg.to_dict() for msg in messages],
+                    'has_more': has_more,
+                    # Pass as `before` to page back in time, `after` to poll for newer messages
+                    'next_cursor': encode_cursor(messages[-1].sent_at, messages[-1].id) if messages else before,
+                    'prev_cursor': encode_cursor(messages[0].sent_at, messages[0].id) if messages else after
+                }
+
+                if request.args.get('include_total', '').lower() in ('1', 'true', 'yes'):
+                    result['total'] = get_conversation_message_count(conversation_id)
+                return result, [conversation_id]
+
+            with replicas.reading(user_id):
+                seq, last_modified = get_conversation_version(conversation_id)
+                return conditional_json(key, seq, last_modified, settle_seconds, build)
+
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
+
+    @app.route('/api/messages/search', methods=['GET'])
+    @jwt_required
+    def search_messages(user_id):
+        """
+        Full-text search over the caller's conversations, most relevant first.
+        Query params: q, conversation_id (optional), limit, cursor (from a
+        previous page's next_cursor)
+        """
+        try:
+            query = request.args.get('q', '').strip()
+            conversation_id = request.args.get('conversation_id', type=int)
+            limit = min(request.args.get('limit', default=20, type=int), 100)
+
+            if not query:
+                return jsonify({'error': 'q is required'}), 400
+            if len(query) > app.config['SEARCH_MAX_QUERY_LENGTH']:
+                return jsonify({'error': 'Query too long'}), 400
+
+            if conversation_id and not get_conversation_for_user(conversation_id, user_id):
+                return jsonify({'error': 'Conversation not found or access denied'}), 404
+
+            cursor = request.args.get('cursor')
+            try:
+                after = decode_rank_cursor(cursor) if cursor else None
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
 
-            # Convert messages to dict
-            messages_data = [msg.to_dict() for msg in messages]
+            with timed('search'), replicas.reading(user_id):
+                results, has_more = search_user_messages(user_id, query, limit, after, conversation_id)
 
-            # Calculate has_more
-            has_more = (offset + limit) < total
+            next_cursor = None
+            if has_more:
+                message, rank = results[-1]
+                next_cursor = encode_rank_cursor(rank, message.id)
 
             return jsonify({
-                'messages': messages_data,
-                'total': total,
-                'has_more': has_more
+                'results': [dict(message.to_dict(), rank=rank) for message, rank in results],
+                'has_more': has_more,
+                'next_cursor': next_cursor
+            }), 200
+
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
+
+    @app.route('/api/sync', methods=['GET'])
+    @jwt_required
+    def sync(user_id):
+        """
+        Delta sync for reconnecting clients.
+        Query params: since (cursor from a previous sync). Without it only the
+        current cursor is returned: take it, then load conversations in full.
+        """
+        try:
+            since = request.args.get('since')
+            if since is not None and not since.isdigit():
+                return jsonify({'error': 'Invalid cursor'}), 400
+
+            with timed('sync'):
+                result = sync_payload(user_id, int(since) if since is not None else None)
+            return jsonify(result), 200
+
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
+
+    @app.route('/api/messages/bulk', methods=['POST'])
+    @jwt_required
+    def send_messages_bulk(user_id):
+        """
+        Send many messages in one request (bots, integrations, imports).
+        Body: {
+            'messages': [{'to_user_id' | 'conversation_id', 'content', 'sent_at'?}, ...],
+            'import': bool      # history: keeps sent_at, stored delivered and read, no fan-out
+        }
+        Items are validated individually; the valid ones are written together.
+        Imports are limited to BULK_IMPORT_USER_IDS: they plant history nobody is notified of.
+        """
+        try:
+            data = request.get_json(silent=True) or {}
+            items = data.get('messages')
+            history = bool(data.get('import'))
+
+            if history and user_id not in app.config['BULK_IMPORT_USER_IDS']:
+                return jsonify({'error': 'Not allowed to import history'}), 403
+
+            if not isinstance(items, list) or not items:
+                return jsonify({'error': 'messages must be a non-empty list'}), 400
+            if len(items) > app.config['BULK_MAX_MESSAGES']:
+                return jsonify({'error': f"At most {app.config['BULK_MAX_MESSAGES']} messages per request"}), 400
+
+            limited = send_limits.check_bulk(user_id, len(items), event='bulk')
+            if limited:
+                response = jsonify({'error': 'Rate limited', **limited})
+                response.headers['Retry-After'] = str(max(1, round(limited['retry_after'])))
+                return response, 429
+
+            accepted, rejected = validate_bulk(user_id, items, app.config['MAX_MESSAGE_LENGTH'],
+                                               allow_sent_at=history)
+            if history:
+                with timed('bulk_import'):
+                    messages = import_bulk(user_id, accepted) if accepted else []
+                delivered = {message.id for message in messages}
+            else:
+                with timed('bulk_insert'):
+                    messages = send_bulk(user_id, accepted) if accepted else []
+                delivered = fan_out_bulk(user_id, accepted, messages)
+
+            log_event('bulk_sent', sender_id=user_id, accepted=len(messages), rejected=len(rejected),
+                      history=history)
+            return jsonify({
+                'accepted': bulk_acks(messages, accepted, delivered),
+                'rejected': rejected
             }), 200
 
         except Exception as e:
@@ -133,157 +356,705 @@ def create_app():
                 return jsonify({'error': 'conversation_id is required'}), 400
 
             # Check if user is part of this conversation
-            conversation = Conversation.query.filter(
-                Conversation.id == conversation_id,
-                ((Conversation.user1_id == user_id) | (Conversation.user2_id == user_id))
-            ).first()
+            conversation = get_conversation_for_user(conversation_id, user_id)
 
             if not conversation:
                 return jsonify({'error': 'Conversation not found or access denied'}), 404
 
-            count = mark_messages_as_read(conversation_id, user_id)
+            if conversation.is_group:
+                count, up_to, read_at = mark_group_read(conversation_id, user_id)
+            else:
+                count, up_to, read_at = mark_messages_as_read(conversation_id, user_id)
+
+            # One aggregated receipt to every device of the other participant(s), up to a (sent_at, id) key
+            if up_to is not None:
+                receipt = {
+                    'conversation_id': conversation_id,
+                    'reader_id': user_id,
+                    'up_to_message_id': up_to[1],
+                    'up_to_sent_at': up_to[0].isoformat(),
+                    'count': count,
+                    'read_at': read_at.isoformat()
+                }
+                if conversation.is_group:
+                    router.broadcast(conversation_room(conversation_id), 'messages_read', receipt)
+                else:
+                    router.deliver(conversation.other_user_id(user_id), 'messages_read', receipt)
 
             return jsonify({
                 'success': True,
                 'messages_marked': count
             }), 200
         except Exception as e:
-            return jsonify({'error': str(e)}), 500 
+            return jsonify({'error': str(e)}), 500
+
+    @app.route('/api/presence', methods=['GET'])
+    @jwt_required
+    def get_presence(user_id):
+        """
+        Get online status for a set of users.
+        Query params: user_ids (comma separated)
+        Users the caller shares no conversation with are left out.
+        """
+        raw_ids = request.args.get('user_ids', '')
+        try:
+            user_ids = [int(uid) for uid in raw_ids.split(',') if uid.strip()]
+        except ValueError:
+            return jsonify({'error': 'user_ids must be a comma separated list of integers'}), 400
+        if len(user_ids) > Config.PRESENCE_MAX_SUBSCRIPTIONS:
+            return jsonify({'error': f'At most {Config.PRESENCE_MAX_SUBSCRIPTIONS} user_ids per request'}), 400
+
+        visible = conversation_partners(user_id, user_ids)
+        user_ids = [uid for uid in dict.fromkeys(user_ids) if uid in visible]
+
+        return jsonify({
+            'presence': {
+                str(uid): {
+                    'online': router.is_online(uid),
+                    'devices_on_node': len(connections.sids_for(uid))
+                } for uid in user_ids
+            }
+        }), 200
+
+    @app.route('/api/groups', methods=['POST'])
+    @jwt_required
+    def create_group_conversation(user_id):
+        """
+        Create a group conversation owned by the caller.
+        Body: {"name": str, "member_ids": [int, ...]}
+        """
+        data = request.get_json(silent=True) or {}
+        name = (data.get('name') or '').strip()
+        member_ids = data.get('member_ids') or []
+
+        if not name or len(name) > 100:
+            return jsonify({'error': 'name is required (max 100 characters)'}), 400
+        if not isinstance(member_ids, list) or not all(isinstance(uid, int) for uid in member_ids):
+            return jsonify({'error': 'member_ids must be a list of integers'}), 400
+
+        try:
+            conversation = create_group(user_id, name, member_ids)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        room = conversation_room(conversation.id)
+        members = get_group_members(conversation.id)
+        for member in members:
+            router.join_room(member.user_id, room)
+
+        return jsonify({
+            'conversation': conversation.to_dict(),
+            'members': [member.to_dict() for member in members]
+        }), 201
+
+    @app.route('/api/groups/<int:conversation_id>/members', methods=['GET'])
+    @jwt_required
+    def list_group_members(user_id, conversation_id):
+        if not get_group_member(conversation_id, user_id):
+            return jsonify({'error': 'Group not found or access denied'}), 404
+
+        return jsonify({
+            'conversation_id': conversation_id,
+            'members': [member.to_dict() for member in get_group_members(conversation_id)]
+        }), 200
+
+    @app.route('/api/groups/<int:conversation_id>/members', methods=['POST'])
+    @jwt_required
+    def add_members(user_id, conversation_id):
+        """
+        Add members to a group (owners and admins only).
+        Body: {"user_ids": [int, ...]}
+        """
+        member = get_group_member(conversation_id, user_id)
+        if not member:
+            return jsonify({'error': 'Group not found or access denied'}), 404
+        if not member.can_manage:
+            return jsonify({'error': 'Only group owners and admins can add members'}), 403
+
+        user_ids = (request.get_json(silent=True) or {}).get('user_ids')
+        if not isinstance(user_ids, list) or not all(isinstance(uid, int) for uid in user_ids):
+            return jsonify({'error': 'user_ids must be a list of integers'}), 400
+
+        try:
+            added = add_group_members(conversation_id, user_ids)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        room = conversation_room(conversation_id)
+        for added_id in added:
+            router.join_room(added_id, room)
+        if added:
+            router.broadcast(room, 'group_members_changed', {
+                'conversation_id': conversation_id, 'added': added, 'removed': []
+            })
+
+        return jsonify({'success': True, 'added': added}), 200
+
+    @app.route('/api/groups/<int:conversation_id>/members/<int:member_id>', methods=['DELETE'])
+    @jwt_required
+    def remove_member(user_id, conversation_id, member_id):
+        """Remove a member (owners and admins), or leave the group (member_id = yourself)"""
+        member = get_group_member(conversation_id, user_id)
+        if not member:
+            return jsonify({'error': 'Group not found or access denied'}), 404
+        if member_id != user_id and not member.can_manage:
+            return jsonify({'error': 'Only group owners and admins can remove members'}), 403
+
+        if not remove_group_member(conversation_id, member_id):
+            return jsonify({'error': 'Not a member of this group'}), 404
+
+        room = conversation_room(conversation_id)
+        router.leave_room(member_id, room)
+        router.broadcast(room, 'group_members_changed', {
+            'conversation_id': conversation_id, 'added': [], 'removed': [member_id]
+        })
+
+        return jsonify({'success': True}), 200
 
 
 
     return app
 
-active_users = {}
+def notify_persist_failed(message, error: str):
+    """Write-behind could not save a message it already acked: tell every device of the sender"""
+    router.deliver(message.sender_id, 'error', {
+        'message': 'Message could not be saved',
+        'message_id': message.id,
+        'conversation_id': message.conversation_id,
+        'status': 'failed'
+    })
+
+def register_gauges(app):
+    """Gauges are read at scrape time, so they cost nothing between scrapes"""
+    metrics.gauge('chat_connected_sockets', 'Open Socket.IO connections on this node',
+                  connections.connection_count)
+    metrics.gauge('chat_online_users', 'Users with at least one socket on this node',
+                  connections.user_count)
+    metrics.gauge('chat_undelivered_messages', 'Messages queued for offline recipients',
+                  count_undelivered_messages)
+
+    def pool_usage():
+        with app.app_context():
+            pools = pool_stats(db.engines)
+        return {
+            (name, state): stats[state]
+            for name, stats in pools.items()
+            for state in ('size', 'checked_out', 'overflow', 'waiting')
+        }
+    metrics.gauge('chat_db_pool_connections', 'Database connection pool usage', pool_usage, ('pool', 'state'))
+
+    def pool_saturation():
+        with app.app_context():
+            return {name: stats['saturation'] for name, stats in pool_stats(db.engines).items()}
+    metrics.gauge('chat_db_pool_saturation', 'Checked-out share of each pool, overflow included',
+                  pool_saturation, ('pool',))
+
+    def writer_queue():
+        writer = get_message_writer()
+        return writer.pending() if writer else 0
+    metrics.gauge('chat_write_behind_queue', 'Messages waiting for the write-behind writer', writer_queue)
+
+    def token_cache():
+        stats = token_cache_stats()
+        return {'hits': stats['hits'], 'misses': stats['misses'], 'size': stats['size']}
+    metrics.gauge('chat_token_cache', 'Verified-token cache counters', token_cache, ('stat',))
+
+    def cached_responses():
+        stats = response_cache.stats()
+        return {'hits': stats['hits'], 'misses': stats['misses'], 'size': stats['size']}
+    metrics.gauge('chat_response_cache', 'REST response cache counters', cached_responses, ('stat',))
+
+    metrics.gauge('chat_pending_deliveries', 'Deliveries waiting for a client ack on this node',
+                  delivery.pending)
+
+    metrics.gauge('chat_replica_lag_seconds', 'Last measured lag per read replica (-1: unreachable)',
+                  replicas.lags, ('replica',))
 
 @socketio.on('connect')
 def handle_connect(auth):
+    registered = False
     try:
         token = auth.get('token')
         if not token:
-            print('❌ Connection rejected: No token provided')
+            log_event('connect_rejected', 'warning', reason='no_token')
             return False
         
-        payload = decode_token(token)
+        with timed('auth'):
+            payload = decode_token(token)
         user_id = payload.get('user_id')
 
         if not user_id:
-            print('❌ Connection rejected: Invalid token')
+            log_event('connect_rejected', 'warning', reason='invalid_token')
+            events_total.inc('connect', 'rejected')
             return False
 
-        active_users[user_id] = request.sid # type: ignore
-
-        # Deliver undelivered messages
-        undelivered = get_undelivered_messages(user_id)
-        if undelivered:
-            print(f"📬 Delivering {len(undelivered)} queued messages to user {user_id}")
-            for message in undelivered:
-                emit('new_message', {
-                    'message_id': message.id,
-                    'conversation_id': message.conversation_id,
-                    'from_user_id': message.sender_id,
-                    'content': message.content,
-                    'sent_at': message.sent_at.isoformat()
-                })
-                mark_message_delivered(message.id)
+        router.user_connected(user_id, request.sid) # type: ignore
+        registered = True
+
+        # Group messages are broadcast to the conversation's room
+        for conversation_id in get_user_group_ids(user_id):
+            join_room(conversation_room(conversation_id))
+
+        # Deliver undelivered messages in bounded chunks, one event per chunk; each is marked delivered once acked
+        queued = 0
+        for chunk in iter_undelivered_message_chunks(user_id, Config.OFFLINE_FLUSH_CHUNK_SIZE):
+            with timed('fanout_emit'):
+                delivery.send(user_id, [request.sid], 'new_messages', # type: ignore
+                              {'messages': [message.to_event() for message in chunk]},
+                              [(message.id, message.sender_id) for message in chunk])
+            queued += len(chunk)
+            # Let other greenlets run between chunks
+            socketio.sleep(0)
 
-        print(f"✅ User {user_id} connected with socket {request.sid}") # type: ignore
+        # Then group messages past the user's delivered watermarks
+        for chunk in iter_undelivered_group_message_chunks(user_id, Config.OFFLINE_FLUSH_CHUNK_SIZE):
+            with timed('fanout_emit'):
+                emit('new_messages', {'messages': [message.to_event() for message in chunk]})
+            with timed('delivery_mark'):
+                mark_group_messages_delivered(user_id, chunk)
+            queued += len(chunk)
+            socketio.sleep(0)
+
+        if queued:
+            log_event('offline_flush', user_id=user_id, messages=queued)
+
+        log_event('connected', user_id=user_id, sid=request.sid) # type: ignore
         
         emit('authenticated', {'user_id': user_id, 'message': 'Authentication successful'})
+        events_total.inc('connect', 'ok')
         
         return True
         
     except Exception as e:
-        print(f"❌ Connection rejected: {str(e)}")
+        # A refused connection never gets a disconnect event: unregister it here, or the
+        # user stays online cluster-wide (and keeps having group watermarks advanced)
+        if registered:
+            release_connection(request.sid) # type: ignore
+        log_event('connect_rejected', 'warning', reason=str(e))
+        events_total.inc('connect', 'rejected')
         return False
 
 @socketio.on('disconnect')
 def handle_disconnect():
-    user_id = None
-    for uid, sid in active_users.items():
-        if sid == request.sid: # type: ignore
-            user_id = uid
-            break
+    user_id, went_offline = release_connection(request.sid) # type: ignore
     
-    if user_id:
-        del active_users[user_id]
-        print(f"👋 User {user_id} disconnected")
+    if user_id and went_offline:
+        log_event('disconnected', user_id=user_id)
+
+def release_connection(sid: str) -> tuple[Optional[int], bool]:
+    """Drop a socket's registration, presence and rate-limit state. Returns (user_id, went_offline)."""
+    user_id, went_offline = router.user_disconnected(sid)
+    presence.disconnected(sid, user_id)
+    send_limits.forget_connection(sid)
+    return user_id, went_offline
 
 @socketio.on('ping')
 def handle_ping():
     emit('pong', {'timestamp': datetime.now().isoformat()})
+@socketio.on('typing')
+def handle_typing(data):
+    """
+    Typing indicator. Rate limited and throttled per connection, relayed in
+    batches, and only to people the user already has a conversation with.
+    Expected data: {
+        'to_user_id': int,          # 1:1, or
+        'conversation_id': int,     # group
+        'typing': bool              # default true; false when the user stops
+    }
+    """
+    user_id = connections.user_for(request.sid) # type: ignore
+    if not user_id or not isinstance(data, dict):
+        return
+
+    is_typing = bool(data.get('typing', True))
+    conversation_id = data.get('conversation_id')
+    to_user_id = data.get('to_user_id')
+
+    if isinstance(conversation_id, int):
+        target = ('room', conversation_id)
+    elif isinstance(to_user_id, int) and to_user_id != user_id:
+        target, conversation_id = ('user', to_user_id), None
+    else:
+        emit('error', {'message': 'Missing to_user_id or conversation_id'})
+        return
+
+    # Stopping an indicator this connection started always goes through, so none is left hanging
+    allowed = send_limits.check_typing(request.sid) # type: ignore
+    if not allowed and (is_typing or not presence.is_typing(request.sid, target)): # type: ignore
+        events_total.inc('typing', 'rate_limited')
+        return
+
+    if target[0] == 'room':
+        if user_id not in get_group_member_ids(conversation_id):
+            emit('error', {'message': 'Not a member of this conversation'})
+            return
+    elif get_conversation_id(user_id, to_user_id) is None:
+        emit('error', {'message': 'No conversation with this user'})
+        events_total.inc('typing', 'rejected')
+        return
+    presence.typing(request.sid, user_id, target, is_typing, conversation_id) # type: ignore
+
+@socketio.on('subscribe_presence')
+def handle_subscribe_presence(data):
+    """
+    Watch other users' online status. Replies at once with their current
+    state; later changes arrive as batched `presence` events. Users the
+    caller shares no conversation with are ignored.
+    Expected data: {'user_ids': [int, ...]}
+    """
+    user_id = connections.user_for(request.sid) # type: ignore
+    if not user_id:
+        return
+
+    user_ids = data.get('user_ids') if isinstance(data, dict) else None
+    if not isinstance(user_ids, list) or not all(isinstance(uid, int) for uid in user_ids):
+        emit('error', {'message': 'user_ids must be a list of integers'})
+        return
+
+    # No more than a connection may watch anyway
+    user_ids = list(dict.fromkeys(user_ids))[:Config.PRESENCE_MAX_SUBSCRIPTIONS]
+    visible = conversation_partners(user_id, user_ids)
+    added = presence.subscribe(request.sid, [uid for uid in user_ids if uid in visible]) # type: ignore
+    if not added:
+        return
+
+    online = router.online_among(added)
+    offline = [uid for uid in added if uid not in online]
+    last_seen = get_last_seen(offline) if offline else {}
+    last_seen.update(presence.pending_last_seen(offline))
+
+    emit('presence', {'updates': [
+        {
+            'user_id': uid,
+            'online': uid in online,
+            'last_seen': last_seen[uid].isoformat() if last_seen.get(uid) else None
+        } for uid in added
+    ]})
+
+@socketio.on('unsubscribe_presence')
+def handle_unsubscribe_presence(data):
+    user_ids = data.get('user_ids') if isinstance(data, dict) else None
+    if isinstance(user_ids, list):
+        presence.unsubscribe(request.sid, [uid for uid in user_ids if isinstance(uid, int)]) # type: ignore
+
+@socketio.on('sync')
+def handle_sync(data):
+    """
+    Same as GET /api/sync over the socket; replies with a `sync` event.
+    Expected data: {'since': int}
+    """
+    user_id = connections.user_for(request.sid) # type: ignore
+    if not user_id:
+        emit('error', {'message': 'User not authenticated'})
+        return
+
+    since = data.get('since') if isinstance(data, dict) else None
+    if since is not None and (not isinstance(since, int) or since < 0):
+        emit('error', {'message': 'Invalid cursor'})
+        return
+
+    with timed('sync'):
+        emit('sync', sync_payload(user_id, since))
+
+def sync_payload(user_id: int, since: Optional[int]) -> dict:
+    """JSON body shared by GET /api/sync and the `sync` socket event"""
+    result = get_changes_since(user_id, since, Config.SYNC_PAGE_SIZE, Config.SYNC_SETTLE_SECONDS)
+    conversations = result['conversations']
+    visible = {conversation.id for conversation in conversations}
+
+    receipts, members, removed, backfilled = [], [], [], []
+    for change in result['changes']:
+        if change.kind in ('delivered', 'read'):
+            receipts.append({
+                'conversation_id': change.conversation_id,
+                'type': change.kind,
+                'user_id': change.user_id,
+                'up_to_message_id': change.message_id,
+                'up_to_sent_at': change.sent_at.isoformat() if change.sent_at else None,
+                'at': change.created_at.isoformat()
+            })
+        elif change.kind == 'history':
+            backfilled.append(change.conversation_id)
+        elif change.kind in ('member_added', 'member_removed'):
+            if change.conversation_id not in visible:
+                removed.append(change.conversation_id)
+            else:
+                members.append({
+                    'conversation_id': change.conversation_id,
+                    'user_id': change.user_id,
+                    'change': 'added' if change.kind == 'member_added' else 'removed'
+                })
+
+    return {
+        'messages': [message.to_dict() for message in result['messages']],
+        'receipts': receipts,
+        'members': members,
+        'conversations': [conversation.to_dict(user_id) for conversation in conversations],
+        'removed_conversation_ids': sorted(set(removed)),
+        'backfilled_conversation_ids': sorted(set(backfilled)),
+        'cursor': result['cursor'],
+        'has_more': result['has_more'],
+        'reset': result['reset']
+    }
+
 @socketio.on('send_message')
 def handle_send_message(data):
     """
     Handle incoming message from client.
     Expected data: {
-        'to_user_id': int,
+        'to_user_id': int,          # 1:1 message, or
+        'conversation_id': int,     # group message
         'content': str
     }
     """
     try:
         # Get sender info from JWT (already validated in connect)
-        sender_id = None
-        for uid, sid in active_users.items():
-            if sid == request.sid: # type: ignore
-                sender_id = uid
-                break
+        sender_id = connections.user_for(request.sid) # type: ignore
         
         if not sender_id:
             emit('error', {'message': 'User not authenticated'})
+            events_total.inc('send_message', 'rejected')
             return
         
         to_user_id = data.get('to_user_id')
         content = data.get('content')
+
+        # Refuse oversized messages and floods before any database work
+        if isinstance(content, str) and len(content) > Config.MAX_MESSAGE_LENGTH:
+            emit('error', {'message': f'Message too long (max {Config.MAX_MESSAGE_LENGTH} characters)'})
+            events_total.inc('send_message', 'rejected')
+            return
+        # PostgreSQL text cannot hold NUL; with write-behind the row would only fail after the ack
+        if isinstance(content, str) and '\x00' in content:
+            emit('error', {'message': 'Message contains a NUL character'})
+            events_total.inc('send_message', 'rejected')
+            return
+
+        limited = send_limits.check(sender_id, request.sid) # type: ignore
+        if limited:
+            emit('rate_limited', limited)
+            events_total.inc('send_message', 'rate_limited')
+            return
+
+        if data.get('conversation_id') and content:
+            send_group_message(sender_id, data['conversation_id'], content)
+            return
         
         if not to_user_id or not content:
             emit('error', {'message': 'Missing to_user_id or content'})
+            events_total.inc('send_message', 'rejected')
             return
         
-        # Get or create conversation
-        conversation = get_or_create_conversation(sender_id, to_user_id)
+        # Get or create conversation (cached; normally no query)
+        with timed('conversation_lookup'):
+            conversation_id = get_or_create_conversation_id(sender_id, to_user_id)
         
-        # Save message to database
-        message = save_message(conversation.id, sender_id, content)
+        # Save message to database, or queue it for the group-commit writer
+        writer = get_message_writer()
+        if writer:
+            try:
+                with timed('enqueue'):
+                    message = writer.submit(conversation_id, sender_id, content)
+            except PipelineFull:
+                emit('error', {'message': 'Server busy, please retry'})
+                events_total.inc('send_message', 'busy')
+                return
+        else:
+            with timed('db_insert_commit'):
+                message = save_message(conversation_id, sender_id, content)
         
         # Confirm to sender
         emit('message_sent', {
             'message_id': message.id,
-            'conversation_id': conversation.id,
+            'conversation_id': conversation_id,
             'status': 'sent',
             'sent_at': message.sent_at.isoformat()
         })
         
-        print(f"✉️ Message {message.id} from {sender_id} to {to_user_id}: {content[:50]}")
+        log_event('message_sent', content=content, message_id=message.id,
+                  sender_id=sender_id, recipient_id=to_user_id)
         
-        # Deliver to recipient if online
-        recipient_socket_id = active_users.get(to_user_id)
-        if recipient_socket_id:
-            socketio.emit('new_message', {
+        # Deliver to every device the recipient has open, on whichever node holds it. The first
+        # device to ack marks it delivered (batched) and sends the sender `message_delivered`.
+        with timed('fanout_emit'):
+            emitted = router.deliver(to_user_id, 'new_message', {
                 'message_id': message.id,
-                'conversation_id': conversation.id,
+                'conversation_id': conversation_id,
                 'from_user_id': sender_id,
                 'content': content,
                 'sent_at': message.sent_at.isoformat()
-            }, to=recipient_socket_id)
-            
-            # Mark as delivered
-            mark_message_delivered(message.id)
-            
-            # Notify sender about delivery
-            emit('message_delivered', {
-                'message_id': message.id,
-                'delivered_at': datetime.utcnow().isoformat()
-            })
-            
-            print(f"✅ Message {message.id} delivered to user {to_user_id}")
+            }, track=[(message.id, sender_id)])
+        if emitted:
+            log_event('message_emitted', message_id=message.id, recipient_id=to_user_id)
+            events_total.inc('send_message', 'emitted')
         else:
-            print(f"📭 User {to_user_id} is offline. Message queued.")
+            log_event('message_queued', message_id=message.id, recipient_id=to_user_id)
+            events_total.inc('send_message', 'queued')
     
     except Exception as e:
-        print(f"❌ Error sending message: {str(e)}")
+        log_event('send_failed', 'error', error=str(e))
+        events_total.inc('send_message', 'error')
         emit('error', {'message': f'Failed to send message: {str(e)}'})
 
+def send_group_message(sender_id: int, conversation_id: int, content: str):
+    """
+    Save a group message and broadcast it to the conversation's room.
+    Per-member delivery is a watermark: members online anywhere in the
+    cluster have theirs advanced with one UPDATE, the rest catch up on connect.
+    """
+    members = get_group_member_ids(conversation_id)
+    if sender_id not in members:
+        emit('error', {'message': 'Not a member of this conversation'})
+        events_total.inc('send_message', 'rejected')
+        return
+
+    # Row-level delivered_at is not used for groups
+    writer = get_message_writer()
+    if writer:
+        try:
+            with timed('enqueue'):
+                message = writer.submit(conversation_id, sender_id, content, delivered=True)
+        except PipelineFull:
+            emit('error', {'message': 'Server busy, please retry'})
+            events_total.inc('send_message', 'busy')
+            return
+    else:
+        with timed('db_insert_commit'):
+            message = save_message(conversation_id, sender_id, content, delivered=True)
+
+    emit('message_sent', {
+        'message_id': message.id,
+        'conversation_id': conversation_id,
+        'status': 'sent',
+        'sent_at': message.sent_at.isoformat()
+    })
+
+    log_event('message_sent', content=content, message_id=message.id,
+              sender_id=sender_id, conversation_id=conversation_id)
+
+    # One emit per node reaches every member socket; the sending socket is skipped
+    with timed('fanout_emit'):
+        router.broadcast(conversation_room(conversation_id), 'new_message', {
+            'message_id': message.id,
+            'conversation_id': conversation_id,
+            'from_user_id': sender_id,
+            'content': content,
+            'sent_at': message.sent_at.isoformat()
+        }, skip_sid=request.sid) # type: ignore
+
+    online = router.online_among(members - {sender_id})
+    if online:
+        with timed('delivery_mark'):
+            advance_delivered_watermarks(conversation_id, online, message.id, message.sent_at)
+
+        emit('message_delivered', {
+            'message_id': message.id,
+            'delivered_at': datetime.utcnow().isoformat(),
+            'recipients': len(online)
+        })
+        events_total.inc('send_message', 'delivered')
+    else:
+        events_total.inc('send_message', 'queued')
+
+@socketio.on('send_messages')
+def handle_send_messages(data):
+    """
+    Send a batch of messages in one event, written with one multi-row INSERT.
+    Expected data: {'messages': [{'to_user_id' | 'conversation_id', 'content'}, ...]}
+    Replies with one `messages_sent` event listing accepted and rejected items.
+    """
+    try:
+        sender_id = connections.user_for(request.sid) # type: ignore
+        if not sender_id:
+            emit('error', {'message': 'User not authenticated'})
+            return
+
+        items = data.get('messages') if isinstance(data, dict) else None
+        if not isinstance(items, list) or not items:
+            emit('error', {'message': 'messages must be a non-empty list'})
+            events_total.inc('send_messages', 'rejected')
+            return
+        if len(items) > Config.BULK_MAX_MESSAGES:
+            emit('error', {'message': f'At most {Config.BULK_MAX_MESSAGES} messages per batch'})
+            events_total.inc('send_messages', 'rejected')
+            return
+
+        limited = send_limits.check_bulk(sender_id, len(items))
+        if limited:
+            emit('rate_limited', limited)
+            events_total.inc('send_messages', 'rate_limited')
+            return
+
+        accepted, rejected = validate_bulk(sender_id, items, Config.MAX_MESSAGE_LENGTH)
+        with timed('bulk_insert'):
+            messages = send_bulk(sender_id, accepted) if accepted else []
+        delivered = fan_out_bulk(sender_id, accepted, messages, skip_sid=request.sid) # type: ignore
+
+        emit('messages_sent', {
+            'accepted': bulk_acks(messages, accepted, delivered),
+            'rejected': rejected
+        })
+        log_event('bulk_sent', sender_id=sender_id, accepted=len(messages), rejected=len(rejected))
+        events_total.inc('send_messages', 'ok')
+
+    except Exception as e:
+        log_event('send_failed', 'error', error=str(e))
+        events_total.inc('send_messages', 'error')
+        emit('error', {'message': f'Failed to send messages: {str(e)}'})
+
+def fan_out_bulk(sender_id: int, accepted: list[dict], messages: list, skip_sid: Optional[str] = None) -> set[int]:
+    """
+    Deliver a saved batch: one `new_messages` event per online 1:1 recipient
+    and per group room. 1:1 messages are marked delivered when the recipient
+    acks them, or stay queued for their next connect; online group members
+    get their watermarks advanced once per group. Returns the ids of the
+    group messages that reached someone.
+    """
+    by_recipient: dict[int, list] = {}
+    by_group: dict[int, list] = {}
+    for item, message in zip(accepted, messages):
+        if item['is_group']:
+            by_group.setdefault(item['conversation_id'], []).append(message)
+        else:
+            by_recipient.setdefault(item['recipient_id'], []).append(message)
+
+    delivered: set[int] = set()
+    with timed('fanout_emit'):
+        online = router.online_among(list(by_recipient)) if by_recipient else set()
+        for recipient_id, batch in by_recipient.items():
+            if recipient_id in online:
+                router.deliver(recipient_id, 'new_messages', {
+                    'messages': [message.to_event() for message in batch]
+                }, track=[(message.id, sender_id) for message in batch])
+
+        for conversation_id, batch in by_group.items():
+            router.broadcast(conversation_room(conversation_id), 'new_messages', {
+                'messages': [message.to_event() for message in batch]
+            }, skip_sid=skip_sid)
+
+    with timed('delivery_mark'):
+        for conversation_id, batch in by_group.items():
+            members_online = router.online_among(get_group_member_ids(conversation_id) - {sender_id})
+            if members_online:
+                newest = max(batch, key=lambda message: (message.sent_at, message.id))
+                advance_delivered_watermarks(conversation_id, members_online, newest.id, newest.sent_at)
+                delivered.update(message.id for message in batch)
+
+    return delivered
+
+def bulk_acks(messages: list, accepted: list[dict], delivered: set[int]) -> list[dict]:
+    """Per-item confirmations for a bulk send, in request order"""
+    return [
+        {
+            'index': item['index'],
+            'message_id': message.id,
+            'conversation_id': message.conversation_id,
+            'sent_at': message.sent_at.isoformat(),
+            'status': 'delivered' if message.id in delivered else 'sent'
+        }
+        for item, message in zip(accepted, messages)
+    ]
+
 def jwt_required(f):
     """Decorator to require JWT authentication for REST endpoints"""
     @wraps(f)
@@ -295,7 +1066,8 @@ def jwt_required(f):
 
         try:
             token = auth_header.split(' ')[1] if ' ' in auth_header else auth_header
-            payload = decode_token(token)
+            with timed('auth'):
+                payload = decode_token(token)
 
             if not payload:
                 return jsonify({'error': 'Invalid token'}), 401
@@ -0,0 +1,48 @@
+"""
+Move cold message history into compressed chunks in messages_archive.
+
+    python archive.py                         # archive messages older than ARCHIVE_AFTER_DAYS
+    python archive.py --older-than-days 90    # custom cutoff
+    python archive.py --dry-run               # report what would move
+
+It also prunes the delta-sync change log past SYNC_RETENTION_DAYS.
+Run it from cron during quiet hours; each batch is its own transaction, so
+it can be stopped at any point.
+"""
+import argparse
+from datetime import datetime, timedelta
+
+from app import create_app
+from config import Config
+from utils.archive import archive_messages
+from utils.sync import prune_changes
+
+parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+parser.add_argument('--older-than-days', type=int, default=Config.ARCHIVE_AFTER_DAYS)
+parser.add_argument('--chunk-size', type=int, default=Config.ARCHIVE_CHUNK_SIZE)
+parser.add_argument('--batch-size', type=int, default=5000)
+parser.add_argument('--max-batches', type=int, default=None)
+parser.add_argument('--sync-retention-days', type=int, default=Config.SYNC_RETENTION_DAYS)
+parser.add_argument('--dry-run', action='store_true')
+args = parser.parse_args()
+
+app = create_app()
+
+with app.app_context():
+    cutoff = datetime.utcnow() - timedelta(days=args.older_than_days)
+    print(f"\n📦 Archiving messages sent before {cutoff.isoformat()}{' (dry run)' if args.dry_run else ''}...")
+
+    stats = archive_messages(cutoff, chunk_size=args.chunk_size, batch_size=args.batch_size,
+                             max_batches=args.max_batches, dry_run=args.dry_run)
+
+    if not stats['messages']:
+        print("✅ Nothing to archive")
+    else:
+        ratio = stats['raw_bytes'] / stats['compressed_bytes'] if stats['compressed_bytes'] else 0
+        verb = 'Would archive' if args.dry_run else 'Archived'
+        print(f"✅ {verb} {stats['messages']} messages in {stats['chunks']} chunks "
+              f"({stats['batches']} batches, content compressed {ratio:.1f}x)")
+
+    sync_cutoff = datetime.utcnow() - timedelta(days=args.sync_retention_days)
+    pruned = prune_changes(sync_cutoff, dry_run=args.dry_run)
+    print(f"✅ {'Would prune' if args.dry_run else 'Pruned'} {pruned} sync log entries older than {sync_cutoff.isoformat()}")
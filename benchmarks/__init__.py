@@ -0,0 +1,7 @@
+"""
+Benchmark scripts. Run from the repository root, e.g.
+
+    python -m benchmarks.bench_persistence --messages 5000
+
+DATABASE_URL selects the database; a throwaway SQLite file is used otherwise.
+"""
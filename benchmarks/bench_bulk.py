@@ -0,0 +1,80 @@
+"""
+Compare write paths for many messages: one save_message per message (one
+commit each), bulk sends (send_bulk: one multi-row INSERT per batch) and
+history imports (import_messages: COPY on PostgreSQL).
+
+    python -m benchmarks.bench_bulk --messages 20000 --conversations 50 --batch-size 500
+"""
+import argparse
+import time
+from datetime import datetime, timedelta
+
+from benchmarks.common import create_bench_app, create_users, write_report
+
+
+def run(messages: int, conversations: int, batch_size: int) -> dict:
+    app = create_bench_app()
+    user_ids = create_users(app, conversations + 1)
+
+    from config import Config
+    from utils.bulk import validate_bulk, send_bulk, import_bulk
+    from utils.database import get_or_create_conversation_id, save_message
+
+    def items(prefix: str, count: int, backdate: bool = False) -> list[dict]:
+        start = datetime.utcnow() - timedelta(days=365)
+        return [
+            {'to_user_id': user_ids[1 + i % conversations], 'content': f'{prefix} message {i}',
+             **({'sent_at': (start + timedelta(seconds=i)).isoformat()} if backdate else {})}
+            for i in range(count)
+        ]
+
+    with app.app_context():
+        sender_id = user_ids[0]
+        conversation_ids = [get_or_create_conversation_id(sender_id, other) for other in user_ids[1:]]
+
+        start = time.perf_counter()
+        for i in range(messages):
+            save_message(conversation_ids[i % conversations], sender_id, f'single message {i}')
+        single_seconds = time.perf_counter() - start
+
+        batch = items('bulk', messages)
+        start = time.perf_counter()
+        for offset in range(0, messages, batch_size):
+            accepted, _ = validate_bulk(sender_id, batch[offset:offset + batch_size], Config.MAX_MESSAGE_LENGTH)
+            send_bulk(sender_id, accepted)
+        bulk_seconds = time.perf_counter() - start
+
+        history = items('imported', messages, backdate=True)
+        start = time.perf_counter()
+        for offset in range(0, messages, batch_size):
+            accepted, _ = validate_bulk(sender_id, history[offset:offset + batch_size],
+                                        Config.MAX_MESSAGE_LENGTH, allow_sent_at=True)
+            import_bulk(sender_id, accepted)
+        import_seconds = time.perf_counter() - start
+
+    def result(seconds: float) -> dict:
+        return {'seconds': round(seconds, 4), 'msgs_per_sec': round(messages / seconds, 1)}
+
+    return {
+        'benchmark': 'bulk',
+        'database': app.config['SQLALCHEMY_DATABASE_URI'].split('://')[0],
+        'messages': messages,
+        'conversations': conversations,
+        'batch_size': batch_size,
+        'single': result(single_seconds),
+        'bulk_send': result(bulk_seconds),
+        'import': result(import_seconds),
+        'bulk_speedup': round(single_seconds / bulk_seconds, 2),
+        'import_speedup': round(single_seconds / import_seconds, 2),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--messages', type=int, default=20000)
+    parser.add_argument('--conversations', type=int, default=50)
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--output', help='write the JSON report to this file')
+    args = parser.parse_args()
+
+    write_report(run(args.messages, args.conversations, args.batch_size), args.output)
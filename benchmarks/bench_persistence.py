@@ -0,0 +1,75 @@
+"""
+Compare message persistence throughput: synchronous save_message (one
+commit per message) against the write-behind MessageWriter (group commit).
+
+    python -m benchmarks.bench_persistence --messages 5000 --conversations 50
+"""
+import argparse
+import time
+
+from benchmarks.common import create_bench_app, create_users, write_report
+
+
+def run(messages: int, conversations: int, batch_size: int, flush_interval_ms: int) -> dict:
+    app = create_bench_app()
+    user_ids = create_users(app, conversations + 1)
+
+    from utils.database import get_or_create_conversation, save_message
+    from utils.persistence import MessageWriter
+
+    with app.app_context():
+        sender_id = user_ids[0]
+        conversation_ids = [
+            get_or_create_conversation(sender_id, other).id for other in user_ids[1:]
+        ]
+
+        start = time.perf_counter()
+        for i in range(messages):
+            save_message(conversation_ids[i % conversations], sender_id, f'sync message {i}')
+        sync_seconds = time.perf_counter() - start
+
+        writer = MessageWriter(app, batch_size=batch_size,
+                               flush_interval=flush_interval_ms / 1000,
+                               max_queue=messages + 1, enqueue_timeout=5)
+        writer.start()
+
+        start = time.perf_counter()
+        for i in range(messages):
+            writer.submit(conversation_ids[i % conversations], sender_id, f'queued message {i}')
+        ack_seconds = time.perf_counter() - start
+        writer.flush()
+        write_behind_seconds = time.perf_counter() - start
+        writer.stop()
+
+    return {
+        'benchmark': 'persistence',
+        'database': app.config['SQLALCHEMY_DATABASE_URI'].split('://')[0],
+        'messages': messages,
+        'conversations': conversations,
+        'synchronous': {
+            'seconds': round(sync_seconds, 4),
+            'msgs_per_sec': round(messages / sync_seconds, 1),
+        },
+        'write_behind': {
+            'batch_size': batch_size,
+            'flush_interval_ms': flush_interval_ms,
+            'ack_msgs_per_sec': round(messages / ack_seconds, 1),
+            'seconds': round(write_behind_seconds, 4),
+            'msgs_per_sec': round(messages / write_behind_seconds, 1),
+            'batches': writer.batches_written,
+            'failed': writer.failed,
+        },
+        'speedup': round(sync_seconds / write_behind_seconds, 2),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--messages', type=int, default=5000)
+    parser.add_argument('--conversations', type=int, default=50)
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--flush-interval-ms', type=int, default=20)
+    parser.add_argument('--output', help='write the JSON report to this file')
+    args = parser.parse_args()
+
+    write_report(run(args.messages, args.conversations, args.batch_size, args.flush_interval_ms), args.output)
@@ -0,0 +1,157 @@
+"""
+Handler latency against database pool size: for each DB_POOL_SIZE, one
+thread per simulated socket sends messages (send_message -> message_sent)
+and reads history (GET /api/messages) at the same time, so handlers compete
+for connections. Reports latency per handler next to the pool's own
+checkout-wait totals (utils/pool.py).
+
+    python -m benchmarks.bench_pool --pool-sizes 2,5,10,20 --concurrency 32 --requests 50
+
+Every pool size runs in a fresh process: the tables are recreated and the
+module-level caches must not carry ids over from the previous run. Each
+pool gets DB_MAX_OVERFLOW extra connections (0 by default here, so the
+pool size is the hard limit). Use a PostgreSQL DATABASE_URL for numbers
+that mean anything; SQLite serializes writers regardless of the pool.
+"""
+import argparse
+import multiprocessing
+import threading
+import time
+
+from benchmarks.common import create_bench_app, create_users, summarize, write_report
+
+
+def _wait_for(client, event: str, timeout: float = 30.0) -> list:
+    """Poll a test client until `event` arrives; returns everything received"""
+    deadline = time.perf_counter() + timeout
+    received = []
+    while True:
+        batch = client.get_received()
+        received.extend(batch)
+        if any(item['name'] == event for item in batch) or time.perf_counter() > deadline:
+            return received
+        time.sleep(0)
+
+
+def run_pool(pool_size: int, max_overflow: int, concurrency: int, requests: int) -> dict:
+    from config import Config
+
+    Config.DB_POOL_SIZE = pool_size
+    Config.DB_MAX_OVERFLOW = max_overflow
+    app = create_bench_app()
+
+    from app import socketio
+    from models import db
+    from utils.database import get_or_create_conversation_id
+    from utils.jwt_helper import generate_token
+    from utils.pool import pool_stats
+
+    user_ids = create_users(app, concurrency)
+    tokens = {uid: generate_token(uid, f'bench{uid}@test.com') for uid in user_ids}
+    # Each socket writes to the next user round the ring
+    partners = {uid: user_ids[(i + 1) % len(user_ids)] for i, uid in enumerate(user_ids)}
+    with app.app_context():
+        conversations = {uid: get_or_create_conversation_id(uid, partners[uid]) for uid in user_ids}
+        before = pool_stats(db.engines)
+
+    clients = {}
+    for uid in user_ids:
+        client = socketio.test_client(app, auth={'token': tokens[uid]})
+        client.get_received()
+        clients[uid] = client
+
+    send_ms, read_ms = [], []
+    errors = []
+    samples_lock = threading.Lock()
+    barrier = threading.Barrier(concurrency)
+
+    def worker(uid: int):
+        client = clients[uid]
+        http = app.test_client()
+        headers = {'Authorization': f'Bearer {tokens[uid]}'}
+        sends, reads, failed = [], [], 0
+        barrier.wait()
+        for i in range(requests):
+            start = time.perf_counter()
+            client.emit('send_message', {'to_user_id': partners[uid], 'content': f'pool bench {i}'})
+            received = _wait_for(client, 'message_sent')
+            sends.append((time.perf_counter() - start) * 1000)
+            if any(item['name'] == 'error' for item in received):
+                failed += 1
+
+            start = time.perf_counter()
+            response = http.get(f'/api/messages?conversation_id={conversations[uid]}&limit=50', headers=headers)
+            reads.append((time.perf_counter() - start) * 1000)
+            if response.status_code != 200:
+                failed += 1
+        with samples_lock:
+            send_ms.extend(sends)
+            read_ms.extend(reads)
+            errors.append(failed)
+
+    threads = [threading.Thread(target=worker, args=(uid,)) for uid in user_ids]
+    start_all = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = time.perf_counter() - start_all
+
+    for client in clients.values():
+        client.disconnect()
+
+    with app.app_context():
+        after = pool_stats(db.engines).get('primary', {})
+    before = before.get('primary', {})
+    checkouts = after.get('checkouts', 0) - before.get('checkouts', 0)
+    wait_seconds = after.get('wait_seconds', 0.0) - before.get('wait_seconds', 0.0)
+
+    return {
+        'pool_size': pool_size,
+        'max_overflow': max_overflow,
+        'requests_per_sec': round(concurrency * requests * 2 / seconds, 1),
+        'errors': sum(errors),
+        'send_message': summarize(send_ms),
+        'get_messages': summarize(read_ms),
+        'pool': {
+            'checkouts': checkouts,
+            'avg_wait_ms': round(wait_seconds / checkouts * 1000, 3) if checkouts else 0.0,
+            'max_wait_ms': round(after.get('max_wait_seconds', 0.0) * 1000, 3),
+            'timeouts': after.get('timeouts', 0) - before.get('timeouts', 0),
+        },
+    }
+
+
+def run(pool_sizes: list[int], max_overflow: int, concurrency: int, requests: int) -> dict:
+    if concurrency < 2:
+        raise SystemExit('Need at least two concurrent sockets')
+    context = multiprocessing.get_context('spawn')
+    results = []
+    for size in pool_sizes:
+        with context.Pool(1) as worker:
+            results.append(worker.apply(run_pool, (size, max_overflow, concurrency, requests)))
+
+    from config import Config
+    return {
+        'benchmark': 'pool',
+        'database': Config.SQLALCHEMY_DATABASE_URI.split('://')[0],
+        'params': {
+            'concurrency': concurrency,
+            'requests': requests,
+            'max_overflow': max_overflow,
+        },
+        'results': results,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--pool-sizes', default='2,5,10,20', help='comma separated DB_POOL_SIZE values')
+    parser.add_argument('--max-overflow', type=int, default=0)
+    parser.add_argument('--concurrency', type=int, default=32, help='simulated sockets, one thread each')
+    parser.add_argument('--requests', type=int, default=50, help='send + read pairs per socket')
+    parser.add_argument('--output', help='write the JSON report to this file')
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.pool_sizes.split(',') if size.strip()]
+    write_report(run(sizes, args.max_overflow, args.concurrency, args.requests), args.output)
@@ -0,0 +1,93 @@
+"""
+Compare the two ways of reading a page of history: ORM instances serialized
+with Message.to_dict() against Core rows loaded into MessageRow objects.
+Reports time and allocated memory per 1000 messages.
+
+    python -m benchmarks.bench_read_path --messages 20000 --page-size 100
+"""
+import argparse
+import time
+import tracemalloc
+from datetime import datetime
+
+from benchmarks.common import create_bench_app, create_users, write_report
+
+
+def _measure(read_page, pages: int) -> dict:
+    """Time `pages` calls of read_page, then trace allocations for one more pass"""
+    read_page()  # warm up statement caches
+
+    start = time.perf_counter()
+    rows = 0
+    for _ in range(pages):
+        rows += len(read_page())
+    seconds = time.perf_counter() - start
+
+    tracemalloc.start()
+    for _ in range(pages):
+        read_page()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'rows': rows,
+        'seconds': round(seconds, 4),
+        'ms_per_1000_messages': round(seconds * 1000 / rows * 1000, 3),
+        'peak_kib': round(peak / 1024, 1),
+    }
+
+
+def run(messages: int, page_size: int, pages: int) -> dict:
+    app = create_bench_app()
+    sender_id, recipient_id = create_users(app, 2)
+
+    from models import db, Message
+    from utils.database import (get_or_create_conversation_id, save_messages_batch,
+                                get_conversation_messages_page)
+
+    with app.app_context():
+        conversation_id = get_or_create_conversation_id(sender_id, recipient_id)
+        for offset in range(0, messages, 1000):
+            save_messages_batch([
+                {'conversation_id': conversation_id, 'sender_id': sender_id, 'content': f'message {i}',
+                 'sent_at': datetime.utcnow()}
+                for i in range(offset, min(offset + 1000, messages))
+            ])
+
+        def orm_page():
+            page = Message.query.filter_by(conversation_id=conversation_id).order_by(
+                Message.sent_at.desc(), Message.id.desc()
+            ).limit(page_size).all()
+            result = [message.to_dict() for message in page]
+            db.session.expunge_all()
+            return result
+
+        def core_page():
+            page, _ = get_conversation_messages_page(conversation_id, page_size)
+            return [message.to_dict() for message in page]
+
+        orm = _measure(orm_page, pages)
+        core = _measure(core_page, pages)
+
+    return {
+        'benchmark': 'read_path',
+        'database': app.config['SQLALCHEMY_DATABASE_URI'].split('://')[0],
+        'messages': messages,
+        'page_size': page_size,
+        'pages': pages,
+        'orm': orm,
+        'core_rows': core,
+        'speedup': round(orm['seconds'] / core['seconds'], 2),
+        'memory_ratio': round(orm['peak_kib'] / core['peak_kib'], 2) if core['peak_kib'] else None,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--messages', type=int, default=20000)
+    parser.add_argument('--page-size', type=int, default=100)
+    parser.add_argument('--pages', type=int, default=200)
+    parser.add_argument('--output', help='write the JSON report to this file')
+    args = parser.parse_args()
+
+    write_report(run(args.messages, args.page_size, args.pages), args.output)
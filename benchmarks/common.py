@@ -0,0 +1,71 @@
+"""
+Shared setup for the benchmark scripts.
+"""
+import json
+import os
+import sys
+import tempfile
+
+# Must run before config is imported anywhere
+if not os.getenv('DATABASE_URL'):
+    _db_path = os.path.join(tempfile.gettempdir(), 'realtime_chat_bench.db')
+    os.environ['DATABASE_URL'] = f'sqlite:///{_db_path}'
+
+# Benchmarks flood send_message on purpose; opt back in with RATE_LIMIT_ENABLED=true
+os.environ.setdefault('RATE_LIMIT_ENABLED', 'false')
+
+
+def create_bench_app(reset: bool = True):
+    """Create the app against DATABASE_URL, optionally starting from empty tables"""
+    from app import create_app
+    from models import db
+
+    app = create_app()
+    if reset:
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+    return app
+
+
+def create_users(app, count: int) -> list[int]:
+    """Insert `count` throwaway users and return their ids"""
+    from models import db, User
+
+    with app.app_context():
+        users = [
+            User(email=f'bench{i}@test.com', password_hash='x') # type: ignore
+            for i in range(count)
+        ]
+        db.session.add_all(users)
+        db.session.commit()
+        return [user.id for user in users]
+
+
+def percentile(samples: list[float], pct: float) -> float:
+    """Nearest-rank percentile of a list of samples"""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def summarize(samples_ms: list[float]) -> dict:
+    return {
+        'count': len(samples_ms),
+        'p50_ms': round(percentile(samples_ms, 50), 3),
+        'p95_ms': round(percentile(samples_ms, 95), 3),
+        'p99_ms': round(percentile(samples_ms, 99), 3),
+        'max_ms': round(max(samples_ms), 3) if samples_ms else 0.0,
+    }
+
+
+def write_report(report: dict, output: str = None):
+    """Write the report as JSON to `output`, or stdout"""
+    text = json.dumps(report, indent=2, default=str)
+    if output:
+        with open(output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        sys.stdout.write(text + '\n')
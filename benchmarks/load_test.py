@@ -0,0 +1,138 @@
+"""
+Socket load test: connects simulated users through the Socket.IO test
+client and measures the send -> ack -> deliver path, the offline flush on
+reconnect, and /api/conversations.
+
+    python -m benchmarks.load_test --users 50 --messages 2000 --offline-ratio 0.2
+
+Prints a JSON report (or writes it to --output) so runs can be compared
+between releases.
+"""
+import argparse
+import random
+import time
+
+from benchmarks.common import create_bench_app, create_users, summarize, write_report
+
+
+def _wait_for(client, event: str, timeout: float = 5.0) -> list:
+    """Poll a test client until `event` arrives; returns everything received"""
+    deadline = time.perf_counter() + timeout
+    received = []
+    while True:
+        batch = client.get_received()
+        received.extend(batch)
+        if any(item['name'] == event for item in batch) or time.perf_counter() > deadline:
+            return received
+        time.sleep(0)
+
+
+def run(users: int, messages: int, offline_ratio: float, content_size: int, seed: int) -> dict:
+    app = create_bench_app()
+    from app import socketio
+    from utils.jwt_helper import generate_token
+
+    rng = random.Random(seed)
+    user_ids = create_users(app, users)
+    tokens = {uid: generate_token(uid, f'bench{uid}@test.com') for uid in user_ids}
+
+    offline_count = int(users * offline_ratio) if offline_ratio else 0
+    offline_ids = user_ids[:offline_count]
+    online_ids = user_ids[offline_count:]
+    if len(online_ids) < 2:
+        raise SystemExit('Need at least two online users')
+
+    clients = {}
+    connect_ms = []
+    for uid in online_ids:
+        start = time.perf_counter()
+        client = socketio.test_client(app, auth={'token': tokens[uid]})
+        connect_ms.append((time.perf_counter() - start) * 1000)
+        client.get_received()
+        clients[uid] = client
+
+    content = 'x' * content_size
+    ack_ms, deliver_ms, errors = [], [], 0
+    offline_sent = 0
+
+    start_all = time.perf_counter()
+    for _ in range(messages):
+        sender = rng.choice(online_ids)
+        if offline_ids and rng.random() < offline_ratio:
+            recipient = rng.choice(offline_ids)
+        else:
+            recipient = rng.choice([uid for uid in online_ids if uid != sender])
+
+        start = time.perf_counter()
+        clients[sender].emit('send_message', {'to_user_id': recipient, 'content': content})
+        received = _wait_for(clients[sender], 'message_sent')
+        ack_ms.append((time.perf_counter() - start) * 1000)
+
+        if any(item['name'] == 'error' for item in received):
+            errors += 1
+            continue
+
+        if recipient in clients:
+            _wait_for(clients[recipient], 'new_message')
+            deliver_ms.append((time.perf_counter() - start) * 1000)
+        else:
+            offline_sent += 1
+    send_seconds = time.perf_counter() - start_all
+
+    # Offline flush: reconnect every offline user and time the handshake, which drains the queue
+    flush_ms, flushed = [], 0
+    for uid in offline_ids:
+        start = time.perf_counter()
+        client = socketio.test_client(app, auth={'token': tokens[uid]})
+        received = client.get_received()
+        flush_ms.append((time.perf_counter() - start) * 1000)
+        flushed += sum(len(item['args'][0]['messages']) for item in received
+                       if item['name'] == 'new_messages')
+        clients[uid] = client
+
+    # Inbox listing
+    http = app.test_client()
+    list_ms = []
+    for uid in user_ids:
+        start = time.perf_counter()
+        response = http.get('/api/conversations', headers={'Authorization': f'Bearer {tokens[uid]}'})
+        list_ms.append((time.perf_counter() - start) * 1000)
+        if response.status_code != 200:
+            errors += 1
+
+    for client in clients.values():
+        client.disconnect()
+
+    return {
+        'benchmark': 'load_test',
+        'database': app.config['SQLALCHEMY_DATABASE_URI'].split('://')[0],
+        'write_behind': bool(app.config.get('WRITE_BEHIND_ENABLED')),
+        'params': {
+            'users': users,
+            'messages': messages,
+            'offline_ratio': offline_ratio,
+            'content_size': content_size,
+            'seed': seed,
+        },
+        'throughput_msgs_per_sec': round(messages / send_seconds, 1),
+        'errors': errors,
+        'connect': summarize(connect_ms),
+        'send_to_message_sent': summarize(ack_ms),
+        'send_to_new_message': summarize(deliver_ms),
+        'offline_flush': dict(summarize(flush_ms), queued=offline_sent, delivered=flushed),
+        'conversations_list': summarize(list_ms),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--offline-ratio', type=float, default=0.2,
+                        help='share of users kept offline while messages are sent')
+    parser.add_argument('--content-size', type=int, default=64)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='write the JSON report to this file')
+    args = parser.parse_args()
+
+    write_report(run(args.users, args.messages, args.offline_ratio, args.content_size, args.seed), args.output)
@@ -7,11 +7,125 @@ class Config:
     SECRET_KEY = os.getenv('SECRET_KEY', 'fallback-secret')
     EXPIRES_IN_HOURS = int(os.getenv('EXPIRES_IN_HOURS', 24))
 
+    # Verified-token cache (0 disables it)
+    TOKEN_CACHE_SIZE = int(os.getenv('TOKEN_CACHE_SIZE', 10000))
+    TOKEN_CACHE_TTL = int(os.getenv('TOKEN_CACHE_TTL', 300))
+
     DB_USER = os.getenv('DB_USER', 'chatuser')
     DB_PASSWORD = os.getenv('DB_PASSWORD', 'chatpassword')
     DB_HOST = os.getenv('DB_HOST', 'localhost')
     DB_PORT = os.getenv('DB_PORT', '5432')
     DB_NAME = os.getenv('DB_NAME', 'realtime_chat')
     
-    SQLALCHEMY_DATABASE_URI = f'postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}'
-    SQLALCHEMY_TRACK_MODIFICATIONS = False
\ No newline at end of file
+    SQLALCHEMY_DATABASE_URI = os.getenv(
+        'DATABASE_URL', f'postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}'
+    )
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+    # Connection pool of the primary and each replica (utils/pool.py); 0 disables the statement timeout
+    DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 10))
+    DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 10))
+    DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 10))
+    DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', 'true').lower() == 'true'
+    DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', 1800))
+    DB_STATEMENT_TIMEOUT_MS = int(os.getenv('DB_STATEMENT_TIMEOUT_MS', 15000))
+    DB_QUERY_CACHE_SIZE = int(os.getenv('DB_QUERY_CACHE_SIZE', 1000))
+
+    # Read replicas (comma separated URLs) for the list, history and search endpoints; binds replica_0, replica_1, ...
+    DATABASE_REPLICA_URLS = [url.strip() for url in os.getenv('DATABASE_REPLICA_URLS', '').split(',') if url.strip()]
+    SQLALCHEMY_BINDS = {f'replica_{i}': url for i, url in enumerate(DATABASE_REPLICA_URLS)}
+    REPLICA_MAX_LAG_SECONDS = float(os.getenv('REPLICA_MAX_LAG_SECONDS', 2))
+    REPLICA_LAG_CHECK_SECONDS = float(os.getenv('REPLICA_LAG_CHECK_SECONDS', 1))
+    # A user's reads stay on the primary this long after they write
+    READ_YOUR_WRITES_SECONDS = float(os.getenv('READ_YOUR_WRITES_SECONDS', 5))
+
+    # Create tables and apply pending migrations in create_app
+    AUTO_MIGRATE = os.getenv('AUTO_MIGRATE', 'true').lower() == 'true'
+
+    # Structured logging
+    LOG_LEVEL = os.getenv('LOG_LEVEL', 'info')
+    LOG_FORMAT = os.getenv('LOG_FORMAT', 'json')  # json or text
+    # Per-event sampling, e.g. "message_sent=0.01,message_delivered=0.01"
+    LOG_SAMPLE_RATES = os.getenv('LOG_SAMPLE_RATES', '')
+    # Include the first 50 characters of message content in message events
+    LOG_MESSAGE_CONTENT = os.getenv('LOG_MESSAGE_CONTENT', 'false').lower() == 'true'
+
+    # Prometheus metrics at /metrics (off by default; the endpoint is unauthenticated)
+    METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'false').lower() == 'true'
+
+    # Cluster routing: 'local' (single node) or 'redis'
+    BUS_BACKEND = os.getenv('BUS_BACKEND', 'local')
+    REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379')
+    NODE_ID = os.getenv('NODE_ID')
+    # Redis nodes refresh a heartbeat; presence of a node silent for NODE_TIMEOUT_SECONDS is ignored, then removed
+    NODE_HEARTBEAT_SECONDS = float(os.getenv('NODE_HEARTBEAT_SECONDS', 10))
+    NODE_TIMEOUT_SECONDS = float(os.getenv('NODE_TIMEOUT_SECONDS', 30))
+
+    # (user1_id, user2_id) -> conversation_id cache
+    CONVERSATION_CACHE_SIZE = int(os.getenv('CONVERSATION_CACHE_SIZE', 100000))
+
+    # Message history
+    MESSAGE_COUNT_CACHE_SIZE = int(os.getenv('MESSAGE_COUNT_CACHE_SIZE', 10000))
+    MESSAGE_COUNT_CACHE_TTL = int(os.getenv('MESSAGE_COUNT_CACHE_TTL', 300))
+
+    # Group conversations; member lists are cached per node for GROUP_MEMBER_CACHE_TTL seconds
+    GROUP_MAX_MEMBERS = int(os.getenv('GROUP_MAX_MEMBERS', 256))
+    GROUP_MEMBER_CACHE_SIZE = int(os.getenv('GROUP_MEMBER_CACHE_SIZE', 10000))
+    GROUP_MEMBER_CACHE_TTL = int(os.getenv('GROUP_MEMBER_CACHE_TTL', 30))
+
+    # Typing indicators and presence: per-connection throttle, batching window, last-seen writes
+    TYPING_THROTTLE_MS = int(os.getenv('TYPING_THROTTLE_MS', 2000))
+    TYPING_MAX_TARGETS = int(os.getenv('TYPING_MAX_TARGETS', 50))
+    PRESENCE_FLUSH_INTERVAL_MS = int(os.getenv('PRESENCE_FLUSH_INTERVAL_MS', 250))
+    PRESENCE_MAX_SUBSCRIPTIONS = int(os.getenv('PRESENCE_MAX_SUBSCRIPTIONS', 500))
+    LAST_SEEN_FLUSH_INTERVAL = int(os.getenv('LAST_SEEN_FLUSH_INTERVAL', 30))
+
+    # send_message limits: token buckets per user (shared via RATE_LIMIT_BACKEND) and per connection
+    RATE_LIMIT_ENABLED = os.getenv('RATE_LIMIT_ENABLED', 'true').lower() == 'true'
+    RATE_LIMIT_BACKEND = os.getenv('RATE_LIMIT_BACKEND', 'memory')  # memory or redis
+    RATE_LIMIT_USER_RATE = float(os.getenv('RATE_LIMIT_USER_RATE', 10))  # tokens per second
+    RATE_LIMIT_USER_BURST = int(os.getenv('RATE_LIMIT_USER_BURST', 30))
+    RATE_LIMIT_CONNECTION_RATE = float(os.getenv('RATE_LIMIT_CONNECTION_RATE', 5))
+    RATE_LIMIT_CONNECTION_BURST = int(os.getenv('RATE_LIMIT_CONNECTION_BURST', 20))
+    MAX_MESSAGE_LENGTH = int(os.getenv('MAX_MESSAGE_LENGTH', 4000))
+
+    # Bulk sends (send_messages, /api/messages/bulk): messages per call, and a per-user bucket in messages
+    BULK_MAX_MESSAGES = int(os.getenv('BULK_MAX_MESSAGES', 1000))
+    RATE_LIMIT_BULK_RATE = float(os.getenv('RATE_LIMIT_BULK_RATE', 200))
+    RATE_LIMIT_BULK_BURST = int(os.getenv('RATE_LIMIT_BULK_BURST', 5000))
+    # Users allowed to import history over the API ("import": true); empty = import_messages.py only
+    BULK_IMPORT_USER_IDS = {int(uid) for uid in os.getenv('BULK_IMPORT_USER_IDS', '').split(',') if uid.strip()}
+
+    # Archival of cold history (archive.py); readers cache archive bounds and decoded chunks
+    ARCHIVE_AFTER_DAYS = int(os.getenv('ARCHIVE_AFTER_DAYS', 180))
+    ARCHIVE_CHUNK_SIZE = int(os.getenv('ARCHIVE_CHUNK_SIZE', 500))
+    ARCHIVE_BOUNDS_CACHE_TTL = int(os.getenv('ARCHIVE_BOUNDS_CACHE_TTL', 60))
+    ARCHIVE_CHUNK_CACHE_SIZE = int(os.getenv('ARCHIVE_CHUNK_CACHE_SIZE', 256))
+
+    # /api/messages/search
+    SEARCH_MAX_QUERY_LENGTH = int(os.getenv('SEARCH_MAX_QUERY_LENGTH', 200))
+
+    # Delta sync (/api/sync and the `sync` socket event); archive.py prunes the change log
+    SYNC_PAGE_SIZE = int(os.getenv('SYNC_PAGE_SIZE', 500))
+    SYNC_SETTLE_SECONDS = float(os.getenv('SYNC_SETTLE_SECONDS', 5))
+    SYNC_RETENTION_DAYS = int(os.getenv('SYNC_RETENTION_DAYS', 30))
+
+    # Serialized bodies of conditional GETs (/api/conversations, /api/messages); 0 disables the cache
+    RESPONSE_CACHE_SIZE = int(os.getenv('RESPONSE_CACHE_SIZE', 2048))
+
+    # Offline queue flush on connect
+    OFFLINE_FLUSH_CHUNK_SIZE = int(os.getenv('OFFLINE_FLUSH_CHUNK_SIZE', 200))
+
+    # Acknowledged 1:1 delivery: resend unacknowledged events, write acks in batches
+    ACK_TIMEOUT_SECONDS = float(os.getenv('ACK_TIMEOUT_SECONDS', 10))
+    ACK_MAX_ATTEMPTS = int(os.getenv('ACK_MAX_ATTEMPTS', 3))
+    ACK_FLUSH_INTERVAL_MS = int(os.getenv('ACK_FLUSH_INTERVAL_MS', 200))
+    # How long an ack waits for its message row to be committed (write-behind)
+    ACK_PERSIST_TIMEOUT_SECONDS = float(os.getenv('ACK_PERSIST_TIMEOUT_SECONDS', 30))
+
+    # Write-behind message persistence (group commit)
+    WRITE_BEHIND_ENABLED = os.getenv('WRITE_BEHIND_ENABLED', 'false').lower() == 'true'
+    WRITE_BEHIND_BATCH_SIZE = int(os.getenv('WRITE_BEHIND_BATCH_SIZE', 500))
+    WRITE_BEHIND_FLUSH_INTERVAL_MS = int(os.getenv('WRITE_BEHIND_FLUSH_INTERVAL_MS', 20))
+    WRITE_BEHIND_MAX_QUEUE = int(os.getenv('WRITE_BEHIND_MAX_QUEUE', 10000))
+    WRITE_BEHIND_ENQUEUE_TIMEOUT_MS = int(os.getenv('WRITE_BEHIND_ENQUEUE_TIMEOUT_MS', 100))
\ No newline at end of file
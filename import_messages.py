@@ -0,0 +1,70 @@
+"""
+Import message history from a JSON Lines file, one message per line:
+
+    {"sender_id": 1, "to_user_id": 2, "content": "hi", "sent_at": "2019-05-01T10:00:00"}
+    {"sender_id": 1, "conversation_id": 7, "content": "hello group", "sent_at": "2019-05-01T10:01:00"}
+
+    python import_messages.py history.jsonl
+    python import_messages.py history.jsonl --batch-size 10000
+
+Lines are validated like POST /api/messages/bulk with import=true and each
+batch is written in one transaction (COPY on PostgreSQL). Imported messages
+are stored delivered and read; rate limits do not apply.
+"""
+import argparse
+import json
+from itertools import islice
+
+from app import create_app
+from config import Config
+from utils.bulk import validate_bulk
+from utils.database import import_messages
+
+parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+parser.add_argument('path')
+parser.add_argument('--batch-size', type=int, default=5000)
+args = parser.parse_args()
+
+app = create_app()
+
+with app.app_context(), open(args.path) as source:
+    print(f"\n📥 Importing messages from {args.path}...")
+    imported, rejected, line_number = 0, 0, 0
+
+    lines = enumerate(source, start=1)
+    while True:
+        batch = list(islice(lines, args.batch_size))
+        if not batch:
+            break
+
+        # sender_id -> [(line number, item)]
+        by_sender: dict[int, list] = {}
+        for line_number, line in batch:
+            if not line.strip():
+                continue
+            try:
+                item = json.loads(line)
+            except ValueError:
+                item = None
+            sender_id = item.get('sender_id') if isinstance(item, dict) else None
+            if not isinstance(sender_id, int):
+                rejected += 1
+                print(f"  ❌ line {line_number}: missing sender_id or invalid JSON")
+                continue
+            by_sender.setdefault(sender_id, []).append((line_number, item))
+
+        rows = []
+        for sender_id, entries in by_sender.items():
+            accepted, errors = validate_bulk(sender_id, [item for _, item in entries],
+                                             Config.MAX_MESSAGE_LENGTH, allow_sent_at=True)
+            for error in errors:
+                print(f"  ❌ line {entries[error['index']][0]}: {error['error']}")
+            rejected += len(errors)
+            rows.extend({'conversation_id': item['conversation_id'], 'sender_id': sender_id,
+                         'content': item['content'], 'sent_at': item['sent_at']} for item in accepted)
+
+        import_messages(rows)
+        imported += len(rows)
+        print(f"  ✅ {imported} messages imported (line {line_number})")
+
+    print(f"\n✅ Imported {imported} messages, rejected {rejected}")
@@ -0,0 +1,46 @@
+"""
+Apply pending schema migrations, show their status, or check that the
+planner uses the indexes they add.
+
+    python migrate.py            # apply pending migrations
+    python migrate.py status     # list migrations and whether they are applied
+    python migrate.py verify     # EXPLAIN-based index checks (exit 1 on failure)
+"""
+import sys
+from app import create_app
+from migrations import upgrade_database, migration_status, verify_migrations
+
+command = sys.argv[1] if len(sys.argv) > 1 else 'upgrade'
+
+app = create_app()
+
+with app.app_context():
+    if command == 'upgrade':
+        applied = upgrade_database()
+        if applied:
+            print(f"\n✅ Applied migrations: {', '.join(applied)}")
+        else:
+            print("\n✅ Database is up to date")
+
+    elif command == 'status':
+        print("\n📋 Migrations:")
+        for migration in migration_status():
+            mark = '✅' if migration['applied'] else '⏳'
+            print(f"  {mark} {migration['version']} - {migration['description']}")
+
+    elif command == 'verify':
+        results = verify_migrations()
+        failed = [r for r in results if not r['used']]
+        for result in results:
+            mark = '✅' if result['used'] else '❌'
+            print(f"  {mark} {result['version']} {result['index']}")
+            if not result['used']:
+                print('     plan: ' + result['plan'].replace('\n', '\n           '))
+        if failed:
+            print(f"\n❌ {len(failed)} of {len(results)} index checks failed")
+            sys.exit(1)
+        print(f"\n✅ All {len(results)} index checks passed")
+
+    else:
+        print(__doc__)
+        sys.exit(2)
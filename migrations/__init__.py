@@ -0,0 +1,127 @@
+"""
+Schema migrations.
+
+Each module in migrations/versions defines:
+    VERSION        - sortable id, e.g. '0001'
+    DESCRIPTION    - one line summary
+    upgrade(conn)  - idempotent DDL/DML run inside a transaction
+    EXPLAIN_CHECKS - list of (sql, index_name) pairs; the planner must use
+                     index_name for sql once the migration is applied
+
+Fresh databases are built with db.create_all() from the models and stamped
+with every version. Existing databases get each pending upgrade() applied in
+order and recorded in the schema_migrations table.
+"""
+import importlib
+import pkgutil
+from datetime import datetime
+
+from sqlalchemy import inspect, text
+
+from models import db
+from utils.log import log_event
+
+schema_migrations = db.Table(
+    'schema_migrations',
+    db.Column('version', db.String(32), primary_key=True),
+    db.Column('description', db.String(255)),
+    db.Column('applied_at', db.DateTime, default=datetime.utcnow),
+)
+
+
+def load_migrations() -> list:
+    """Import every migration module, ordered by VERSION"""
+    from migrations import versions
+
+    modules = [
+        importlib.import_module(f'{versions.__name__}.{info.name}')
+        for info in pkgutil.iter_modules(versions.__path__)
+    ]
+    return sorted(modules, key=lambda module: module.VERSION)
+
+
+def applied_versions(conn) -> set[str]:
+    return set(conn.execute(db.select(schema_migrations.c.version)).scalars())
+
+
+def _stamp(conn, migration):
+    conn.execute(schema_migrations.insert().values(
+        version=migration.VERSION,
+        description=migration.DESCRIPTION,
+        applied_at=datetime.utcnow()
+    ))
+
+
+def upgrade_database(engine=None) -> list[str]:
+    """
+    Bring the database up to date. Returns the versions applied by this call.
+    Must run inside an app context when engine is not given.
+    """
+    engine = engine or db.engine
+    fresh = not inspect(engine).has_table('messages')
+
+    # Creates missing tables (with their indexes); never alters existing ones
+    db.metadata.create_all(engine)
+
+    applied = []
+    with engine.begin() as conn:
+        done = applied_versions(conn)
+        for migration in load_migrations():
+            if migration.VERSION in done:
+                continue
+            if not fresh:
+                migration.upgrade(conn)
+                log_event('migration_applied', version=migration.VERSION, description=migration.DESCRIPTION)
+            _stamp(conn, migration)
+            applied.append(migration.VERSION)
+    return applied
+
+
+def migration_status(engine=None) -> list[dict]:
+    engine = engine or db.engine
+    done = set()
+    if inspect(engine).has_table('schema_migrations'):
+        with engine.connect() as conn:
+            done = applied_versions(conn)
+    return [
+        {'version': m.VERSION, 'description': m.DESCRIPTION, 'applied': m.VERSION in done}
+        for m in load_migrations()
+    ]
+
+
+def explain(conn, sql: str) -> str:
+    """Get the query plan for `sql` as text"""
+    if conn.dialect.name == 'postgresql':
+        rows = conn.execute(text(f'EXPLAIN {sql}')).scalars().all()
+        return '\n'.join(rows)
+    if conn.dialect.name == 'sqlite':
+        rows = conn.execute(text(f'EXPLAIN QUERY PLAN {sql}')).all()
+        return '\n'.join(str(row[-1]) for row in rows)
+    raise RuntimeError(f'EXPLAIN checks are not supported on {conn.dialect.name}')
+
+
+def verify_migrations(engine=None) -> list[dict]:
+    """
+    Run every EXPLAIN check and report whether the planner picked the
+    expected index. On PostgreSQL sequential scans are disabled for the
+    check so that small test tables still exercise the index.
+    """
+    engine = engine or db.engine
+    results = []
+    with engine.connect() as conn:
+        trans = conn.begin()
+        try:
+            if conn.dialect.name == 'postgresql':
+                conn.execute(text('SET LOCAL enable_seqscan = off'))
+            for migration in load_migrations():
+                for sql, index_name in getattr(migration, 'EXPLAIN_CHECKS', ()):
+                    plan = explain(conn, sql)
+                    results.append({
+                        'version': migration.VERSION,
+                        'index': index_name,
+                        'used': index_name in plan,
+                        'plan': plan,
+                    })
+        finally:
+            trans.rollback()
+    return results
@@ -0,0 +1,61 @@
+"""
+Idempotent DDL helpers shared by the migration modules.
+"""
+import re
+
+from sqlalchemy import inspect, text
+
+
+def has_column(conn, table: str, column: str) -> bool:
+    return any(col['name'] == column for col in inspect(conn).get_columns(table))
+
+
+def add_column(conn, table: str, column: str, ddl: str) -> bool:
+    """Add a column unless it exists. Returns True if it was added."""
+    if has_column(conn, table, column):
+        return False
+    conn.execute(text(f'ALTER TABLE {table} ADD COLUMN {column} {ddl}'))
+    return True
+
+
+def create_index(conn, name: str, table: str, columns: str, where: str = None):
+    """CREATE INDEX IF NOT EXISTS, optionally partial"""
+    sql = f'CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})'
+    if where:
+        sql += f' WHERE {where}'
+    conn.execute(text(sql))
+
+
+def drop_not_null(conn, table: str, columns: list[str]) -> bool:
+    """
+    Make columns nullable. Returns True if anything changed.
+    SQLite cannot alter a column, so the table is rebuilt from its own
+    CREATE TABLE statement (create copy, move rows, drop, rename, re-index).
+    """
+    required = [col['name'] for col in inspect(conn).get_columns(table)
+                if col['name'] in columns and not col['nullable']]
+    if not required:
+        return False
+
+    if conn.dialect.name != 'sqlite':
+        for column in required:
+            conn.execute(text(f'ALTER TABLE {table} ALTER COLUMN {column} DROP NOT NULL'))
+        return True
+
+    ddl = conn.execute(text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :t"),
+                       {'t': table}).scalar_one()
+    index_ddl = conn.execute(text("SELECT sql FROM sqlite_master WHERE type = 'index' "
+                                  "AND tbl_name = :t AND sql IS NOT NULL"),
+                             {'t': table}).scalars().all()
+    for column in required:
+        ddl = re.sub(rf'(\b"?{column}"?\s+\w+(?:\([^)]*\))?)\s+NOT NULL', r'\1', ddl)
+
+    rebuilt = f'_{table}_rebuild'
+    names = ', '.join(col['name'] for col in inspect(conn).get_columns(table))
+    conn.execute(text(re.sub(rf'^CREATE TABLE\s+"?{table}"?', f'CREATE TABLE {rebuilt}', ddl)))
+    conn.execute(text(f'INSERT INTO {rebuilt} ({names}) SELECT {names} FROM {table}'))
+    conn.execute(text(f'DROP TABLE {table}'))
+    conn.execute(text(f'ALTER TABLE {rebuilt} RENAME TO {table}'))
+    for sql in index_ddl:
+        conn.execute(text(sql))
+    return True
@@ -0,0 +1,3 @@
+"""
+Migration modules, applied in VERSION order.
+"""
@@ -0,0 +1,43 @@
+"""
+Denormalized inbox state on conversations: last message pointer and
+per-participant unread counters, backfilled from messages.
+"""
+from sqlalchemy import text
+
+from migrations.helpers import add_column
+
+VERSION = '0001'
+DESCRIPTION = 'conversations.last_message_id and unread counters'
+
+EXPLAIN_CHECKS = []
+
+
+def upgrade(conn):
+    added = add_column(conn, 'conversations', 'last_message_id', 'INTEGER REFERENCES messages(id)')
+    add_column(conn, 'conversations', 'user1_unread_count', 'INTEGER NOT NULL DEFAULT 0')
+    add_column(conn, 'conversations', 'user2_unread_count', 'INTEGER NOT NULL DEFAULT 0')
+
+    if not added:
+        return
+
+    conn.execute(text("""
+        UPDATE conversations SET
+            last_message_id = (
+                SELECT m.id FROM messages m
+                WHERE m.conversation_id = conversations.id
+                ORDER BY m.sent_at DESC, m.id DESC
+                LIMIT 1
+            ),
+            user1_unread_count = (
+                SELECT COUNT(*) FROM messages m
+                WHERE m.conversation_id = conversations.id
+                  AND m.sender_id != conversations.user1_id
+                  AND m.read_at IS NULL
+            ),
+            user2_unread_count = (
+                SELECT COUNT(*) FROM messages m
+                WHERE m.conversation_id = conversations.id
+                  AND m.sender_id != conversations.user2_id
+                  AND m.read_at IS NULL
+            )
+    """))
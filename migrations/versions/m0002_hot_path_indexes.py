@@ -0,0 +1,33 @@
+"""
+Secondary indexes for message history, the offline queue, read receipts
+and inbox listing.
+"""
+from migrations.helpers import create_index
+
+VERSION = '0002'
+DESCRIPTION = 'indexes for history, undelivered, unread and inbox queries'
+
+EXPLAIN_CHECKS = [
+    ("SELECT id FROM messages WHERE conversation_id = 1 "
+     "ORDER BY sent_at DESC, id DESC LIMIT 51",
+     'ix_messages_conversation_sent'),
+    ("SELECT id FROM messages WHERE conversation_id IN (1, 2) AND sender_id != 1 "
+     "AND delivered_at IS NULL ORDER BY sent_at, id LIMIT 200",
+     'ix_messages_undelivered'),
+    ("SELECT MAX(id) FROM messages WHERE conversation_id = 1 AND sender_id != 1 "
+     "AND read_at IS NULL",
+     'ix_messages_unread'),
+    ("SELECT id FROM conversations WHERE user2_id = 1 "
+     "ORDER BY updated_at DESC, id DESC LIMIT 51",
+     'ix_conversations_user2_updated'),
+]
+
+
+def upgrade(conn):
+    create_index(conn, 'ix_messages_conversation_sent', 'messages', 'conversation_id, sent_at, id')
+    create_index(conn, 'ix_messages_undelivered', 'messages', 'conversation_id, sent_at, id',
+                 where='delivered_at IS NULL')
+    create_index(conn, 'ix_messages_unread', 'messages', 'conversation_id, id',
+                 where='read_at IS NULL')
+    create_index(conn, 'ix_conversations_user1_updated', 'conversations', 'user1_id, updated_at, id')
+    create_index(conn, 'ix_conversations_user2_updated', 'conversations', 'user2_id, updated_at, id')
@@ -0,0 +1,24 @@
+"""
+Group conversations: conversations.is_group / name, nullable participant
+columns for groups, and the conversation_members table (created from the
+model) holding per-member delivered / read watermarks.
+"""
+from migrations.helpers import add_column, create_index, drop_not_null
+
+VERSION = '0003'
+DESCRIPTION = 'group conversations and conversation_members'
+
+EXPLAIN_CHECKS = [
+    ("SELECT conversation_id FROM conversation_members WHERE user_id = 1",
+     'ix_conversation_members_user'),
+    ("SELECT id FROM messages WHERE conversation_id = 1 AND id > 10 AND read_at IS NULL "
+     "ORDER BY id LIMIT 200",
+     'ix_messages_unread'),
+]
+
+
+def upgrade(conn):
+    add_column(conn, 'conversations', 'is_group', 'BOOLEAN NOT NULL DEFAULT FALSE')
+    add_column(conn, 'conversations', 'name', 'VARCHAR(100)')
+    drop_not_null(conn, 'conversations', ['user1_id', 'user2_id'])
+    create_index(conn, 'ix_conversation_members_user', 'conversation_members', 'user_id, conversation_id')
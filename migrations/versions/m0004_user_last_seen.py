@@ -0,0 +1,13 @@
+"""
+users.last_seen_at, written in batches by the presence broadcaster.
+"""
+from migrations.helpers import add_column
+
+VERSION = '0004'
+DESCRIPTION = 'users.last_seen_at'
+
+EXPLAIN_CHECKS = []
+
+
+def upgrade(conn):
+    add_column(conn, 'users', 'last_seen_at', 'TIMESTAMP')
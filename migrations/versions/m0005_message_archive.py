@@ -0,0 +1,19 @@
+"""
+messages_archive: compressed monthly chunks of cold history (the table
+itself is created from the model).
+"""
+from migrations.helpers import create_index
+
+VERSION = '0005'
+DESCRIPTION = 'messages_archive for cold history'
+
+EXPLAIN_CHECKS = [
+    ("SELECT id FROM messages_archive WHERE conversation_id = 1 "
+     "ORDER BY last_sent_at DESC, last_message_id DESC",
+     'ix_messages_archive_conversation'),
+]
+
+
+def upgrade(conn):
+    create_index(conn, 'ix_messages_archive_conversation', 'messages_archive',
+                 'conversation_id, last_sent_at, last_message_id')
@@ -0,0 +1,25 @@
+"""
+Full-text search index over messages.content: a GIN expression index on
+PostgreSQL, an FTS5 table backfilled from the hot messages on SQLite.
+"""
+from sqlalchemy import text
+
+VERSION = '0006'
+DESCRIPTION = 'full-text search index on messages'
+
+# The FTS5 table is not a regular index and the GIN index only exists on PostgreSQL
+EXPLAIN_CHECKS = []
+
+
+def upgrade(conn):
+    if conn.dialect.name == 'postgresql':
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_messages_search ON messages "
+                          "USING gin (to_tsvector('simple', content))"))
+        return
+
+    if conn.dialect.name == 'sqlite':
+        conn.execute(text('CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts '
+                          'USING fts5(content, conversation_id UNINDEXED)'))
+        conn.execute(text('INSERT INTO messages_fts (rowid, content, conversation_id) '
+                          'SELECT id, content, conversation_id FROM messages '
+                          'WHERE id NOT IN (SELECT rowid FROM messages_fts)'))
@@ -0,0 +1,18 @@
+"""
+changes: the append-only log behind delta sync (the table itself is
+created from the model).
+"""
+from migrations.helpers import create_index
+
+VERSION = '0007'
+DESCRIPTION = 'changes log for delta sync'
+
+EXPLAIN_CHECKS = [
+    ("SELECT seq FROM changes WHERE conversation_id = 1 AND seq > 100 ORDER BY seq",
+     'ix_changes_conversation_seq'),
+]
+
+
+def upgrade(conn):
+    create_index(conn, 'ix_changes_conversation_seq', 'changes', 'conversation_id, seq')
+    create_index(conn, 'ix_changes_member_removed', 'changes', 'user_id, seq', where="kind = 'member_removed'")
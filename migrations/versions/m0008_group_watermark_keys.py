@@ -0,0 +1,28 @@
+"""
+Group watermarks on the (sent_at, id) key: conversation_members gets the
+sent_at of each watermark message. Existing watermarks take it from their
+message, or from the newest archived message of the group when the archive
+job has already moved that message out of `messages`.
+"""
+from sqlalchemy import text
+
+from migrations.helpers import add_column
+
+VERSION = '0008'
+DESCRIPTION = 'conversation_members watermark sent_at'
+
+EXPLAIN_CHECKS = []
+
+
+def upgrade(conn):
+    for watermark in ('delivered', 'read'):
+        add_column(conn, 'conversation_members', f'last_{watermark}_sent_at', 'TIMESTAMP')
+        conn.execute(text(f"""
+            UPDATE conversation_members SET last_{watermark}_sent_at = COALESCE(
+                (SELECT messages.sent_at FROM messages
+                 WHERE messages.id = conversation_members.last_{watermark}_message_id),
+                (SELECT MAX(messages_archive.last_sent_at) FROM messages_archive
+                 WHERE messages_archive.conversation_id = conversation_members.conversation_id)
+            )
+            WHERE last_{watermark}_message_id IS NOT NULL AND last_{watermark}_sent_at IS NULL
+        """))
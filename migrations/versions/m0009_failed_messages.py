@@ -0,0 +1,12 @@
+"""
+failed_messages: dead letters of the write-behind writer (the table itself
+is created from the model and needs no index).
+"""
+VERSION = '0009'
+DESCRIPTION = 'failed_messages for write-behind dead letters'
+
+EXPLAIN_CHECKS = []
+
+
+def upgrade(conn):
+    pass
@@ -0,0 +1,25 @@
+"""
+Read receipts on the (sent_at, id) key: changes gets the sent_at of the
+message a receipt goes up to, and ix_messages_unread is rebuilt on
+(conversation_id, sent_at, id) so the newest unread message is found in
+key order.
+"""
+from sqlalchemy import text
+
+from migrations.helpers import add_column, create_index
+
+VERSION = '0010'
+DESCRIPTION = 'changes.sent_at, ix_messages_unread on (sent_at, id)'
+
+EXPLAIN_CHECKS = [
+    ("SELECT sent_at, id FROM messages WHERE conversation_id = 1 AND sender_id != 1 "
+     "AND read_at IS NULL ORDER BY sent_at DESC, id DESC LIMIT 1",
+     'ix_messages_unread'),
+]
+
+
+def upgrade(conn):
+    add_column(conn, 'changes', 'sent_at', 'TIMESTAMP')
+    conn.execute(text('DROP INDEX IF EXISTS ix_messages_unread'))
+    create_index(conn, 'ix_messages_unread', 'messages', 'conversation_id, sent_at, id',
+                 where='read_at IS NULL')
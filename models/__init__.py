@@ -5,5 +5,10 @@ from models.database import db
 from models.participant import User
 from models.conversation import Conversation
 from models.message import Message
+from models.member import ConversationMember
+from models.archive import MessageArchive
+from models.change import Change
+from models.failed import FailedMessage
+from models.rows import MessageRow, ConversationRow
 
-__all__ = ['db', 'User', 'Conversation', 'Message']
\ No newline at end of file
+__all__ = ['db', 'User', 'Conversation', 'Message', 'ConversationMember', 'MessageArchive', 'Change', 'FailedMessage', 'MessageRow', 'ConversationRow']
\ No newline at end of file
@@ -0,0 +1,32 @@
+from models.database import db
+from datetime import datetime
+
+class MessageArchive(db.Model):
+    """
+    Cold message history. Each row is a zlib-compressed chunk of one
+    conversation's messages from one month, moved out of `messages` by the
+    archive job (archive.py).
+    """
+    __tablename__ = 'messages_archive'
+
+    id = db.Column(db.Integer, primary_key=True)
+    conversation_id = db.Column(db.Integer, db.ForeignKey('conversations.id'), nullable=False)
+    period = db.Column(db.String(7), nullable=False)  # YYYY-MM of sent_at
+    message_count = db.Column(db.Integer, nullable=False)
+
+    # Key range covered by the chunk, on the same (sent_at, id) key as history cursors
+    first_sent_at = db.Column(db.DateTime, nullable=False)
+    first_message_id = db.Column(db.Integer, nullable=False)
+    last_sent_at = db.Column(db.DateTime, nullable=False)
+    last_message_id = db.Column(db.Integer, nullable=False)
+
+    payload = db.Column(db.LargeBinary, nullable=False)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        # Scrolling back: newest chunks of a conversation first
+        db.Index('ix_messages_archive_conversation', 'conversation_id', 'last_sent_at', 'last_message_id'),
+    )
+
+    def __repr__(self):
+        return f'<MessageArchive {self.id}: conversation {self.conversation_id} {self.period} ({self.message_count})>'
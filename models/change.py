@@ -0,0 +1,40 @@
+from models.database import db
+from datetime import datetime
+
+# Kinds of change recorded in the log
+CHANGE_KINDS = ('message', 'delivered', 'read', 'member_added', 'member_removed', 'history')
+
+class Change(db.Model):
+    """
+    Append-only change log read by /api/sync. `seq` is the sync cursor.
+    Entries are per conversation, not per recipient, so a group message is
+    one row however many members the group has.
+    """
+    __tablename__ = 'changes'
+
+    seq = db.Column(db.Integer, primary_key=True)
+    conversation_id = db.Column(db.Integer, db.ForeignKey('conversations.id'), nullable=False)
+    kind = db.Column(db.String(16), nullable=False)
+    # Reader for `read`, the member for member_added / member_removed
+    user_id = db.Column(db.Integer, nullable=True)
+    # The new message, the newest message covered by a receipt, or the highest
+    # imported id for `history` (no FK: messages get archived)
+    message_id = db.Column(db.Integer, nullable=True)
+    # sent_at of message_id for messages and receipts: receipts cover everything
+    # up to (sent_at, message_id), since ids are not in send order under write-behind
+    sent_at = db.Column(db.DateTime, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    __table_args__ = (
+        # Sync: a user's conversations probed one by one past the cursor
+        db.Index('ix_changes_conversation_seq', 'conversation_id', 'seq'),
+        # Sync: removals from groups the user can no longer see
+        db.Index('ix_changes_member_removed', 'user_id', 'seq',
+                 postgresql_where=db.text("kind = 'member_removed'"),
+                 sqlite_where=db.text("kind = 'member_removed'")),
+        # Never reuse a seq on SQLite, even once the log has been pruned empty
+        {'sqlite_autoincrement': True},
+    )
+
+    def __repr__(self):
+        return f'<Change {self.seq}: {self.kind} in conversation {self.conversation_id}>'
@@ -5,21 +5,57 @@ class Conversation(db.Model):
     __tablename__ = 'conversations'
     
     id = db.Column(db.Integer, primary_key=True)
-    user1_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
-    user2_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    # Participants of a 1:1 conversation; NULL for groups, which use conversation_members
+    user1_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
+    user2_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
+    is_group = db.Column(db.Boolean, nullable=False, default=False, server_default=db.false())
+    name = db.Column(db.String(100), nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    # Denormalized inbox state, maintained by save_message / mark_messages_as_read
+    last_message_id = db.Column(
+        db.Integer,
+        db.ForeignKey('messages.id', use_alter=True, name='fk_conversation_last_message'),
+        nullable=True
+    )
+    user1_unread_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    user2_unread_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     
     # Relationships
-    messages = db.relationship('Message', backref='conversation', lazy=True, cascade='all, delete-orphan')
+    messages = db.relationship('Message', backref='conversation', lazy=True, cascade='all, delete-orphan',
+                               foreign_keys='Message.conversation_id')
     user1 = db.relationship('User', foreign_keys=[user1_id])
     user2 = db.relationship('User', foreign_keys=[user2_id])
+    members = db.relationship('ConversationMember', backref='conversation', lazy=True,
+                              cascade='all, delete-orphan')
     
-    # Ensure user1_id < user2_id to prevent duplicates
+    # Ensure user1_id < user2_id to prevent duplicates (NULL pairs of groups pass both checks)
     __table_args__ = (
         db.CheckConstraint('user1_id < user2_id', name='user_order_check'),
         db.UniqueConstraint('user1_id', 'user2_id', name='unique_conversation'),
+        # Inbox listing by either participant, newest first
+        db.Index('ix_conversations_user1_updated', 'user1_id', 'updated_at', 'id'),
+        db.Index('ix_conversations_user2_updated', 'user2_id', 'updated_at', 'id'),
     )
+
+    def other_user_id(self, user_id: int) -> int:
+        """Get the id of the other participant"""
+        return self.user2_id if self.user1_id == user_id else self.user1_id
+
+    def unread_count_for(self, user_id: int) -> int:
+        """Get the denormalized unread counter for a participant"""
+        return self.user1_unread_count if self.user1_id == user_id else self.user2_unread_count
     
+    def to_dict(self):
+        return {
+            'conversation_id': self.id,
+            'is_group': self.is_group,
+            'name': self.name,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+        }
+
     def __repr__(self):
-        return f'<Conversation {self.id}: {self.user1_id} <-> {self.user2_id}>'
\ No newline at end of file
+        if self.is_group:
+            return f'<Conversation {self.id}: group {self.name!r}>'
+        return f'<Conversation {self.id}: {self.user1_id} <-> {self.user2_id}>'
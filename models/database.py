@@ -1,7 +1,24 @@
 """
 Shared database instance for all models.
 """
+from contextvars import ContextVar
+
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session
+
+# Engine that serves the SELECTs of the current context (set by utils/replica.py); None means the primary
+read_engine: ContextVar = ContextVar('read_engine', default=None)
+
+
+class RoutingSession(Session):
+    """Sends plain SELECTs to `read_engine` when one is set; writes and flushes always use the primary"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        engine = read_engine.get()
+        if engine is not None and bind is None and not self._flushing and getattr(clause, 'is_select', False):
+            return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
 
 # Single shared db instance
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
@@ -0,0 +1,26 @@
+from models.database import db
+from datetime import datetime
+
+class FailedMessage(db.Model):
+    """
+    Dead letters of the write-behind writer: messages that were acked to
+    their sender and fanned out but could not be written, kept here instead
+    of being dropped. No foreign keys, since a missing conversation or
+    sender can be the reason the write failed.
+    """
+    __tablename__ = 'failed_messages'
+
+    id = db.Column(db.Integer, primary_key=True)
+    # The id the sender and recipients were given
+    message_id = db.Column(db.Integer, nullable=False)
+    conversation_id = db.Column(db.Integer, nullable=False)
+    sender_id = db.Column(db.Integer, nullable=False)
+    # Raw UTF-8: the content may be what a text column refused (NUL on PostgreSQL)
+    content = db.Column(db.LargeBinary, nullable=False)
+    sent_at = db.Column(db.DateTime, nullable=False)
+    delivered_at = db.Column(db.DateTime, nullable=True)
+    error = db.Column(db.Text, nullable=False)
+    failed_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    def __repr__(self):
+        return f'<FailedMessage {self.message_id} from {self.sender_id}>'
@@ -0,0 +1,43 @@
+from models.database import db
+from datetime import datetime
+
+class ConversationMember(db.Model):
+    __tablename__ = 'conversation_members'
+
+    conversation_id = db.Column(db.Integer, db.ForeignKey('conversations.id'), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    role = db.Column(db.String(20), nullable=False, default='member')
+    joined_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    # Per-member state as watermarks: every message up to the watermark counts as
+    # delivered / read, so there is no row per member per message. Watermarks are
+    # (sent_at, message id) keys, the order of history pages and touch_conversation;
+    # ids alone are not in send order once workers reserve them in blocks
+    last_delivered_message_id = db.Column(db.Integer, nullable=True)
+    last_delivered_sent_at = db.Column(db.DateTime, nullable=True)
+    last_read_message_id = db.Column(db.Integer, nullable=True)
+    last_read_sent_at = db.Column(db.DateTime, nullable=True)
+    unread_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+    __table_args__ = (
+        # Groups a user belongs to (the primary key covers members of a group)
+        db.Index('ix_conversation_members_user', 'user_id', 'conversation_id'),
+    )
+
+    ROLES = ('owner', 'admin', 'member')
+
+    @property
+    def can_manage(self) -> bool:
+        return self.role in ('owner', 'admin')
+
+    def to_dict(self):
+        return {
+            'user_id': self.user_id,
+            'role': self.role,
+            'joined_at': self.joined_at.isoformat() if self.joined_at else None,
+            'last_read_message_id': self.last_read_message_id,
+            'last_read_sent_at': self.last_read_sent_at.isoformat() if self.last_read_sent_at else None,
+        }
+
+    def __repr__(self):
+        return f'<ConversationMember {self.user_id} in {self.conversation_id}>'
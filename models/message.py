@@ -1,5 +1,6 @@
 from models.database import db
 from datetime import datetime
+from sqlalchemy import DDL, event
 
 class Message(db.Model):
     __tablename__ = 'messages'
@@ -12,6 +13,25 @@ class Message(db.Model):
     delivered_at = db.Column(db.DateTime, nullable=True)
     read_at = db.Column(db.DateTime, nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        # History pages and keyset cursors on (sent_at, id)
+        db.Index('ix_messages_conversation_sent', 'conversation_id', 'sent_at', 'id'),
+        # Offline queue: only rows still waiting for delivery
+        db.Index('ix_messages_undelivered', 'conversation_id', 'sent_at', 'id',
+                 postgresql_where=db.text('delivered_at IS NULL'),
+                 sqlite_where=db.text('delivered_at IS NULL')),
+        # Read receipts: newest unread message per conversation on the (sent_at, id)
+        # key. Group messages never get a row-level read_at, so this also serves
+        # group catch-up
+        db.Index('ix_messages_unread', 'conversation_id', 'sent_at', 'id',
+                 postgresql_where=db.text('read_at IS NULL'),
+                 sqlite_where=db.text('read_at IS NULL')),
+        # Full-text search on PostgreSQL (utils/search.py); SQLite uses messages_fts below
+        db.Index('ix_messages_search',
+                 db.func.to_tsvector(db.literal_column("'simple'"), db.text('content')),
+                 postgresql_using='gin').ddl_if(dialect='postgresql'),
+    )
     
     def to_dict(self):
         """Convert message to dictionary for JSON serialization"""
@@ -26,4 +46,11 @@ class Message(db.Model):
         }
     
     def __repr__(self):
-        return f'<Message {self.id} from {self.sender_id}>'
\ No newline at end of file
+        return f'<Message {self.id} from {self.sender_id}>'
+
+
+# SQLite full-text index, keyed by message id and written alongside messages (utils/search.py)
+MESSAGES_FTS_DDL = 'CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(content, conversation_id UNINDEXED)'
+
+event.listen(Message.__table__, 'after_create', DDL(MESSAGES_FTS_DDL).execute_if(dialect='sqlite'))
+event.listen(Message.__table__, 'before_drop', DDL('DROP TABLE IF EXISTS messages_fts').execute_if(dialect='sqlite'))
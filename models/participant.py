@@ -8,6 +8,8 @@ class User(db.Model):
     email = db.Column(db.String(120), unique=True, nullable=False)
     password_hash = db.Column(db.String(255), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Written in batches by the presence broadcaster, so it may lag by LAST_SEEN_FLUSH_INTERVAL
+    last_seen_at = db.Column(db.DateTime, nullable=True)
     
     # Relationships
     sent_messages = db.relationship('Message', foreign_keys='Message.sender_id', backref='sender', lazy=True)
@@ -0,0 +1,137 @@
+"""
+Lightweight read-only row objects for the read paths.
+
+They are filled straight from Core SELECT results, so listing messages or
+conversations skips ORM identity-map bookkeeping and per-instance dicts.
+"""
+from models.database import db
+from models.message import Message
+from models.conversation import Conversation
+from models.member import ConversationMember
+from models.change import Change
+
+messages_table = Message.__table__
+conversations_table = Conversation.__table__
+members_table = ConversationMember.__table__
+changes_table = Change.__table__
+
+MESSAGE_COLUMNS = (
+    messages_table.c.id,
+    messages_table.c.conversation_id,
+    messages_table.c.sender_id,
+    messages_table.c.content,
+    messages_table.c.sent_at,
+    messages_table.c.delivered_at,
+    messages_table.c.read_at,
+)
+
+
+def _iso(value):
+    return value.isoformat() if value is not None else None
+
+
+class MessageRow:
+    """Read-only message; same JSON shape as Message.to_dict()"""
+
+    __slots__ = ('id', 'conversation_id', 'sender_id', 'content', 'sent_at', 'delivered_at', 'read_at')
+
+    def __init__(self, id, conversation_id, sender_id, content, sent_at, delivered_at, read_at):
+        self.id = id
+        self.conversation_id = conversation_id
+        self.sender_id = sender_id
+        self.content = content
+        self.sent_at = sent_at
+        self.delivered_at = delivered_at
+        self.read_at = read_at
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'conversation_id': self.conversation_id,
+            'sender_id': self.sender_id,
+            'content': self.content,
+            'sent_at': _iso(self.sent_at),
+            'delivered_at': _iso(self.delivered_at),
+            'read_at': _iso(self.read_at),
+        }
+
+    def to_event(self):
+        """Payload of a new_message socket event"""
+        return {
+            'message_id': self.id,
+            'conversation_id': self.conversation_id,
+            'from_user_id': self.sender_id,
+            'content': self.content,
+            'sent_at': _iso(self.sent_at),
+        }
+
+
+CONVERSATION_COLUMNS = (
+    conversations_table.c.id,
+    conversations_table.c.user1_id,
+    conversations_table.c.user2_id,
+    conversations_table.c.updated_at,
+    conversations_table.c.user1_unread_count,
+    conversations_table.c.user2_unread_count,
+    conversations_table.c.is_group,
+    conversations_table.c.name,
+    # Only meaningful when the query joins the reader's membership row
+    members_table.c.unread_count.label('member_unread_count'),
+    messages_table.c.content.label('last_content'),
+    messages_table.c.sent_at.label('last_sent_at'),
+    messages_table.c.sender_id.label('last_sender_id'),
+)
+
+
+class ConversationRow:
+    """Read-only inbox entry: a conversation joined with its last message"""
+
+    __slots__ = ('id', 'user1_id', 'user2_id', 'updated_at', 'user1_unread_count',
+                 'user2_unread_count', 'is_group', 'name', 'member_unread_count',
+                 'last_content', 'last_sent_at', 'last_sender_id')
+
+    def __init__(self, id, user1_id, user2_id, updated_at, user1_unread_count,
+                 user2_unread_count, is_group, name, member_unread_count,
+                 last_content, last_sent_at, last_sender_id):
+        self.id = id
+        self.user1_id = user1_id
+        self.user2_id = user2_id
+        self.updated_at = updated_at
+        self.user1_unread_count = user1_unread_count
+        self.user2_unread_count = user2_unread_count
+        self.is_group = is_group
+        self.name = name
+        self.member_unread_count = member_unread_count
+        self.last_content = last_content
+        self.last_sent_at = last_sent_at
+        self.last_sender_id = last_sender_id
+
+    other_user_id = Conversation.other_user_id
+
+    def unread_count_for(self, user_id: int) -> int:
+        if self.is_group:
+            return self.member_unread_count or 0
+        return Conversation.unread_count_for(self, user_id)
+
+    def to_dict(self, user_id: int):
+        last_message = None
+        if self.last_sent_at is not None:
+            last_message = {
+                'content': self.last_content,
+                'sent_at': self.last_sent_at.isoformat(),
+                'sender_id': self.last_sender_id
+            }
+        return {
+            'conversation_id': self.id,
+            'is_group': bool(self.is_group),
+            'name': self.name,
+            'other_user_id': None if self.is_group else self.other_user_id(user_id),
+            'last_message': last_message,
+            'unread_count': self.unread_count_for(user_id),
+            'updated_at': _iso(self.updated_at)
+        }
+
+
+def fetch_rows(row_class, statement) -> list:
+    """Execute a Core SELECT and build one row object per result row"""
+    return [row_class(*row) for row in db.session.execute(statement)]
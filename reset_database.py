@@ -4,6 +4,7 @@ WARNING: This will delete all data in the database!
 """
 from app import create_app
 from models import db
+from migrations import upgrade_database
 
 app = create_app()
 
@@ -17,13 +18,18 @@ with app.app_context():
         print("✅ All tables dropped")
 
         print("\n📝 Creating tables with correct schema...")
-        db.create_all()
+        upgrade_database()
         print("✅ All tables created successfully!")
 
         print("\n📋 Tables created:")
         print("  - users")
         print("  - conversations")
         print("  - messages")
+        print("  - conversation_members")
+        print("  - messages_archive")
+        print("  - messages_fts (SQLite search index)")
+        print("  - changes")
+        print("  - schema_migrations")
 
         print("\n💡 Next steps:")
         print("  1. Run: python create_test_users.py")
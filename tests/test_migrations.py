@@ -0,0 +1,44 @@
+"""
+The planner must use every index the migrations add (migrations/__init__.py,
+EXPLAIN_CHECKS), on a fresh database and on one brought up to date by the
+upgrade() steps.
+
+    python -m pytest tests
+"""
+import pytest
+from sqlalchemy import create_engine
+
+from migrations import load_migrations, migration_status, schema_migrations, upgrade_database, verify_migrations
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f'sqlite:///{tmp_path / "chat.db"}')
+    yield engine
+    engine.dispose()
+
+
+def _unused(engine) -> list[str]:
+    results = verify_migrations(engine)
+    assert results, 'no EXPLAIN checks ran'
+    return [f"{r['version']} {r['index']}:\n{r['plan']}" for r in results if not r['used']]
+
+
+def test_fresh_database_uses_every_index(engine):
+    applied = upgrade_database(engine)
+
+    assert applied == [migration.VERSION for migration in load_migrations()]
+    assert all(migration['applied'] for migration in migration_status(engine))
+    assert _unused(engine) == []
+
+
+def test_upgraded_database_uses_every_index(engine):
+    upgrade_database(engine)
+    # Forget the stamps so that every upgrade() runs against the existing tables
+    with engine.begin() as conn:
+        conn.execute(schema_migrations.delete())
+
+    applied = upgrade_database(engine)
+
+    assert applied == [migration.VERSION for migration in load_migrations()]
+    assert _unused(engine) == []
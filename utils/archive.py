@@ -0,0 +1,242 @@
+"""
+Archival of cold message history.
+
+The archive job moves messages older than a cutoff out of `messages` into
+`messages_archive`, one zlib-compressed JSON chunk per conversation and
+month. That keeps the hot table, and every index on it, bounded by the
+retention window rather than by the age of the service.
+
+A message stays hot while anything still depends on its row:
+  - it is its conversation's last_message_id
+  - it has not been delivered (1:1) or some member has not received it (group)
+  - it is unread (1:1; group read state lives in member watermarks)
+
+History reads merge hot rows with archived ones on the (sent_at, id) key,
+so clients scrolling back see one continuous timeline. Archived messages
+drop out of the full-text search index with their rows.
+"""
+import json
+import zlib
+from datetime import datetime
+from itertools import groupby
+from typing import Optional
+
+from sqlalchemy import and_, delete, func, insert, or_, select, tuple_
+
+from config import Config
+from models import db, MessageArchive
+from models.rows import (MessageRow, MESSAGE_COLUMNS, messages_table, conversations_table,
+                         members_table, fetch_rows)
+from utils.cache import LRUCache
+from utils.log import log_event
+from utils.search import unindex_messages
+
+Key = tuple[datetime, int]
+
+# conversation_id -> (oldest key, newest key, message count) or None; the job runs in another process
+_bounds = LRUCache(maxsize=Config.CONVERSATION_CACHE_SIZE, ttl=Config.ARCHIVE_BOUNDS_CACHE_TTL)
+
+# archive chunk id -> decoded MessageRows; chunks never change once written
+_chunks = LRUCache(maxsize=Config.ARCHIVE_CHUNK_CACHE_SIZE)
+
+
+def encode_chunk(rows: list[MessageRow]) -> bytes:
+    return zlib.compress(json.dumps([
+        [row.id, row.sender_id, row.content, row.sent_at.isoformat(),
+         row.delivered_at.isoformat() if row.delivered_at else None,
+         row.read_at.isoformat() if row.read_at else None]
+        for row in rows
+    ], separators=(',', ':')).encode())
+
+
+def decode_chunk(conversation_id: int, payload: bytes) -> list[MessageRow]:
+    parse = datetime.fromisoformat
+    return [
+        MessageRow(id, conversation_id, sender_id, content, parse(sent_at),
+                   parse(delivered_at) if delivered_at else None,
+                   parse(read_at) if read_at else None)
+        for id, sender_id, content, sent_at, delivered_at, read_at in json.loads(zlib.decompress(payload))
+    ]
+
+
+# Archive job
+
+def archivable_messages(cutoff: datetime):
+    """SELECT for messages older than cutoff that nothing still needs from the hot table"""
+    messages, conversations, members = messages_table, conversations_table, members_table
+
+    # A member whose delivered watermark is still before the message
+    behind_member = select(members.c.user_id).where(
+        members.c.conversation_id == messages.c.conversation_id,
+        or_(members.c.last_delivered_sent_at.is_(None),
+            tuple_(members.c.last_delivered_sent_at, members.c.last_delivered_message_id)
+            < tuple_(messages.c.sent_at, messages.c.id))
+    ).exists()
+
+    return select(*MESSAGE_COLUMNS).select_from(
+        messages.join(conversations, conversations.c.id == messages.c.conversation_id)
+    ).where(
+        messages.c.sent_at < cutoff,
+        messages.c.delivered_at.is_not(None),
+        or_(conversations.c.last_message_id.is_(None), messages.c.id != conversations.c.last_message_id),
+        or_(
+            and_(conversations.c.is_group.is_(False), messages.c.read_at.is_not(None)),
+            and_(conversations.c.is_group.is_(True), ~behind_member),
+        )
+    ).order_by(messages.c.conversation_id, messages.c.sent_at, messages.c.id)
+
+
+def archive_messages(cutoff: datetime, chunk_size: int = 500, batch_size: int = 5000,
+                     max_batches: Optional[int] = None, dry_run: bool = False) -> dict:
+    """
+    Move archivable messages older than cutoff into compressed chunks.
+    Each batch is one transaction: chunks inserted, rows deleted, commit.
+    """
+    stats = {'messages': 0, 'chunks': 0, 'raw_bytes': 0, 'compressed_bytes': 0, 'batches': 0}
+    last_key = None
+
+    while max_batches is None or stats['batches'] < max_batches:
+        statement = archivable_messages(cutoff)
+        if last_key:
+            # Dry runs delete nothing, so walk past what was already counted
+            statement = statement.where(
+                tuple_(messages_table.c.conversation_id, messages_table.c.sent_at, messages_table.c.id) > last_key
+            )
+        rows = fetch_rows(MessageRow, statement.limit(batch_size))
+        if not rows:
+            break
+
+        chunks = []
+        for (conversation_id, period), group in groupby(rows, key=lambda r: (r.conversation_id, r.sent_at.strftime('%Y-%m'))):
+            group = list(group)
+            for start in range(0, len(group), chunk_size):
+                part = group[start:start + chunk_size]
+                payload = encode_chunk(part)
+                stats['raw_bytes'] += sum(len(row.content.encode()) for row in part)
+                stats['compressed_bytes'] += len(payload)
+                chunks.append({
+                    'conversation_id': conversation_id,
+                    'period': period,
+                    'message_count': len(part),
+                    'first_sent_at': part[0].sent_at,
+                    'first_message_id': part[0].id,
+                    'last_sent_at': part[-1].sent_at,
+                    'last_message_id': part[-1].id,
+                    'payload': payload,
+                    'archived_at': datetime.utcnow(),
+                })
+
+        if dry_run:
+            last_key = (rows[-1].conversation_id, rows[-1].sent_at, rows[-1].id)
+        else:
+            message_ids = [row.id for row in rows]
+            db.session.execute(insert(MessageArchive), chunks)
+            db.session.execute(delete(messages_table).where(messages_table.c.id.in_(message_ids)))
+            unindex_messages(message_ids)
+            db.session.commit()
+            for conversation_id in {chunk['conversation_id'] for chunk in chunks}:
+                _bounds.pop(conversation_id)
+
+        stats['messages'] += len(rows)
+        stats['chunks'] += len(chunks)
+        stats['batches'] += 1
+        log_event('archive_batch', messages=len(rows), chunks=len(chunks), dry_run=dry_run)
+
+    return stats
+
+
+# Reads
+
+def archive_bounds(conversation_id: int) -> Optional[tuple[Key, Key, int]]:
+    """(oldest key, newest key, message count) of a conversation's archive, or None"""
+    bounds = _bounds.get(conversation_id, False)
+    if bounds is False:
+        archive = MessageArchive.__table__.c
+        row = db.session.execute(
+            select(func.min(archive.first_sent_at), func.min(archive.first_message_id),
+                   func.max(archive.last_sent_at), func.max(archive.last_message_id),
+                   func.sum(archive.message_count))
+            .where(archive.conversation_id == conversation_id)
+        ).one()
+        # min/max of each column separately bound the key range from outside, which is all we need
+        bounds = ((row[0], row[1]), (row[2], row[3]), int(row[4])) if row[4] else None
+        _bounds.set(conversation_id, bounds)
+    return bounds
+
+
+def archived_message_count(conversation_id: int) -> int:
+    bounds = archive_bounds(conversation_id)
+    return bounds[2] if bounds else 0
+
+
+def _chunk_rows(chunk_id: int, conversation_id: int) -> list[MessageRow]:
+    rows = _chunks.get(chunk_id)
+    if rows is None:
+        payload = db.session.execute(
+            select(MessageArchive.payload).where(MessageArchive.id == chunk_id)
+        ).scalar_one()
+        rows = decode_chunk(conversation_id, payload)
+        _chunks.set(chunk_id, rows)
+    return rows
+
+
+def read_archived(conversation_id: int, limit: int, before: Optional[Key] = None,
+                  after: Optional[Key] = None) -> list[MessageRow]:
+    """
+    Up to `limit` archived messages past a cursor: newest first for
+    before / no cursor, oldest first for after. Chunks are decoded lazily,
+    and only as many as can still contribute.
+    """
+    archive = MessageArchive.__table__.c
+    key = lambda row: (row.sent_at, row.id)
+
+    if after:
+        statement = select(archive.id, archive.first_sent_at, archive.first_message_id).where(
+            archive.conversation_id == conversation_id,
+            tuple_(archive.last_sent_at, archive.last_message_id) > tuple_(*after)
+        ).order_by(archive.first_sent_at, archive.first_message_id)
+        keep = lambda row: key(row) > after
+        # Stop once the chunk starts after the limit-th row found so far
+        beyond = lambda chunk_key, worst: chunk_key > worst
+    else:
+        statement = select(archive.id, archive.last_sent_at, archive.last_message_id).where(
+            archive.conversation_id == conversation_id
+        ).order_by(archive.last_sent_at.desc(), archive.last_message_id.desc())
+        if before:
+            statement = statement.where(tuple_(archive.first_sent_at, archive.first_message_id) < tuple_(*before))
+        keep = lambda row: before is None or key(row) < before
+        beyond = lambda chunk_key, worst: chunk_key < worst
+
+    found: list[MessageRow] = []
+    for chunk_id, sent_at, message_id in db.session.execute(statement):
+        if len(found) >= limit and beyond((sent_at, message_id), key(found[-1])):
+            break
+        found.extend(row for row in _chunk_rows(chunk_id, conversation_id) if keep(row))
+        found.sort(key=key, reverse=not after)
+        del found[limit:]
+    return found
+
+
+def with_archived(conversation_id: int, hot: list[MessageRow], limit: int,
+                  before: Optional[Key] = None, after: Optional[Key] = None) -> list[MessageRow]:
+    """
+    Merge archived messages into a page read from the hot table.
+    `hot` is ordered like read_archived (newest first unless `after`) and
+    holds at most `limit` rows. The archive is only read when it could
+    contribute to the page.
+    """
+    bounds = archive_bounds(conversation_id)
+    if bounds is None:
+        return hot
+
+    oldest, newest, _ = bounds
+    key = lambda row: (row.sent_at, row.id)
+    if after:
+        if newest <= after or (len(hot) >= limit and key(hot[-1]) < oldest):
+            return hot
+    elif len(hot) >= limit and key(hot[-1]) > newest:
+        return hot
+
+    merged = hot + read_archived(conversation_id, limit, before=before, after=after)
+    merged.sort(key=key, reverse=not after)
+    return merged[:limit]
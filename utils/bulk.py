@@ -0,0 +1,174 @@
+"""
+Bulk sends and history imports.
+
+A batch is validated in one pass: recipients are checked with one query,
+1:1 conversations come from the (cached) pair lookup, and conversation
+targets are loaded together, with group membership from the member cache.
+Invalid items are rejected individually; the rest are written together:
+
+  - send_bulk: live messages through save_messages_batch (one multi-row
+    INSERT, one conversation touch per sender, unread counters and the
+    offline queue as for single sends)
+  - import_bulk: history through import_messages (COPY on PostgreSQL),
+    stored delivered and read with the sent_at the caller gives
+
+With write-behind on, both take their ids from the MessageWriter's
+IdAllocator, so they never collide with ids it has already handed out.
+"""
+from datetime import datetime, timezone
+from typing import Optional
+
+from sqlalchemy import select
+
+from models import db, User, Conversation
+from models.rows import MessageRow
+from utils.database import (get_or_create_conversation_id, get_group_member_ids, save_messages_batch,
+                            import_messages)
+from utils.persistence import get_message_writer
+
+
+def _parse_sent_at(value) -> Optional[datetime]:
+    """ISO timestamp -> naive UTC; None if it is malformed or in the future"""
+    if not isinstance(value, str):
+        return None
+    try:
+        sent_at = datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    if sent_at.tzinfo is not None:
+        sent_at = sent_at.astimezone(timezone.utc).replace(tzinfo=None)
+    return sent_at if sent_at <= datetime.utcnow() else None
+
+
+def validate_bulk(sender_id: int, items: list, max_length: int,
+                  allow_sent_at: bool = False) -> tuple[list[dict], list[dict]]:
+    """
+    Check a batch of {to_user_id | conversation_id, content[, sent_at]} items.
+    Returns (accepted, rejected): accepted items carry index, conversation_id,
+    is_group, recipient_id (1:1), content and sent_at; rejected ones index
+    and error.
+    """
+    now = datetime.utcnow()
+    parsed, rejected = [], []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            rejected.append({'index': index, 'error': 'Invalid message'})
+            continue
+
+        content = item.get('content')
+        if not isinstance(content, str) or not content:
+            rejected.append({'index': index, 'error': 'Missing content'})
+            continue
+        if len(content) > max_length:
+            rejected.append({'index': index, 'error': f'Message too long (max {max_length} characters)'})
+            continue
+        if '\x00' in content:
+            rejected.append({'index': index, 'error': 'Message contains a NUL character'})
+            continue
+
+        conversation_id, to_user_id = item.get('conversation_id'), item.get('to_user_id')
+        if isinstance(conversation_id, int):
+            target = ('conversation', conversation_id)
+        elif isinstance(to_user_id, int) and to_user_id != sender_id:
+            target = ('user', to_user_id)
+        else:
+            rejected.append({'index': index, 'error': 'Missing to_user_id or conversation_id'})
+            continue
+
+        sent_at = now
+        if allow_sent_at and item.get('sent_at') is not None:
+            sent_at = _parse_sent_at(item['sent_at'])
+            if sent_at is None:
+                rejected.append({'index': index, 'error': 'Invalid sent_at'})
+                continue
+
+        parsed.append((index, target, content, sent_at))
+
+    # Resolve every distinct target once
+    recipients = {key for (_, (kind, key), _, _) in parsed if kind == 'user'}
+    known_users = set(db.session.execute(select(User.id).where(User.id.in_(recipients))).scalars()) \
+        if recipients else set()
+    # target -> (conversation_id, is_group, recipient_id)
+    targets = {('user', user_id): (get_or_create_conversation_id(sender_id, user_id), False, user_id)
+               for user_id in known_users}
+
+    conversation_ids = {key for (_, (kind, key), _, _) in parsed if kind == 'conversation'}
+    if conversation_ids:
+        for conversation_id, is_group, user1_id, user2_id in db.session.execute(
+            select(Conversation.id, Conversation.is_group, Conversation.user1_id, Conversation.user2_id)
+            .where(Conversation.id.in_(conversation_ids))
+        ):
+            if is_group:
+                if sender_id in get_group_member_ids(conversation_id):
+                    targets[('conversation', conversation_id)] = (conversation_id, True, None)
+            elif sender_id in (user1_id, user2_id):
+                other = user2_id if user1_id == sender_id else user1_id
+                targets[('conversation', conversation_id)] = (conversation_id, False, other)
+
+    accepted = []
+    for index, target, content, sent_at in parsed:
+        resolved = targets.get(target)
+        if resolved is None:
+            error = 'Unknown recipient' if target[0] == 'user' else 'Conversation not found or access denied'
+            rejected.append({'index': index, 'error': error})
+            continue
+        conversation_id, is_group, recipient_id = resolved
+        accepted.append({
+            'index': index,
+            'conversation_id': conversation_id,
+            'is_group': is_group,
+            'recipient_id': recipient_id,
+            'content': content,
+            'sent_at': sent_at,
+        })
+
+    rejected.sort(key=lambda entry: entry['index'])
+    return accepted, rejected
+
+
+def _assign_ids(rows: list[dict]):
+    """Give rows ids from the write-behind allocator when it is running; otherwise the database assigns them"""
+    writer = get_message_writer()
+    if writer and rows:
+        for row, message_id in zip(rows, writer.ids.next_ids(len(rows))):
+            row['id'] = message_id
+
+
+def _rows(sender_id: int, accepted: list[dict], ids: list[int]) -> list[MessageRow]:
+    return [
+        MessageRow(message_id, item['conversation_id'], sender_id, item['content'], item['sent_at'],
+                   item.get('delivered_at'), item.get('read_at'))
+        for item, message_id in zip(accepted, ids)
+    ]
+
+
+def send_bulk(sender_id: int, accepted: list[dict]) -> list[MessageRow]:
+    """
+    Save validated live messages in one transaction. Group messages are
+    stored delivered (members track delivery by watermark); 1:1 messages
+    wait in the offline queue until the caller marks them delivered.
+    """
+    for item in accepted:
+        item['delivered_at'] = item['sent_at'] if item['is_group'] else None
+    rows = [
+        {'conversation_id': item['conversation_id'], 'sender_id': sender_id, 'content': item['content'],
+         'sent_at': item['sent_at'], 'delivered_at': item['delivered_at']}
+        for item in accepted
+    ]
+    _assign_ids(rows)
+    ids = save_messages_batch(rows)
+    return _rows(sender_id, accepted, ids)
+
+
+def import_bulk(sender_id: int, accepted: list[dict]) -> list[MessageRow]:
+    """Import validated items as history (delivered, read, no fan-out)"""
+    rows = [
+        {'conversation_id': item['conversation_id'], 'sender_id': sender_id,
+         'content': item['content'], 'sent_at': item['sent_at']}
+        for item in accepted
+    ]
+    _assign_ids(rows)
+    ids = import_messages(rows)
+    for item, row in zip(accepted, rows):
+        item['delivered_at'] = item['read_at'] = row['sent_at']
+    return _rows(sender_id, accepted, ids)
@@ -0,0 +1,263 @@
+"""
+Pub/sub buses used to route socket deliveries between server nodes.
+
+A bus carries two things:
+  - messages published on a channel (each node listens on its own channel)
+  - a cluster-wide presence map: user_id -> {node_id: open socket count}
+
+LocalBus keeps both in memory and is shared by every node created on the
+same LocalHub, which makes it a stand-in for Redis in single-process setups
+and when simulating several nodes in one process. RedisBus is the production
+backend. Its nodes send heartbeats: the entries of a node that stops (crash,
+restart under a new id) are ignored once its heartbeat lapses and then
+removed by one of the live nodes.
+"""
+import json
+import threading
+import time
+from collections import defaultdict
+from typing import Callable, Optional
+
+from utils.log import log_event
+
+Handler = Callable[[dict], None]
+
+
+class MessageBus:
+    """Interface shared by the bus backends"""
+
+    def publish(self, channel: str, message: dict):
+        raise NotImplementedError
+
+    def subscribe(self, channel: str, handler: Handler):
+        raise NotImplementedError
+
+    def start(self, start_task: Optional[Callable] = None):
+        """Begin delivering subscribed messages. No-op for synchronous buses."""
+
+    def stop(self):
+        pass
+
+    def presence_add(self, user_id: int, node_id: str) -> bool:
+        """Count one more socket for the user on a node. Returns True if the user just came online cluster-wide."""
+        raise NotImplementedError
+
+    def presence_remove(self, user_id: int, node_id: str) -> bool:
+        """Count one socket less. Returns True if the user just went offline cluster-wide."""
+        raise NotImplementedError
+
+    def presence_nodes(self, user_id: int) -> set[str]:
+        """Get the nodes that hold at least one socket for the user"""
+        raise NotImplementedError
+
+    def presence_online(self, user_ids) -> set[int]:
+        """Get which of the given users are online anywhere in the cluster"""
+        return {user_id for user_id in user_ids if self.presence_nodes(user_id)}
+
+
+class LocalHub:
+    """Shared state for every LocalBus attached to it"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.handlers: dict[str, list[Handler]] = defaultdict(list)
+        self.presence: dict[int, dict[str, int]] = {}
+
+
+class LocalBus(MessageBus):
+    """In-memory bus; handlers run synchronously in the publisher's context"""
+
+    def __init__(self, hub: Optional[LocalHub] = None):
+        self.hub = hub or LocalHub()
+
+    def publish(self, channel: str, message: dict):
+        # Round-trip through JSON so payloads behave exactly as they would over Redis
+        encoded = json.dumps(message)
+        for handler in list(self.hub.handlers.get(channel, ())):
+            handler(json.loads(encoded))
+
+    def subscribe(self, channel: str, handler: Handler):
+        with self.hub.lock:
+            self.hub.handlers[channel].append(handler)
+
+    def presence_add(self, user_id: int, node_id: str) -> bool:
+        with self.hub.lock:
+            nodes = self.hub.presence.setdefault(user_id, {})
+            first = not nodes
+            nodes[node_id] = nodes.get(node_id, 0) + 1
+            return first
+
+    def presence_remove(self, user_id: int, node_id: str) -> bool:
+        with self.hub.lock:
+            nodes = self.hub.presence.get(user_id)
+            if not nodes or node_id not in nodes:
+                return False
+            nodes[node_id] -= 1
+            if nodes[node_id] <= 0:
+                del nodes[node_id]
+            if not nodes:
+                del self.hub.presence[user_id]
+                return True
+            return False
+
+    def presence_nodes(self, user_id: int) -> set[str]:
+        return set(self.hub.presence.get(user_id, ()))
+
+
+class RedisBus(MessageBus):
+    """Redis pub/sub plus a hash per user for presence, and node heartbeats"""
+
+    PRESENCE_KEY = 'chat:presence:{user_id}'
+    # node_id -> time of its last heartbeat
+    NODES_KEY = 'chat:nodes'
+    # Held by the node that removes a dead node's presence
+    REAP_KEY = 'chat:nodes:reap:{node_id}'
+
+    # Decrement, delete at zero and read the remaining nodes in one step, so a
+    # connect on another node cannot slip in between and be reported offline.
+    # Returns nil unless this node's entry was deleted
+    PRESENCE_REMOVE_SCRIPT = """
+    if redis.call('HEXISTS', KEYS[1], ARGV[1]) == 0 then
+        return false
+    end
+    if redis.call('HINCRBY', KEYS[1], ARGV[1], -1) > 0 then
+        return false
+    end
+    redis.call('HDEL', KEYS[1], ARGV[1])
+    return redis.call('HKEYS', KEYS[1])
+    """
+
+    def __init__(self, url: str, node_timeout: float = 30.0):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError('BUS_BACKEND=redis requires the redis package (pip install redis)')
+
+        self.redis = redis.Redis.from_url(url, decode_responses=True)
+        self.pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+        self.handlers: dict[str, list[Handler]] = defaultdict(list)
+        self._presence_remove = self.redis.register_script(self.PRESENCE_REMOVE_SCRIPT)
+        self.node_timeout = node_timeout
+        # Nodes whose heartbeat had lapsed at our last heartbeat; their entries do not count
+        self._dead_nodes: set[str] = set()
+        self._running = False
+
+    def publish(self, channel: str, message: dict):
+        self.redis.publish(channel, json.dumps(message))
+
+    def subscribe(self, channel: str, handler: Handler):
+        self.handlers[channel].append(handler)
+        self.pubsub.subscribe(channel)
+
+    def start(self, start_task: Optional[Callable] = None):
+        if self._running:
+            return
+        self._running = True
+        if start_task:
+            start_task(self._listen)
+        else:
+            threading.Thread(target=self._listen, name='redis-bus', daemon=True).start()
+
+    def stop(self):
+        self._running = False
+        self.pubsub.close()
+
+    def _listen(self):
+        while self._running:
+            try:
+                for item in self.pubsub.listen():
+                    if not self._running:
+                        break
+                    message = json.loads(item['data'])
+                    for handler in self.handlers.get(item['channel'], ()):
+                        try:
+                            handler(message)
+                        except Exception as e:
+                            log_event('bus_handler_failed', 'error', channel=item['channel'], error=str(e))
+            except Exception as e:
+                if self._running:
+                    log_event('bus_connection_error', 'error', error=str(e))
+
+    def presence_add(self, user_id: int, node_id: str) -> bool:
+        key = self.PRESENCE_KEY.format(user_id=user_id)
+        with self.redis.pipeline() as pipe:
+            pipe.hkeys(key)
+            pipe.hincrby(key, node_id, 1)
+            previous_nodes, _ = pipe.execute()
+        return not self._live(previous_nodes)
+
+    def presence_remove(self, user_id: int, node_id: str) -> bool:
+        remaining = self._presence_remove(keys=[self.PRESENCE_KEY.format(user_id=user_id)], args=[node_id])
+        return remaining is not None and not self._live(remaining)
+
+    def presence_nodes(self, user_id: int) -> set[str]:
+        return self._live(self.redis.hkeys(self.PRESENCE_KEY.format(user_id=user_id)))
+
+    def presence_online(self, user_ids) -> set[int]:
+        """One round trip for any number of users"""
+        user_ids = list(user_ids)
+        with self.redis.pipeline(transaction=False) as pipe:
+            for user_id in user_ids:
+                pipe.hkeys(self.PRESENCE_KEY.format(user_id=user_id))
+            nodes = pipe.execute()
+        return {user_id for user_id, user_nodes in zip(user_ids, nodes) if self._live(user_nodes)}
+
+    def _live(self, nodes) -> set[str]:
+        return set(nodes) - self._dead_nodes
+
+    def heartbeat(self, node_id: str) -> tuple[bool, list[str]]:
+        """
+        Mark a node alive and refresh which nodes are dead (no heartbeat for
+        node_timeout). Returns (rejoined, dead): rejoined is True when the
+        node was not registered, because it just started or was reaped.
+        """
+        now = time.time()
+        with self.redis.pipeline() as pipe:
+            pipe.zadd(self.NODES_KEY, {node_id: now})
+            pipe.zrangebyscore(self.NODES_KEY, '-inf', now - self.node_timeout)
+            added, dead = pipe.execute()
+        self._dead_nodes = set(dead)
+        return bool(added), dead
+
+    def reap_node(self, node_id: str) -> list[int]:
+        """
+        Remove a dead node's presence. Returns the users left offline, or
+        nothing if another node is already reaping it.
+        """
+        if not self.redis.set(self.REAP_KEY.format(node_id=node_id), 1, nx=True, ex=max(60, int(self.node_timeout))):
+            return []
+        offline = self.clear_node(node_id)
+        # Unregistered last, so nobody counts its entries as live while they are removed
+        self.redis.zrem(self.NODES_KEY, node_id)
+        return offline
+
+    def presence_restore(self, node_id: str, counts: dict[int, int]) -> list[int]:
+        """Re-register a reaped node's sockets (user_id -> open sockets). Returns the users back online."""
+        user_ids = list(counts)
+        with self.redis.pipeline() as pipe:
+            for user_id in user_ids:
+                key = self.PRESENCE_KEY.format(user_id=user_id)
+                pipe.hkeys(key)
+                pipe.hset(key, node_id, counts[user_id])
+            results = pipe.execute()
+        return [user_id for user_id, nodes in zip(user_ids, results[::2]) if not self._live(nodes)]
+
+    def clear_node(self, node_id: str) -> list[int]:
+        """Drop every presence entry of a node (an earlier run of this one, or a dead one). Returns the users left offline."""
+        offline = []
+        for key in self.redis.scan_iter(match=self.PRESENCE_KEY.format(user_id='*')):
+            with self.redis.pipeline() as pipe:
+                pipe.hdel(key, node_id)
+                pipe.hkeys(key)
+                removed, remaining = pipe.execute()
+            if removed and not self._live(remaining):
+                offline.append(int(key.rsplit(':', 1)[-1]))
+        return offline
+
+
+def create_bus(backend: str, redis_url: Optional[str] = None, node_timeout: float = 30.0) -> MessageBus:
+    if backend == 'redis':
+        return RedisBus(redis_url or 'redis://localhost:6379', node_timeout)
+    if backend == 'local':
+        return LocalBus()
+    raise ValueError(f'Unknown BUS_BACKEND: {backend}')
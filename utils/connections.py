@@ -0,0 +1,94 @@
+"""
+In-memory registry of live Socket.IO connections.
+
+Keeps a forward index (user -> set of socket ids) and a reverse index
+(socket id -> user) so that resolving the owner of ``request.sid`` and
+finding every device of a user are both O(1).
+"""
+import threading
+from typing import Optional
+
+
+class ConnectionRegistry:
+    """
+    Tracks which sockets belong to which users.
+    A user may have several sockets open at once (one per device/tab).
+    """
+
+    def __init__(self):
+        # threading.Lock is green-aware once eventlet monkey patches it,
+        # and a plain mutex otherwise.
+        self._lock = threading.Lock()
+        self._sids_by_user: dict[int, set[str]] = {}
+        self._user_by_sid: dict[str, int] = {}
+
+    def add(self, user_id: int, sid: str) -> bool:
+        """
+        Register a socket for a user.
+        Returns True if this is the user's first open socket (user came online).
+        """
+        with self._lock:
+            previous = self._user_by_sid.get(sid)
+            if previous is not None and previous != user_id:
+                self._discard(previous, sid)
+
+            self._user_by_sid[sid] = user_id
+            sids = self._sids_by_user.setdefault(user_id, set())
+            first = not sids
+            sids.add(sid)
+            return first
+
+    def remove(self, sid: str) -> tuple[Optional[int], bool]:
+        """
+        Unregister a socket.
+        Returns (user_id, went_offline). user_id is None for unknown sockets.
+        """
+        with self._lock:
+            user_id = self._user_by_sid.pop(sid, None)
+            if user_id is None:
+                return None, False
+            went_offline = self._discard(user_id, sid)
+            return user_id, went_offline
+
+    def _discard(self, user_id: int, sid: str) -> bool:
+        sids = self._sids_by_user.get(user_id)
+        if not sids:
+            return False
+        sids.discard(sid)
+        if not sids:
+            del self._sids_by_user[user_id]
+            return True
+        return False
+
+    def user_for(self, sid: str) -> Optional[int]:
+        """Get the user that owns a socket, or None."""
+        return self._user_by_sid.get(sid)
+
+    def sids_for(self, user_id: int) -> list[str]:
+        """Get a snapshot of every socket id the user has open."""
+        with self._lock:
+            return list(self._sids_by_user.get(user_id, ()))
+
+    def is_online(self, user_id: int) -> bool:
+        """Check whether the user has at least one open socket."""
+        return user_id in self._sids_by_user
+
+    def online_users(self) -> list[int]:
+        """Get a snapshot of all online user ids."""
+        with self._lock:
+            return list(self._sids_by_user)
+
+    def user_count(self) -> int:
+        return len(self._sids_by_user)
+
+    def connection_count(self) -> int:
+        return len(self._user_by_sid)
+
+    def clear(self):
+        with self._lock:
+            self._sids_by_user.clear()
+            self._user_by_sid.clear()
+
+
+# Process-wide registry used by the Socket.IO handlers
+connections = ConnectionRegistry()
@@ -1,68 +1,416 @@
-from models import db, User, Conversation, Message
+import csv
+import io
+from models import db, User, Conversation, Message, ConversationMember, FailedMessage
+from models.rows import (MessageRow, ConversationRow, MESSAGE_COLUMNS, CONVERSATION_COLUMNS,
+                         messages_table, conversations_table, members_table, fetch_rows)
 from datetime import datetime
-from typing import Optional
+from typing import Iterable, Iterator, Optional
+from sqlalchemy import and_, case, delete, func, insert, or_, select, text, tuple_, update
+from sqlalchemy.exc import IntegrityError
+from config import Config
+from utils.archive import with_archived, archived_message_count, archive_bounds
+from utils.search import index_messages, search_messages
+from utils.sync import (record_changes, read_changes, settled_cursor, current_seq, oldest_seq,
+                        latest_change, latest_conversation_change)
+from utils.httpcache import response_cache
+from utils.replica import replicas
+from utils.cache import LRUCache
+from utils.log import log_event
+
+# (user1_id, user2_id) -> conversation_id; pairs never change once created
+_conversation_ids = LRUCache(maxsize=Config.CONVERSATION_CACHE_SIZE)
+
+# conversation_id -> message count, for the optional `total` on history pages
+_message_counts = LRUCache(maxsize=Config.MESSAGE_COUNT_CACHE_SIZE, ttl=Config.MESSAGE_COUNT_CACHE_TTL)
+
+# conversation_id -> is_group; a conversation never changes kind
+_conversation_kinds = LRUCache(maxsize=Config.CONVERSATION_CACHE_SIZE)
+
+# conversation_id -> frozenset of member ids; dropped locally on membership changes
+_group_members = LRUCache(maxsize=Config.GROUP_MEMBER_CACHE_SIZE, ttl=Config.GROUP_MEMBER_CACHE_TTL)
 
 def get_or_create_conversation(user1_id: int, user2_id: int) -> Conversation:
     """
     Get existing conversation between two users or create a new one.
     Always ensures user1_id < user2_id.
     """
+    conversation_id = get_or_create_conversation_id(user1_id, user2_id)
+    return db.session.get(Conversation, conversation_id)
+
+
+def get_or_create_conversation_id(user1_id: int, user2_id: int) -> int:
+    """
+    Get the id of the conversation between two users, creating it if needed.
+    Served from an in-memory pair cache on the hot path. Creation is an
+    INSERT ... ON CONFLICT DO NOTHING, so two users messaging each other at
+    the same moment both end up with the same row instead of an error.
+    """
     # Ensure user1_id < user2_id
     if user1_id > user2_id:
         user1_id, user2_id = user2_id, user1_id
-    
+
+    pair = (user1_id, user2_id)
+    conversation_id = _conversation_ids.get(pair)
+    if conversation_id is not None:
+        return conversation_id
+
     # Try to find existing conversation
-    conversation = Conversation.query.filter_by(
-        user1_id=user1_id,
-        user2_id=user2_id
-    ).first()
-    
+    conversation_id = _find_conversation_id(user1_id, user2_id)
+
     # Create if doesn't exist
-    if not conversation:
-        conversation = Conversation(
-            user1_id=user1_id, # type: ignore
-            user2_id=user2_id # type: ignore
+    if conversation_id is None:
+        conversation_id = _insert_conversation(user1_id, user2_id)
+        if conversation_id is None:
+            # Lost the race to a concurrent insert; the row exists now
+            conversation_id = _find_conversation_id(user1_id, user2_id)
+        else:
+            log_event('conversation_created', conversation_id=conversation_id,
+                      user1_id=user1_id, user2_id=user2_id)
+
+    _conversation_ids.set(pair, conversation_id)
+    return conversation_id
+
+
+def get_conversation_id(user1_id: int, user2_id: int) -> Optional[int]:
+    """Id of the existing conversation between two users, or None. Uses the pair cache; never creates."""
+    if user1_id > user2_id:
+        user1_id, user2_id = user2_id, user1_id
+
+    pair = (user1_id, user2_id)
+    conversation_id = _conversation_ids.get(pair)
+    if conversation_id is None:
+        conversation_id = _find_conversation_id(user1_id, user2_id)
+        if conversation_id is not None:
+            _conversation_ids.set(pair, conversation_id)
+    return conversation_id
+
+
+def _find_conversation_id(user1_id: int, user2_id: int) -> Optional[int]:
+    return db.session.execute(
+        select(Conversation.id).where(
+            Conversation.user1_id == user1_id,
+            Conversation.user2_id == user2_id
         )
-        db.session.add(conversation)
+    ).scalar()
+
+
+def _insert_conversation(user1_id: int, user2_id: int) -> Optional[int]:
+    """
+    Insert a conversation unless the pair already exists.
+    Returns the new id, or None if another transaction created it first.
+    """
+    now = datetime.utcnow()
+    values = {'user1_id': user1_id, 'user2_id': user2_id, 'created_at': now, 'updated_at': now}
+    dialect = db.engine.dialect.name
+
+    if dialect in ('postgresql', 'sqlite'):
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert as upsert
+        else:
+            from sqlalchemy.dialects.sqlite import insert as upsert
+
+        conversation_id = db.session.execute(
+            upsert(Conversation)
+            .values(**values)
+            .on_conflict_do_nothing(index_elements=['user1_id', 'user2_id'])
+            .returning(Conversation.id)
+        ).scalar()
         db.session.commit()
-        print(f"📝 Created new conversation between {user1_id} and {user2_id}")
-    
-    return conversation
+        return conversation_id
+
+    try:
+        conversation_id = db.session.execute(
+            insert(Conversation).values(**values).returning(Conversation.id)
+        ).scalar()
+        db.session.commit()
+        return conversation_id
+    except IntegrityError:
+        db.session.rollback()
+        return None
 
 
-def save_message(conversation_id: int, sender_id: int, content: str) -> Message:
+def save_message(conversation_id: int, sender_id: int, content: str, delivered: bool = False) -> Message:
     """
     Save a new message to the database.
+    `delivered` stores delivered_at with the row (group messages track
+    delivery per member instead, so they are saved as delivered).
     """
+    now = datetime.utcnow()
     message = Message(
         conversation_id=conversation_id, # type: ignore
         sender_id=sender_id, # type: ignore
         content=content, # type: ignore
-        sent_at=datetime.utcnow() # type: ignore
+        sent_at=now, # type: ignore
+        delivered_at=now if delivered else None # type: ignore
     )
     
     db.session.add(message)
+    db.session.flush()
     
-    # Update conversation's updated_at timestamp
-    conversation = Conversation.query.get(conversation_id)
-    if conversation:
-        conversation.updated_at = datetime.utcnow()
+    # Update the conversation's inbox state, the search index and the change log in the same transaction
+    touch_conversation(conversation_id, sender_id, message.id, message.sent_at)
+    index_messages([(message.id, conversation_id, content)])
+    record_changes([(conversation_id, 'message', None, message.id, message.sent_at)])
     
     db.session.commit()
+    _message_counts.incr(conversation_id)
+    response_cache.invalidate_conversation(conversation_id)
+    replicas.note_write([sender_id])
     
     return message
 
 
-def mark_message_delivered(message_id: int) -> bool:
+def save_messages_batch(rows: list[dict]) -> list[int]:
     """
-    Mark a message as delivered.
+    Save many messages in one transaction with a multi-row INSERT.
+    Each row is a dict with conversation_id, sender_id, content and sent_at,
+    and optionally id and delivered_at.
+    Each conversation is touched once per sender rather than once per message.
+    Returns the message ids in row order.
     """
-    message = Message.query.get(message_id)
-    if message and not message.delivered_at:
-        message.delivered_at = datetime.utcnow()
-        db.session.commit()
-        return True
-    return False
+    if not rows:
+        return []
+
+    result = db.session.execute(
+        insert(Message).returning(Message.id, sort_by_parameter_order=True),
+        rows
+    )
+    message_ids = list(result.scalars())
+    index_messages((message_id, row['conversation_id'], row['content'])
+                   for row, message_id in zip(rows, message_ids))
+    record_changes((row['conversation_id'], 'message', None, message_id, row['sent_at'])
+                   for row, message_id in zip(rows, message_ids))
+
+    # (conversation_id, sender_id) -> [count, newest id, newest sent_at] on the (sent_at, id) key
+    latest: dict[tuple[int, int], list] = {}
+    for row, message_id in zip(rows, message_ids):
+        entry = latest.setdefault((row['conversation_id'], row['sender_id']), [0, 0, None])
+        entry[0] += 1
+        if entry[2] is None or (row['sent_at'], message_id) > (entry[2], entry[1]):
+            entry[1], entry[2] = message_id, row['sent_at']
+
+    for (conversation_id, sender_id), (count, message_id, sent_at) in latest.items():
+        touch_conversation(conversation_id, sender_id, message_id, sent_at, count)
+
+    db.session.commit()
+
+    for (conversation_id, _), (count, _, _) in latest.items():
+        _message_counts.incr(conversation_id, count)
+        response_cache.invalidate_conversation(conversation_id)
+    replicas.note_write({sender_id for _, sender_id in latest})
+
+    return message_ids
+
+
+def save_failed_message(row: dict, error: str):
+    """Keep a message the write-behind writer could not save (a save_messages_batch row) in failed_messages"""
+    db.session.execute(insert(FailedMessage).values(
+        message_id=row['id'],
+        conversation_id=row['conversation_id'],
+        sender_id=row['sender_id'],
+        content=row['content'].encode('utf-8', 'surrogatepass'),
+        sent_at=row['sent_at'],
+        delivered_at=row['delivered_at'],
+        error=error
+    ))
+    db.session.commit()
+
+
+def reserve_message_ids(count: int) -> list[int]:
+    """Take `count` ids from the messages id sequence, ascending (PostgreSQL only). Does not commit."""
+    return sorted(db.session.execute(
+        text("SELECT nextval(pg_get_serial_sequence('messages', 'id')) FROM generate_series(1, :n)"),
+        {'n': count}
+    ).scalars().all())
+
+
+def _copy_supported() -> bool:
+    """psycopg2 refuses COPY once a wait callback is set (utils/pool.py sets one under eventlet)"""
+    try:
+        import psycopg2.extensions
+    except ImportError:
+        return False
+    return psycopg2.extensions.get_wait_callback() is None
+
+
+def _copy_messages(rows: list[dict]):
+    """Stream rows (with ids) into messages with COPY, inside the session's transaction"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow([
+            row['id'], row['conversation_id'], row['sender_id'], row['content'],
+            row['sent_at'].isoformat(), row['delivered_at'].isoformat(), row['read_at'].isoformat(),
+            row['sent_at'].isoformat(),
+        ])
+    buffer.seek(0)
+
+    cursor = db.session.connection().connection.cursor()
+    try:
+        cursor.copy_expert(
+            'COPY messages (id, conversation_id, sender_id, content, sent_at, delivered_at, read_at, created_at) '
+            'FROM STDIN WITH (FORMAT csv)', buffer)
+    finally:
+        cursor.close()
+
+
+def import_messages(rows: list[dict]) -> list[int]:
+    """
+    Import history: rows with conversation_id, sender_id, content and sent_at
+    (any time in the past), and optionally id. They are stored delivered and
+    read, so nobody gets them as offline messages or unread counts. On
+    PostgreSQL rows without ids get them from the sequence and are streamed
+    with COPY; elsewhere, and under eventlet's green psycopg2, it is a
+    multi-row INSERT.
+    Each conversation is touched once (it only moves forward if the import
+    holds its newest message) and gets one `history` change; group members
+    that were caught up have their watermarks moved past the import.
+    Returns the message ids in row order.
+    """
+    if not rows:
+        return []
+
+    for row in rows:
+        row['delivered_at'] = row['read_at'] = row['sent_at']
+
+    conversation_ids = {row['conversation_id'] for row in rows}
+    # conversation_id -> (sent_at, id) of its newest message before the import
+    previous_last = {
+        conversation_id: (sent_at, message_id)
+        for conversation_id, message_id, sent_at in db.session.execute(
+            select(conversations_table.c.id, conversations_table.c.last_message_id, messages_table.c.sent_at)
+            .select_from(conversations_table.join(
+                messages_table, messages_table.c.id == conversations_table.c.last_message_id))
+            .where(conversations_table.c.id.in_(conversation_ids))
+        )
+    }
+
+    postgresql = db.session.get_bind().dialect.name == 'postgresql'
+    if postgresql and 'id' not in rows[0]:
+        for row, message_id in zip(rows, reserve_message_ids(len(rows))):
+            row['id'] = message_id
+    if postgresql and _copy_supported():
+        message_ids = [row['id'] for row in rows]
+        _copy_messages(rows)
+    else:
+        message_ids = list(db.session.execute(
+            insert(Message).returning(Message.id, sort_by_parameter_order=True), rows
+        ).scalars())
+    index_messages((message_id, row['conversation_id'], row['content'])
+                   for row, message_id in zip(rows, message_ids))
+
+    # conversation_id -> [count, newest (sent_at, id), its sender, highest id]
+    latest: dict[int, list] = {}
+    for row, message_id in zip(rows, message_ids):
+        entry = latest.setdefault(row['conversation_id'], [0, None, None, 0])
+        entry[0] += 1
+        if entry[1] is None or (row['sent_at'], message_id) > entry[1]:
+            entry[1], entry[2] = (row['sent_at'], message_id), row['sender_id']
+        entry[3] = max(entry[3], message_id)
+
+    for conversation_id, (count, (sent_at, message_id), sender_id, _) in latest.items():
+        touch_conversation(conversation_id, sender_id, message_id, sent_at, count=0)
+        if is_group_conversation(conversation_id):
+            # Members that had everything keep everything, including imports newer than their watermark
+            caught_up = previous_last.get(conversation_id)
+            for kind in ('delivered', 'read'):
+                watermark = _watermark(kind)
+                db.session.execute(
+                    update(ConversationMember)
+                    .where(ConversationMember.conversation_id == conversation_id,
+                           _before(watermark, sent_at, message_id),
+                           *([] if caught_up is None else [~_before(watermark, *caught_up)]))
+                    .values({watermark[0]: sent_at, watermark[1]: message_id})
+                    .execution_options(synchronize_session=False)
+                )
+    record_changes((conversation_id, 'history', None, entry[3], None) for conversation_id, entry in latest.items())
+    db.session.commit()
+
+    for conversation_id, (count, _, _, _) in latest.items():
+        _message_counts.incr(conversation_id, count)
+        response_cache.invalidate_conversation(conversation_id)
+    replicas.note_write({row['sender_id'] for row in rows})
+
+    return message_ids
+
+
+def touch_conversation(conversation_id: int, sender_id: int, last_message_id: int,
+                       sent_at: datetime, count: int = 1):
+    """
+    Point the conversation at its newest message and bump the recipient's
+    unread counter, in a single UPDATE. Groups bump every other member's
+    counter with one more UPDATE. Does not commit.
+    Only moves last_message_id / updated_at forward on the (sent_at, id) key,
+    so backdated imports and late commits never rewind the inbox.
+    """
+    last_sent_at = select(messages_table.c.sent_at).where(
+        messages_table.c.id == Conversation.last_message_id
+    ).scalar_subquery()
+    newer = or_(
+        Conversation.last_message_id.is_(None),
+        last_sent_at < sent_at,
+        and_(last_sent_at == sent_at, Conversation.last_message_id < last_message_id),
+    )
+
+    db.session.execute(
+        update(Conversation)
+        .where(Conversation.id == conversation_id)
+        .values(
+            updated_at=case((newer, sent_at), else_=Conversation.updated_at),
+            last_message_id=case((newer, last_message_id), else_=Conversation.last_message_id),
+            user1_unread_count=Conversation.user1_unread_count + case(
+                (Conversation.user1_id != sender_id, count), else_=0),
+            user2_unread_count=Conversation.user2_unread_count + case(
+                (Conversation.user2_id != sender_id, count), else_=0),
+        )
+        .execution_options(synchronize_session=False)
+    )
+
+    if count and is_group_conversation(conversation_id):
+        db.session.execute(
+            update(ConversationMember)
+            .where(ConversationMember.conversation_id == conversation_id,
+                   ConversationMember.user_id != sender_id)
+            .values(unread_count=ConversationMember.unread_count + count)
+            .execution_options(synchronize_session=False)
+        )
+
+
+def _user_conversations_statement(user_id: int):
+    """SELECT of CONVERSATION_COLUMNS over every conversation the user takes part in"""
+    conversations, messages, members = conversations_table, messages_table, members_table
+    return select(*CONVERSATION_COLUMNS).select_from(
+        conversations
+        .outerjoin(messages, messages.c.id == conversations.c.last_message_id)
+        .outerjoin(members, and_(members.c.conversation_id == conversations.c.id,
+                                 members.c.user_id == user_id))
+    ).where(
+        (conversations.c.user1_id == user_id) | (conversations.c.user2_id == user_id)
+        | (members.c.user_id == user_id)
+    )
+
+
+def get_user_conversations(user_id: int, limit: int = 50,
+                           before: Optional[tuple[datetime, int]] = None):
+    """
+    Get a page of the user's conversations with their last message, newest first.
+    Uses keyset pagination on (updated_at, id); `before` is the key of the
+    last row of the previous page.
+    Includes the groups the user is a member of.
+    Returns (rows, has_more) with ConversationRow objects read through Core.
+    """
+    conversations = conversations_table
+    statement = _user_conversations_statement(user_id)
+
+    if before:
+        statement = statement.where(tuple_(conversations.c.updated_at, conversations.c.id) < tuple_(*before))
+
+    rows = fetch_rows(ConversationRow, statement.order_by(
+        conversations.c.updated_at.desc(), conversations.c.id.desc()
+    ).limit(limit + 1))
+
+    return rows[:limit], len(rows) > limit
+
 
 def get_undelivered_messages(user_id: int) -> list[Message]:
     """
@@ -89,35 +437,675 @@ def get_undelivered_messages(user_id: int) -> list[Message]:
 
     return undelivered
 
+def iter_undelivered_message_chunks(user_id: int, chunk_size: int = 200) -> Iterator[list[MessageRow]]:
+    """
+    Stream a user's undelivered messages, oldest first, in chunks of at most
+    `chunk_size`. Walks the queue with a (sent_at, id) keyset so memory stays
+    bounded no matter how many messages are waiting.
+    """
+    conversation_ids = select(Conversation.id).where(
+        (Conversation.user1_id == user_id) | (Conversation.user2_id == user_id)
+    )
+
+    messages = messages_table
+    last_key = None
+    while True:
+        statement = select(*MESSAGE_COLUMNS).where(
+            messages.c.conversation_id.in_(conversation_ids),
+            messages.c.sender_id != user_id,
+            messages.c.delivered_at.is_(None)
+        )
+        if last_key:
+            statement = statement.where(tuple_(messages.c.sent_at, messages.c.id) > tuple_(*last_key))
+
+        chunk = fetch_rows(MessageRow, statement.order_by(messages.c.sent_at, messages.c.id).limit(chunk_size))
+        if not chunk:
+            return
+
+        yield chunk
+
+        if len(chunk) < chunk_size:
+            return
+        last_key = (chunk[-1].sent_at, chunk[-1].id)
+
+def persist_delivery_acks(message_ids: list[int]) -> tuple[list[int], list[int]]:
+    """
+    Mark acknowledged messages as delivered with a single UPDATE and log at
+    most one receipt per conversation and sender (see _delivered_receipts).
+    Returns (ids marked delivered now, ids to retry). The latter have no
+    committed row yet (the write-behind writer still holds them); ids that
+    were already delivered are in neither list.
+    """
+    if not message_ids:
+        return [], []
+
+    delivered = db.session.execute(
+        update(Message)
+        .where(Message.id.in_(message_ids), Message.delivered_at.is_(None))
+        .values(delivered_at=datetime.utcnow())
+        .returning(Message.id, Message.conversation_id, Message.sender_id, Message.sent_at)
+        .execution_options(synchronize_session=False)
+    ).all()
+
+    record_changes(_delivered_receipts(delivered))
+
+    db.session.commit()
+
+    # Rows committed after the UPDATE are retried too; only delivered ones are done
+    retry = set(message_ids) - {row[0] for row in delivered}
+    if retry:
+        retry -= set(db.session.execute(
+            select(Message.id).where(Message.id.in_(retry), Message.delivered_at.is_not(None))
+        ).scalars())
+    return [row[0] for row in delivered], sorted(retry)
+
+def _delivered_receipts(delivered: list) -> list[tuple]:
+    """
+    'delivered' change entries for newly delivered (id, conversation_id,
+    sender_id, sent_at) rows. A receipt tells the sender that every message
+    they sent in the conversation up to it, on the (sent_at, id) key,
+    reached the recipient (user_id). Acks arrive per message and out of
+    order, so a receipt only
+    moves over a prefix with no undelivered message in it: an ack behind a
+    pending one logs nothing until that one is acked too.
+    """
+    # (conversation_id, sender_id) -> oldest newly delivered key
+    first: dict[tuple[int, int], tuple] = {}
+    for message_id, conversation_id, sender_id, sent_at in delivered:
+        pair, key = (conversation_id, sender_id), (sent_at, message_id)
+        if pair not in first or key < first[pair]:
+            first[pair] = key
+    if not first:
+        return []
+    conversation_ids = {conversation_id for conversation_id, _ in first}
+
+    # Oldest message of each sender still waiting for delivery (the offline queue)
+    gaps: dict[tuple[int, int], tuple] = {}
+    for conversation_id, sender_id, sent_at, message_id in db.session.execute(
+        select(Message.conversation_id, Message.sender_id, Message.sent_at, Message.id)
+        .where(Message.conversation_id.in_(conversation_ids), Message.delivered_at.is_(None))
+    ):
+        pair, key = (conversation_id, sender_id), (sent_at, message_id)
+        if pair in first and (pair not in gaps or key < gaps[pair]):
+            gaps[pair] = key
+
+    participants = {
+        row.id: (row.user1_id, row.user2_id)
+        for row in db.session.execute(
+            select(Conversation.id, Conversation.user1_id, Conversation.user2_id)
+            .where(Conversation.id.in_(conversation_ids))
+        )
+    }
+
+    entries = []
+    for (conversation_id, sender_id), key in first.items():
+        gap = gaps.get((conversation_id, sender_id))
+        if gap is not None and gap < key:
+            continue
+        # Newest message of the sender before the gap; at least the one just delivered
+        statement = (
+            select(Message.id, Message.sent_at)
+            .where(Message.conversation_id == conversation_id, Message.sender_id == sender_id)
+            .order_by(Message.sent_at.desc(), Message.id.desc())
+            .limit(1)
+        )
+        if gap is not None:
+            statement = statement.where(tuple_(Message.sent_at, Message.id) < tuple_(*gap))
+        user1_id, user2_id = participants[conversation_id]
+        recipient_id = user2_id if sender_id == user1_id else user1_id
+        up_to_id, up_to_sent_at = db.session.execute(statement).one()
+        entries.append((conversation_id, 'delivered', recipient_id, up_to_id, up_to_sent_at))
+    return entries
+
+def count_undelivered_messages() -> int:
+    """
+    Count messages still waiting for delivery (served by the partial index).
+    """
+    return db.session.query(func.count(Message.id)).filter(Message.delivered_at.is_(None)).scalar()
+
 def get_conversation_messages(conversation_id: int, limit: int = 50,offset: int = 0):
     """ Get messages from a conversation with pagination.
         Returns messages ordered by sent_at (newest first).
+        Reaches into archived history once the offset goes past the hot rows.
     """
-    messages = Message.query.filter_by(conversation_id=conversation_id).order_by(Message.sent_at.desc()).limit(limit).offset(offset).all()
+    if archive_bounds(conversation_id) is None:
+        messages = Message.query.filter_by(conversation_id=conversation_id).order_by(Message.sent_at.desc()).limit(limit).offset(offset).all()
+    else:
+        table = messages_table
+        hot = fetch_rows(MessageRow, select(*MESSAGE_COLUMNS).where(table.c.conversation_id == conversation_id)
+                         .order_by(table.c.sent_at.desc(), table.c.id.desc()).limit(offset + limit))
+        messages = with_archived(conversation_id, hot, offset + limit)[offset:]
 
-    total = Message.query.filter_by(conversation_id=conversation_id).count()
+    total = get_conversation_message_count(conversation_id)
 
     return messages,total
 
-def mark_messages_as_read(conversation_id: int, user_id: int) -> int:
+def get_conversation_messages_page(conversation_id: int, limit: int = 50,
+                                   before: Optional[tuple[datetime, int]] = None,
+                                   after: Optional[tuple[datetime, int]] = None):
+    """
+    Get a page of messages using keyset pagination on (sent_at, id).
+    `before` fetches older messages than the cursor, `after` newer ones.
+    Messages are always returned newest first.
+    Returns (messages, has_more) where has_more refers to the paging direction.
+    Messages are MessageRow objects read through Core, not ORM instances,
+    merged with archived history where the page reaches into it.
+    """
+    table = messages_table
+    key = tuple_(table.c.sent_at, table.c.id)
+    statement = select(*MESSAGE_COLUMNS).where(table.c.conversation_id == conversation_id)
+
+    if after:
+        statement = statement.where(key > tuple_(*after)).order_by(table.c.sent_at.asc(), table.c.id.asc())
+    else:
+        if before:
+            statement = statement.where(key < tuple_(*before))
+        statement = statement.order_by(table.c.sent_at.desc(), table.c.id.desc())
+
+    # Fetch one extra row to learn whether another page exists
+    messages = fetch_rows(MessageRow, statement.limit(limit + 1))
+    messages = with_archived(conversation_id, messages, limit + 1, before=before, after=after)
+    has_more = len(messages) > limit
+    messages = messages[:limit]
+
+    if after:
+        messages.reverse()
+
+    return messages, has_more
+
+def get_conversation_message_count(conversation_id: int) -> int:
+    """
+    Get the number of messages in a conversation.
+    Cached for MESSAGE_COUNT_CACHE_TTL seconds and kept current by save_message.
+    Includes archived messages.
+    """
+    total = _message_counts.get(conversation_id)
+    if total is None:
+        total = Message.query.filter_by(conversation_id=conversation_id).count()
+        total += archived_message_count(conversation_id)
+        _message_counts.set(conversation_id, total)
+    return total
+
+def user_conversation_ids(user_id: int):
+    """SELECT of the ids of every conversation the user takes part in, 1:1 or group"""
+    conversations, members = conversations_table, members_table
+    return select(conversations.c.id).where(
+        (conversations.c.user1_id == user_id) | (conversations.c.user2_id == user_id)
+    ).union_all(
+        select(members.c.conversation_id).where(members.c.user_id == user_id)
+    )
+
+
+def search_user_messages(user_id: int, query: str, limit: int = 20,
+                         after: Optional[tuple[float, int]] = None,
+                         conversation_id: Optional[int] = None):
+    """
+    Full-text search over the user's conversations, or just `conversation_id`
+    (the caller checks access). `after` is the (rank, id) search cursor.
+    Returns ([(MessageRow, rank)], has_more).
+    """
+    scope = [conversation_id] if conversation_id else user_conversation_ids(user_id)
+    return search_messages(scope, query, limit, after)
+
+
+def get_changes_since(user_id: int, since: Optional[int], limit: int = 500, settle_seconds: float = 5.0) -> dict:
+    """
+    Everything that changed in the user's conversations past the `since`
+    sequence number, for delta sync. Without `since` only the current
+    cursor is returned. Returns a dict with:
+      - changes: change log rows in seq order
+      - messages: current MessageRows of the new messages among them
+      - conversations: current ConversationRows of the conversations touched
+      - cursor: the seq to pass as `since` next time
+      - has_more: another call would return more changes
+      - reset: no `since`, or one older than the retained log; refetch everything
+    """
+    oldest = oldest_seq()
+    if since is None or (oldest is not None and since < oldest - 1):
+        return {'changes': [], 'messages': [], 'conversations': [],
+                'cursor': current_seq(), 'has_more': False, 'reset': True}
+
+    changes = read_changes(user_conversation_ids(user_id), user_id, since, limit + 1)
+    has_more = len(changes) > limit
+    changes = changes[:limit]
+
+    message_ids = [change.message_id for change in changes if change.kind == 'message']
+    messages = fetch_rows(MessageRow, select(*MESSAGE_COLUMNS).where(
+        messages_table.c.id.in_(message_ids)
+    ).order_by(messages_table.c.id)) if message_ids else []
+
+    conversation_ids = {change.conversation_id for change in changes}
+    conversations = fetch_rows(ConversationRow, _user_conversations_statement(user_id).where(
+        conversations_table.c.id.in_(conversation_ids)
+    )) if conversation_ids else []
+
+    return {
+        'changes': changes,
+        'messages': messages,
+        'conversations': conversations,
+        'cursor': settled_cursor(changes, since, settle_seconds, has_more),
+        'has_more': has_more,
+        'reset': False,
+    }
+
+
+def get_user_version(user_id: int) -> Optional[tuple[int, datetime]]:
+    """(seq, time) of the newest change in the user's conversations, or None; reads only the change log"""
+    change = latest_change(user_conversation_ids(user_id), user_id)
+    return (change.seq, change.created_at) if change else None
+
+
+def get_conversation_version(conversation_id: int) -> tuple[int, datetime]:
+    """
+    (seq, time) of the conversation's newest change; seq 0 if it has none in
+    the log. Both are read here, so they come from the same database.
+    """
+    updated_at = db.session.execute(
+        select(Conversation.updated_at).where(Conversation.id == conversation_id)
+    ).scalar()
+    change = latest_conversation_change(conversation_id)
+    if change is None:
+        return 0, updated_at
+    return change.seq, max(change.created_at, updated_at or change.created_at)
+
+
+def mark_messages_as_read(conversation_id: int, user_id: int) -> tuple[int, Optional[tuple], datetime]:
     """
     Mark all unread messages in a conversation as read for the given user.
-    Returns the number of messages marked as read.
+    Runs as a "read up to" watermark on the (sent_at, id) key, like history
+    pages (ids are not in send order under write-behind): one indexed probe
+    for the newest unread message, then a single set-based UPDATE for
+    everything up to it. Messages that arrive in between stay unread.
+    Returns (count, up_to, read_at); up_to is the (sent_at, message id) key,
+    or None when there was nothing to mark.
     """
-    # Find all unread messages in this conversation that were NOT sent by the user
-    unread_messages = Message.query.filter(
+    read_at = datetime.utcnow()
+    unread = (
         Message.conversation_id == conversation_id,
         Message.sender_id != user_id,
         Message.read_at.is_(None)
+    )
+
+    up_to = db.session.execute(
+        select(Message.sent_at, Message.id).where(*unread)
+        .order_by(Message.sent_at.desc(), Message.id.desc()).limit(1)
+    ).one_or_none()
+    if up_to is None:
+        return 0, None, read_at
+    up_to = tuple(up_to)
+
+    # Reading a message implies it was delivered
+    result = db.session.execute(
+        update(Message)
+        .where(*unread, tuple_(Message.sent_at, Message.id) <= tuple_(*up_to))
+        .values(read_at=read_at, delivered_at=func.coalesce(Message.delivered_at, read_at))
+        .execution_options(synchronize_session=False)
+    )
+    count = result.rowcount
+
+    # Drop the reader's unread counter without moving the conversation in the inbox
+    db.session.execute(
+        update(Conversation)
+        .where(Conversation.id == conversation_id)
+        .values(
+            updated_at=Conversation.updated_at,
+            user1_unread_count=case((Conversation.user1_id == user_id, _decrement(Conversation.user1_unread_count, count)),
+                                    else_=Conversation.user1_unread_count),
+            user2_unread_count=case((Conversation.user2_id == user_id, _decrement(Conversation.user2_unread_count, count)),
+                                    else_=Conversation.user2_unread_count),
+        )
+        .execution_options(synchronize_session=False)
+    )
+    record_changes([(conversation_id, 'read', user_id, up_to[1], up_to[0])])
+    db.session.commit()
+    response_cache.invalidate_conversation(conversation_id)
+    replicas.note_write([user_id])
+
+    return count, up_to, read_at
+
+
+def _decrement(column, amount: int):
+    """SQL expression for max(column - amount, 0) that works on every backend"""
+    return case((column > amount, column - amount), else_=0)
+
+
+
+def get_conversation_for_user(conversation_id: int, user_id: int) -> Optional[Conversation]:
+    """
+    Get a conversation if the user takes part in it, as one of the pair or as
+    a group member. Returns None otherwise.
+    """
+    conversation = db.session.get(Conversation, conversation_id)
+    if conversation is None:
+        return None
+    if conversation.is_group:
+        return conversation if user_id in get_group_member_ids(conversation_id) else None
+    return conversation if user_id in (conversation.user1_id, conversation.user2_id) else None
+
+
+def is_group_conversation(conversation_id: int) -> bool:
+    is_group = _conversation_kinds.get(conversation_id)
+    if is_group is None:
+        is_group = bool(db.session.execute(
+            select(Conversation.is_group).where(Conversation.id == conversation_id)
+        ).scalar())
+        _conversation_kinds.set(conversation_id, is_group)
+    return is_group
+
+
+def create_group(creator_id: int, name: str, member_ids: Iterable[int]) -> Conversation:
+    """
+    Create a group conversation owned by creator_id with the given members.
+    Raises ValueError for unknown users or too many members.
+    """
+    member_ids = set(member_ids) - {creator_id}
+    _check_group_size(len(member_ids) + 1)
+    _check_users_exist(member_ids)
+
+    now = datetime.utcnow()
+    conversation = Conversation(is_group=True, name=name, created_at=now, updated_at=now) # type: ignore
+    db.session.add(conversation)
+    db.session.flush()
+
+    db.session.add(ConversationMember(conversation_id=conversation.id, user_id=creator_id, # type: ignore
+                                      role='owner', joined_at=now)) # type: ignore
+    db.session.add_all([
+        ConversationMember(conversation_id=conversation.id, user_id=user_id, joined_at=now) # type: ignore
+        for user_id in member_ids
+    ])
+    record_changes((conversation.id, 'member_added', user_id, None, None) for user_id in [creator_id, *member_ids])
+    db.session.commit()
+
+    _conversation_kinds.set(conversation.id, True)
+    replicas.note_write([creator_id, *member_ids])
+    log_event('group_created', conversation_id=conversation.id, creator_id=creator_id,
+              members=len(member_ids) + 1)
+    return conversation
+
+
+def add_group_members(conversation_id: int, user_ids: Iterable[int]) -> list[int]:
+    """
+    Add members to a group. New members start with both watermarks at the
+    group's latest message, so they are not flooded with earlier history as
+    "undelivered". Returns the ids that were actually added.
+    """
+    existing = get_group_member_ids(conversation_id)
+    new_ids = sorted(set(user_ids) - existing)
+    if not new_ids:
+        return []
+    _check_group_size(len(existing) + len(new_ids))
+    _check_users_exist(new_ids)
+
+    last_message_id, last_sent_at = db.session.execute(
+        select(conversations_table.c.last_message_id, messages_table.c.sent_at)
+        .select_from(conversations_table.outerjoin(
+            messages_table, messages_table.c.id == conversations_table.c.last_message_id))
+        .where(conversations_table.c.id == conversation_id)
+    ).one()
+    now = datetime.utcnow()
+    db.session.execute(insert(ConversationMember), [
+        {
+            'conversation_id': conversation_id,
+            'user_id': user_id,
+            'role': 'member',
+            'joined_at': now,
+            'last_delivered_message_id': last_message_id,
+            'last_delivered_sent_at': last_sent_at,
+            'last_read_message_id': last_message_id,
+            'last_read_sent_at': last_sent_at,
+            'unread_count': 0,
+        }
+        for user_id in new_ids
+    ])
+    record_changes((conversation_id, 'member_added', user_id, None, None) for user_id in new_ids)
+    db.session.commit()
+
+    _group_members.pop(conversation_id)
+    replicas.note_write(new_ids)
+    return new_ids
+
+
+def remove_group_member(conversation_id: int, user_id: int) -> bool:
+    result = db.session.execute(
+        delete(ConversationMember).where(
+            ConversationMember.conversation_id == conversation_id,
+            ConversationMember.user_id == user_id
+        )
+    )
+    if result.rowcount:
+        record_changes([(conversation_id, 'member_removed', user_id, None, None)])
+    db.session.commit()
+    _group_members.pop(conversation_id)
+    replicas.note_write([user_id])
+    return result.rowcount > 0
+
+
+def get_group_member(conversation_id: int, user_id: int) -> Optional[ConversationMember]:
+    return db.session.get(ConversationMember, (conversation_id, user_id))
+
+
+def get_group_members(conversation_id: int) -> list[ConversationMember]:
+    return ConversationMember.query.filter_by(conversation_id=conversation_id).order_by(
+        ConversationMember.joined_at, ConversationMember.user_id
     ).all()
 
-    # Mark them as read
-    count = 0
-    for message in unread_messages:
-        message.read_at = datetime.utcnow()
-        count += 1
 
-    if count > 0:
-        db.session.commit()
+def get_group_member_ids(conversation_id: int) -> frozenset:
+    """
+    Get the ids of a group's members. Served from a short-lived per-node
+    cache on the send path; changes made on this node drop the entry.
+    """
+    member_ids = _group_members.get(conversation_id)
+    if member_ids is None:
+        member_ids = frozenset(db.session.execute(
+            select(ConversationMember.user_id).where(ConversationMember.conversation_id == conversation_id)
+        ).scalars())
+        _group_members.set(conversation_id, member_ids)
+    return member_ids
+
+
+def get_user_group_ids(user_id: int) -> list[int]:
+    return list(db.session.execute(
+        select(ConversationMember.conversation_id).where(ConversationMember.user_id == user_id)
+    ).scalars())
+
+
+def conversation_partners(user_id: int, user_ids: Iterable[int]) -> set[int]:
+    """
+    The users among user_ids that share a 1:1 or group conversation with
+    user_id (user_id itself included). Cached 1:1 pairs need no query; the
+    rest take at most one query for 1:1 conversations and one for groups.
+    """
+    candidates = set(user_ids)
+    partners = candidates & {user_id}
+    unknown = []
+    for other in candidates - partners:
+        if _conversation_ids.get((min(user_id, other), max(user_id, other))) is not None:
+            partners.add(other)
+        else:
+            unknown.append(other)
+    if not unknown:
+        return partners
+
+    for conversation_id, user1_id, user2_id in db.session.execute(
+        select(Conversation.id, Conversation.user1_id, Conversation.user2_id).where(or_(
+            and_(Conversation.user1_id == user_id, Conversation.user2_id.in_(unknown)),
+            and_(Conversation.user2_id == user_id, Conversation.user1_id.in_(unknown)),
+        ))
+    ):
+        _conversation_ids.set((user1_id, user2_id), conversation_id)
+        partners.add(user2_id if user1_id == user_id else user1_id)
+
+    unknown = [other for other in unknown if other not in partners]
+    if unknown:
+        mine, theirs = members_table.alias('mine'), members_table.alias('theirs')
+        partners.update(db.session.execute(
+            select(theirs.c.user_id).distinct()
+            .select_from(mine.join(theirs, theirs.c.conversation_id == mine.c.conversation_id))
+            .where(mine.c.user_id == user_id, theirs.c.user_id.in_(unknown))
+        ).scalars())
+    return partners
+
+
+def _check_group_size(size: int):
+    if size > Config.GROUP_MAX_MEMBERS:
+        raise ValueError(f'Groups are limited to {Config.GROUP_MAX_MEMBERS} members')
+
+
+def _check_users_exist(user_ids: Iterable[int]):
+    user_ids = set(user_ids)
+    if not user_ids:
+        return
+    found = set(db.session.execute(select(User.id).where(User.id.in_(user_ids))).scalars())
+    missing = user_ids - found
+    if missing:
+        raise ValueError(f'Unknown user ids: {sorted(missing)}')
+
+
+def iter_undelivered_group_message_chunks(user_id: int, chunk_size: int = 200) -> Iterator[list[MessageRow]]:
+    """
+    Stream group messages past the user's delivered watermarks, oldest first
+    on the (sent_at, id) key across all of their groups, in chunks of at
+    most `chunk_size`.
+    """
+    messages, members = messages_table, members_table
+    delivered_at, delivered_id = members.c.last_delivered_sent_at, members.c.last_delivered_message_id
+    base = select(*MESSAGE_COLUMNS).select_from(
+        messages.join(members, and_(members.c.conversation_id == messages.c.conversation_id,
+                                    members.c.user_id == user_id))
+    ).where(
+        or_(delivered_at.is_(None),
+            tuple_(messages.c.sent_at, messages.c.id) > tuple_(delivered_at, delivered_id)),
+        messages.c.sender_id != user_id,
+        # Live group messages are never read row by row; imported history is stored read
+        messages.c.read_at.is_(None)
+    )
+
+    last_key = None
+    while True:
+        statement = base
+        if last_key:
+            statement = statement.where(tuple_(messages.c.sent_at, messages.c.id) > tuple_(*last_key))
+        chunk = fetch_rows(MessageRow, statement.order_by(messages.c.sent_at, messages.c.id).limit(chunk_size))
+        if not chunk:
+            return
+
+        yield chunk
+
+        if len(chunk) < chunk_size:
+            return
+        last_key = (chunk[-1].sent_at, chunk[-1].id)
+
+
+def _watermark(kind: str) -> tuple:
+    """(sent_at, message id) columns of the member's 'delivered' or 'read' watermark"""
+    return (getattr(ConversationMember, f'last_{kind}_sent_at'),
+            getattr(ConversationMember, f'last_{kind}_message_id'))
+
+
+def _before(watermark: tuple, sent_at: datetime, message_id: int):
+    """The watermark is unset or older than (sent_at, message_id)"""
+    return or_(watermark[0].is_(None), tuple_(*watermark) < tuple_(sent_at, message_id))
+
+
+def advance_delivered_watermarks(conversation_id: int, user_ids: Iterable[int], message_id: int,
+                                 sent_at: datetime) -> int:
+    """
+    Record that the given members have received everything up to the message
+    (sent_at, message_id), with a single UPDATE. Watermarks never move backwards.
+    """
+    user_ids = list(user_ids)
+    if not user_ids:
+        return 0
+
+    result = db.session.execute(
+        update(ConversationMember)
+        .where(
+            ConversationMember.conversation_id == conversation_id,
+            ConversationMember.user_id.in_(user_ids),
+            _before(_watermark('delivered'), sent_at, message_id)
+        )
+        .values(last_delivered_message_id=message_id, last_delivered_sent_at=sent_at)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    return result.rowcount
+
+
+def mark_group_messages_delivered(user_id: int, chunk: list[MessageRow]) -> int:
+    """Advance the user's watermark in each group that appears in a delivered chunk"""
+    # Chunks come oldest first, so the last message of each group is its newest
+    newest = {message.conversation_id: message for message in chunk}
+
+    return sum(
+        advance_delivered_watermarks(conversation_id, [user_id], message.id, message.sent_at)
+        for conversation_id, message in newest.items()
+    )
+
+
+def mark_group_read(conversation_id: int, user_id: int) -> tuple[int, Optional[tuple], datetime]:
+    """
+    Move the member's read watermark to the group's latest message.
+    Same contract as mark_messages_as_read: returns (count, up_to, read_at),
+    count being the unread messages that were cleared.
+    """
+    read_at = datetime.utcnow()
+    members, conversations = members_table, conversations_table
+    member = db.session.execute(
+        select(members.c.unread_count, members.c.last_read_sent_at, members.c.last_read_message_id,
+               conversations.c.last_message_id, messages_table.c.sent_at)
+        .select_from(members
+                     .join(conversations, conversations.c.id == members.c.conversation_id)
+                     .join(messages_table, messages_table.c.id == conversations.c.last_message_id))
+        .where(members.c.conversation_id == conversation_id, members.c.user_id == user_id)
+    ).one_or_none()
+
+    # Not a member, or nothing sent yet
+    if member is None:
+        return 0, None, read_at
+
+    up_to = (member.sent_at, member.last_message_id)
+    # A message that commits late can sit behind the newest one and still bump the counter
+    caught_up = member.last_read_sent_at is not None and \
+        (member.last_read_sent_at, member.last_read_message_id) >= up_to
+    if caught_up and not member.unread_count:
+        return 0, None, read_at
+
+    count = member.unread_count
+
+    # Messages that arrive in between keep their share of the counter
+    values = {'unread_count': _decrement(ConversationMember.unread_count, count)}
+    for kind in ('read', 'delivered'):
+        watermark = _watermark(kind)
+        behind = _before(watermark, *up_to)
+        values[watermark[0].key] = case((behind, up_to[0]), else_=watermark[0])
+        values[watermark[1].key] = case((behind, up_to[1]), else_=watermark[1])
+    db.session.execute(
+        update(ConversationMember)
+        .where(ConversationMember.conversation_id == conversation_id,
+               ConversationMember.user_id == user_id)
+        .values(values)
+        .execution_options(synchronize_session=False)
+    )
+    record_changes([(conversation_id, 'read', user_id, up_to[1], up_to[0])])
+    db.session.commit()
+    response_cache.invalidate_conversation(conversation_id)
+    replicas.note_write([user_id])
+
+    return count, up_to, read_at
+
+
+def save_last_seen(last_seen: dict[int, datetime]):
+    """Write many users' last-seen times with one bulk UPDATE by primary key"""
+    if not last_seen:
+        return
+    db.session.execute(update(User), [
+        {'id': user_id, 'last_seen_at': seen_at} for user_id, seen_at in last_seen.items()
+    ])
+    db.session.commit()
+
 
-    return count
\ No newline at end of file
+def get_last_seen(user_ids: list[int]) -> dict[int, Optional[datetime]]:
+    return dict(db.session.execute(
+        select(User.id, User.last_seen_at).where(User.id.in_(user_ids))
+    ).all())
@@ -0,0 +1,201 @@
+"""
+Acknowledged delivery of 1:1 messages.
+
+A message counts as delivered when a device acknowledges it, not when the
+server emits it. The router hands `new_message` / `new_messages` events
+for the sockets of this node to the DeliveryTracker, which emits them with
+a Socket.IO ack callback and keeps them in a pending table:
+
+  - an event that is not acknowledged within ACK_TIMEOUT_SECONDS is sent
+    again to the user's current sockets on this node, with the timeout
+    doubling each time, for at most ACK_MAX_ATTEMPTS sends. After that, or
+    once the user has no socket left here, it is dropped and the messages
+    wait in the offline queue for the next connect.
+  - acknowledged ids are written every ACK_FLUSH_INTERVAL_MS with one
+    UPDATE per batch (persist_delivery_acks). Ids whose row is not committed
+    yet (write-behind) are retried on the next flushes for up to
+    ACK_PERSIST_TIMEOUT_SECONDS.
+  - senders get `message_delivered` for the ids a flush wrote.
+
+Delivery is at least once: a resend can cross a late ack, so clients drop
+duplicates by message_id. Group messages keep per-member watermarks and are
+not tracked here.
+"""
+import itertools
+import threading
+import time
+from datetime import datetime
+from functools import partial
+from typing import Callable, Optional
+
+from utils.database import persist_delivery_acks
+from utils.log import log_event
+from utils.metrics import metrics
+from utils.routing import Router, router
+
+delivery_acks_total = metrics.counter(
+    'chat_delivery_acks_total', 'Tracked deliveries by outcome (acked, resent, expired, persisted, dropped)',
+    ('outcome',))
+
+# (message_id, sender_id)
+TrackedMessage = tuple[int, int]
+
+
+class _Pending:
+    __slots__ = ('user_id', 'event', 'payload', 'messages', 'attempts', 'deadline')
+
+    def __init__(self, user_id: int, event: str, payload: dict, messages: list, deadline: float):
+        self.user_id = user_id
+        self.event = event
+        self.payload = payload
+        self.messages = messages
+        self.attempts = 1
+        self.deadline = deadline
+
+
+class DeliveryTracker:
+    def __init__(self, router: Router, timeout: float = 10.0, max_attempts: int = 3,
+                 flush_interval: float = 0.2, persist_timeout: float = 30.0):
+        self.router = router
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        self.flush_interval = flush_interval
+        self.persist_timeout = persist_timeout
+        self.app = None
+        self._emit: Optional[Callable] = None
+        self._sleep: Callable[[float], None] = time.sleep
+        self._lock = threading.Lock()
+        self._tokens = itertools.count(1)
+
+        # token -> event waiting for an ack from any of the user's sockets
+        self._pending: dict[int, _Pending] = {}
+        # message_id -> (sender_id, monotonic time of the first ack), waiting for the next flush
+        self._acked: dict[int, tuple[int, float]] = {}
+
+        self._running = False
+
+    def init_app(self, app, socketio):
+        config = app.config
+        self.app = app
+        self.timeout = config['ACK_TIMEOUT_SECONDS']
+        self.max_attempts = config['ACK_MAX_ATTEMPTS']
+        self.flush_interval = config['ACK_FLUSH_INTERVAL_MS'] / 1000
+        self.persist_timeout = config['ACK_PERSIST_TIMEOUT_SECONDS']
+        # The server's emit hands ack callbacks the client's arguments without a request context
+        self._emit = partial(socketio.server.emit, namespace='/')
+        self._sleep = socketio.sleep
+        self.router.track_deliveries(self.send)
+        if not self._running:
+            self._running = True
+            socketio.start_background_task(self._run)
+
+    def stop(self):
+        """Stop the loop and write out the acks received so far"""
+        self._running = False
+        self.flush()
+
+    def send(self, user_id: int, sids: list[str], event: str, payload: dict, messages: list[TrackedMessage]):
+        """Emit an event to these sockets and wait for one of them to acknowledge it"""
+        token = next(self._tokens)
+        with self._lock:
+            self._pending[token] = _Pending(user_id, event, payload, messages, time.monotonic() + self.timeout)
+        self._send(token, sids, event, payload)
+
+    def _send(self, token: int, sids: list[str], event: str, payload: dict):
+        for sid in sids:
+            self._emit(event, payload, to=sid, callback=partial(self.acked, token))
+
+    def acked(self, token: int, *args):
+        """Ack callback: the first ack from any device settles the event"""
+        now = time.monotonic()
+        with self._lock:
+            pending = self._pending.pop(token, None)
+            if pending is None:
+                return
+            for message_id, sender_id in pending.messages:
+                self._acked.setdefault(message_id, (sender_id, now))
+        delivery_acks_total.inc('acked', amount=len(pending.messages))
+
+    def pending(self) -> int:
+        return len(self._pending)
+
+    # Timeouts
+
+    def expire(self):
+        """Resend events whose ack is overdue; give up on those out of attempts"""
+        now = time.monotonic()
+        resend = []
+        with self._lock:
+            for token, pending in list(self._pending.items()):
+                if pending.deadline > now:
+                    continue
+                sids = self.router.registry.sids_for(pending.user_id)
+                if pending.attempts >= self.max_attempts or not sids:
+                    del self._pending[token]
+                    delivery_acks_total.inc('expired')
+                    continue
+                pending.attempts += 1
+                pending.deadline = now + self.timeout * 2 ** (pending.attempts - 1)
+                resend.append((token, sids, pending))
+
+        for token, sids, pending in resend:
+            self._send(token, sids, pending.event, pending.payload)
+            delivery_acks_total.inc('resent')
+            log_event('delivery_resent', user_id=pending.user_id, messages=len(pending.messages),
+                      attempt=pending.attempts)
+
+    # Flushing
+
+    def _run(self):
+        while self._running:
+            self._sleep(self.flush_interval)
+            try:
+                self.expire()
+                self.flush()
+            except Exception as e:
+                log_event('delivery_flush_failed', 'error', error=str(e))
+
+    def flush(self):
+        """Write acknowledged deliveries with one UPDATE and send the senders their receipts"""
+        with self._lock:
+            acked, self._acked = self._acked, {}
+        if not acked or self.app is None:
+            return
+
+        try:
+            with self.app.app_context():
+                delivered, missing = persist_delivery_acks(sorted(acked))
+        except Exception as e:
+            with self._lock:
+                for message_id, entry in acked.items():
+                    self._acked.setdefault(message_id, entry)
+            log_event('delivery_ack_flush_failed', 'error', messages=len(acked), error=str(e))
+            return
+
+        # Rows still in the write-behind queue: keep their acks for the next flush
+        now = time.monotonic()
+        dropped = 0
+        with self._lock:
+            for message_id in missing:
+                sender_id, acked_at = acked[message_id]
+                if now - acked_at < self.persist_timeout:
+                    self._acked.setdefault(message_id, (sender_id, acked_at))
+                else:
+                    dropped += 1
+        if dropped:
+            delivery_acks_total.inc('dropped', amount=dropped)
+            log_event('delivery_ack_dropped', 'warning', messages=dropped)
+
+        delivered_at = datetime.utcnow().isoformat()
+        for message_id in delivered:
+            sender_id, _ = acked[message_id]
+            self.router.deliver(sender_id, 'message_delivered', {
+                'message_id': message_id,
+                'delivered_at': delivered_at
+            })
+        if delivered:
+            delivery_acks_total.inc('persisted', amount=len(delivered))
+
+
+# Process-wide tracker used by the router and the Socket.IO handlers
+delivery = DeliveryTracker(router)
@@ -0,0 +1,114 @@
+"""
+Conditional GETs and a small response cache for the polled read endpoints.
+
+Validators come from the change log (utils/sync.py), never from messages:
+  - GET /api/conversations: the newest change visible to the user
+  - GET /api/messages: the conversation's newest change and its updated_at
+
+A request carrying a matching If-None-Match / If-Modified-Since gets a
+304 Not Modified after those lookups alone. A change younger than
+SYNC_SETTLE_SECONDS may still be followed by a lower seq committing late,
+so such responses go out without validators and are not cached.
+
+The response cache keeps serialized bodies keyed on (user, endpoint, params)
+with the ETag they were built for. A hit still needs the current ETag, which
+keeps it correct across workers; save_message and the read paths also drop
+a conversation's entries from the local cache straight away.
+"""
+import hashlib
+import threading
+from datetime import datetime, timedelta
+from typing import Callable, Hashable, Iterable, Optional
+
+from flask import Response, jsonify, request
+from werkzeug.http import is_resource_modified
+
+from utils.cache import LRUCache
+from utils.metrics import http_cache_total
+
+
+class ResponseCache:
+    def __init__(self, maxsize: int = 2048):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        # key -> (etag, body)
+        self._entries = LRUCache(maxsize=maxsize)
+        # conversation_id -> keys of the entries that include it
+        self._keys_by_conversation = LRUCache(maxsize=maxsize)
+
+    def init_app(self, app):
+        self.maxsize = app.config['RESPONSE_CACHE_SIZE']
+        self._entries = LRUCache(maxsize=self.maxsize)
+        self._keys_by_conversation = LRUCache(maxsize=self.maxsize)
+
+    def get(self, key: Hashable, etag: str) -> Optional[bytes]:
+        entry = self._entries.get(key)
+        if entry is None or entry[0] != etag:
+            return None
+        return entry[1]
+
+    def set(self, key: Hashable, etag: str, body: bytes, conversation_ids: Iterable[int]):
+        if not self.maxsize:
+            return
+        self._entries.set(key, (etag, body))
+        with self._lock:
+            for conversation_id in conversation_ids:
+                keys = self._keys_by_conversation.get(conversation_id)
+                if keys is None:
+                    keys = set()
+                    self._keys_by_conversation.set(conversation_id, keys)
+                keys.add(key)
+
+    def invalidate_conversation(self, conversation_id: int):
+        with self._lock:
+            keys = self._keys_by_conversation.pop(conversation_id) or ()
+        for key in keys:
+            self._entries.pop(key)
+
+    def stats(self) -> dict:
+        return self._entries.stats()
+
+
+# Process-wide cache used by the REST endpoints
+response_cache = ResponseCache()
+
+
+def make_etag(key: Hashable, seq: int) -> str:
+    return hashlib.sha1(f'{key!r}|{seq}'.encode()).hexdigest()[:20]
+
+
+def conditional_json(key: Hashable, seq: Optional[int], last_modified: Optional[datetime],
+                     settle_seconds: float, build: Callable[[], tuple[dict, Iterable[int]]]) -> Response:
+    """
+    Answer a GET from its validators: 304 if the client's copy is current,
+    else the cached body, else build() -> (payload, conversation ids in it).
+    `seq` / `last_modified` describe the newest change behind the response.
+    """
+    settled = seq is not None and last_modified is not None and \
+        last_modified <= datetime.utcnow() - timedelta(seconds=settle_seconds)
+    if not settled:
+        payload, _ = build()
+        response = jsonify(payload)
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+
+    etag = make_etag(key, seq)
+    if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        http_cache_total.inc(request.endpoint, 'not_modified')
+        response = Response(status=304)
+    else:
+        body = response_cache.get(key, etag)
+        if body is not None:
+            http_cache_total.inc(request.endpoint, 'hit')
+            response = Response(body, mimetype='application/json')
+        else:
+            http_cache_total.inc(request.endpoint, 'miss')
+            payload, conversation_ids = build()
+            response = jsonify(payload)
+            response_cache.set(key, etag, response.get_data(), conversation_ids)
+
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.vary.add('Authorization')
+    return response
@@ -1,8 +1,20 @@
 import jwt
+import hashlib
+import threading
+import time
 from datetime import datetime, timedelta
 from config import Config
+from utils.cache import LRUCache
 
 secret = Config.SECRET_KEY
+
+# sha256(token) -> (claims, exp). Entries never outlive the token's own exp.
+_token_cache = LRUCache(maxsize=Config.TOKEN_CACHE_SIZE, ttl=Config.TOKEN_CACHE_TTL)
+
+# sha256(token) -> exp, for tokens revoked before they expire
+_revoked = {}
+_revoked_lock = threading.Lock()
+
 def generate_token(user_id,email):
     payload = {
     'user_id': user_id,
@@ -14,11 +26,56 @@ def generate_token(user_id,email):
 
     return token
 
+def _digest(token):
+    return hashlib.sha256(token.encode()).hexdigest()
+
 def decode_token(token):
+    digest = _digest(token)
+    if digest in _revoked:
+        raise Exception('Token has been revoked')
+
+    if Config.TOKEN_CACHE_SIZE > 0:
+        cached = _token_cache.get(digest)
+        if cached:
+            claims, exp = cached
+            if exp > time.time():
+                return dict(claims)
+            _token_cache.pop(digest)
+            raise Exception('Token has expired')
+
     try:
         decoded = jwt.decode(token, secret, algorithms=['HS256'])
-        return {'user_id': decoded['user_id'], 'email': decoded['email']}
     except jwt.ExpiredSignatureError:
         raise Exception('Token has expired')
     except jwt.InvalidTokenError:
-        raise Exception('Invalid token')
\ No newline at end of file
+        raise Exception('Invalid token')
+
+    claims = {'user_id': decoded['user_id'], 'email': decoded['email']}
+
+    if Config.TOKEN_CACHE_SIZE > 0:
+        exp = decoded.get('exp')
+        remaining = exp - time.time() if exp else Config.TOKEN_CACHE_TTL
+        if remaining > 0:
+            _token_cache.set(digest, (claims, exp or float('inf')), ttl=min(remaining, Config.TOKEN_CACHE_TTL))
+
+    return dict(claims)
+
+def revoke_token(token):
+    """Reject a token from now on, even if its signature and exp are still valid"""
+    try:
+        exp = jwt.decode(token, secret, algorithms=['HS256'], options={'verify_exp': False}).get('exp')
+    except jwt.InvalidTokenError:
+        return
+    digest = _digest(token)
+    now = time.time()
+    with _revoked_lock:
+        # Expired tokens fail verification anyway, so their entries can go
+        for expired in [d for d, e in _revoked.items() if e <= now]:
+            del _revoked[expired]
+        _revoked[digest] = exp or float('inf')
+    _token_cache.pop(digest)
+
+def token_cache_stats():
+    stats = _token_cache.stats()
+    stats['revoked'] = len(_revoked)
+    return stats
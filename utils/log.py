@@ -0,0 +1,112 @@
+"""
+Structured, non-blocking logging for the message path.
+
+Handlers only put records on an in-memory queue; a QueueListener thread
+formats them and does the actual stream I/O. Events are emitted as one
+JSON object per line, can be sampled per event name, and never carry
+message content unless LOG_MESSAGE_CONTENT is enabled.
+"""
+import atexit
+import json
+import logging
+import queue
+import random
+import sys
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional
+
+logger = logging.getLogger('chat')
+
+_sample_rates: dict[str, float] = {}
+_include_content = False
+_listener: Optional[QueueListener] = None
+
+LEVELS = {
+    'debug': logging.DEBUG,
+    'info': logging.INFO,
+    'warning': logging.WARNING,
+    'error': logging.ERROR,
+}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(),
+            'level': record.levelname.lower(),
+            'event': record.getMessage(),
+        }
+        entry.update(getattr(record, 'fields', {}))
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        fields = ' '.join(f'{k}={v}' for k, v in getattr(record, 'fields', {}).items())
+        return f'{record.levelname.lower():7} {record.getMessage()} {fields}'.rstrip()
+
+
+def parse_sample_rates(spec: str) -> dict[str, float]:
+    """Parse 'message_sent=0.01,message_delivered=0.1' into a dict"""
+    rates = {}
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        event, _, rate = item.partition('=')
+        rates[event.strip()] = float(rate)
+    return rates
+
+
+def configure_logging(level: str = 'info', fmt: str = 'json', sample_rates: str = '',
+                      include_content: bool = False, stream=None):
+    """Route the 'chat' logger through a queue to a background listener"""
+    global _listener, _include_content, _sample_rates
+
+    if _listener is None:
+        atexit.register(stop_logging)
+    else:
+        stop_logging()
+
+    _sample_rates = parse_sample_rates(sample_rates)
+    _include_content = include_content
+
+    handler = logging.StreamHandler(stream or sys.stdout)
+    handler.setFormatter(JsonFormatter() if fmt == 'json' else TextFormatter())
+
+    records: queue.SimpleQueue = queue.SimpleQueue()
+    logger.handlers = [QueueHandler(records)]
+    logger.setLevel(LEVELS.get(level.lower(), logging.INFO))
+    logger.propagate = False
+
+    _listener = QueueListener(records, handler, respect_handler_level=True)
+    _listener.start()
+
+
+def stop_logging():
+    """Flush queued records and stop the listener thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def log_event(event: str, level: str = 'info', content: Optional[str] = None, **fields):
+    """
+    Log a structured event. Cheap when the level is disabled or the event is
+    sampled out. `content` is only recorded when LOG_MESSAGE_CONTENT is on.
+    """
+    levelno = LEVELS[level]
+    if not logger.isEnabledFor(levelno):
+        return
+
+    rate = _sample_rates.get(event)
+    if rate is not None and random.random() >= rate:
+        return
+
+    if content is not None and _include_content:
+        fields['content'] = content[:50]
+    if rate is not None:
+        fields['sample_rate'] = rate
+
+    logger.log(levelno, event, extra={'fields': fields})
@@ -0,0 +1,198 @@
+"""
+Minimal in-process metrics with Prometheus text exposition.
+
+Counters and histograms are updated on the hot path; gauges are read from
+callbacks at scrape time. When metrics are disabled every update is a
+single attribute check and timed() hands back a shared no-op context
+manager.
+"""
+import threading
+import time
+from typing import Callable, Optional
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = '') -> str:
+    parts = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, registry: 'MetricsRegistry', name: str, help: str, labelnames: tuple = ()):
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def header(self) -> list[str]:
+        return [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, *labels, amount: float = 1):
+        if not self.registry.enabled:
+            return
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = self.header()
+        for labels, value in sorted(self._values.items()):
+            lines.append(f'{self.name}{_format_labels(self.labelnames, labels)} {value}')
+        return lines
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, *args, buckets: tuple = DEFAULT_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(buckets)
+        # labels -> [count per bucket..., +Inf count, sum]
+        self._values: dict[tuple, list] = {}
+
+    def observe(self, value: float, *labels):
+        if not self.registry.enabled:
+            return
+        with self._lock:
+            row = self._values.get(labels)
+            if row is None:
+                row = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    row[i] += 1
+                    break
+            else:
+                row[len(self.buckets)] += 1
+            row[-1] += value
+
+    def time(self, *labels):
+        if not self.registry.enabled:
+            return _NOOP_TIMER
+        return _Timer(self, labels)
+
+    def render(self) -> list[str]:
+        lines = self.header()
+        for labels, row in sorted(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), row[:-1]):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labelnames, labels)} {row[-1]}')
+            lines.append(f'{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}')
+        return lines
+
+
+class Gauge(_Metric):
+    """Value read from a callback at scrape time"""
+    kind = 'gauge'
+
+    def __init__(self, *args, callback: Callable[[], float], **kwargs):
+        super().__init__(*args, **kwargs)
+        self.callback = callback
+
+    def render(self) -> list[str]:
+        try:
+            value = self.callback()
+        except Exception:
+            return []
+        lines = self.header()
+        if isinstance(value, dict):
+            for labels, item in sorted(value.items()):
+                labels = labels if isinstance(labels, tuple) else (labels,)
+                lines.append(f'{self.name}{_format_labels(self.labelnames, labels)} {item}')
+        else:
+            lines.append(f'{self.name} {value}')
+        return lines
+
+
+class _Timer:
+    __slots__ = ('histogram', 'labels', 'start')
+
+    def __init__(self, histogram: Histogram, labels: tuple):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labels)
+        return False
+
+
+class _NoopTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOOP_TIMER = _NoopTimer()
+
+
+class MetricsRegistry:
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self._metrics: dict[str, _Metric] = {}
+
+    def _register(self, metric: _Metric) -> _Metric:
+        existing = self._metrics.get(metric.name)
+        if existing is not None:
+            return existing
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: tuple = ()) -> Counter:
+        return self._register(Counter(self, name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: tuple = (),
+                  buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(self, name, help, labelnames, buckets=buckets))
+
+    def gauge(self, name: str, help: str, callback: Callable[[], float],
+              labelnames: tuple = ()) -> Gauge:
+        gauge = Gauge(self, name, help, labelnames, callback=callback)
+        self._metrics[name] = gauge
+        return gauge
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+# Process-wide registry; enabled from config in create_app
+metrics = MetricsRegistry()
+
+stage_seconds = metrics.histogram(
+    'chat_stage_seconds', 'Time spent in each stage of the socket and REST hot paths', ('stage',))
+events_total = metrics.counter(
+    'chat_events_total', 'Socket events handled, by event and outcome', ('event', 'outcome'))
+http_request_seconds = metrics.histogram(
+    'chat_http_request_seconds', 'REST request latency', ('endpoint', 'status'))
+http_cache_total = metrics.counter(
+    'chat_http_cache_total', 'Conditional GETs by outcome (not_modified, hit, miss)', ('endpoint', 'outcome'))
+
+
+def timed(stage: str):
+    """Context manager that records the block's duration under chat_stage_seconds{stage=...}"""
+    return stage_seconds.time(stage)
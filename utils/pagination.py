@@ -0,0 +1,50 @@
+"""
+Opaque keyset cursors.
+
+A cursor encodes the (timestamp, id) of the last row a client has seen so the
+next page can be fetched with an indexed range scan instead of OFFSET.
+Search results are ordered by relevance instead, so their cursors carry
+(rank, id).
+"""
+import base64
+from datetime import datetime
+
+
+def encode_cursor(timestamp: datetime, row_id: int) -> str:
+    """Encode a (timestamp, id) pair as a URL-safe cursor string"""
+    raw = f"{timestamp.isoformat()}|{row_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, int]:
+    """
+    Decode a cursor produced by encode_cursor.
+    Raises ValueError if the cursor is malformed.
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        raw = base64.urlsafe_b64decode(padded.encode()).decode()
+        timestamp, row_id = raw.rsplit('|', 1)
+        return datetime.fromisoformat(timestamp), int(row_id)
+    except Exception:
+        raise ValueError('Invalid cursor')
+
+
+def encode_rank_cursor(rank: float, row_id: int) -> str:
+    """Encode a (rank, id) pair; repr() keeps the float exact for the next comparison"""
+    raw = f"{rank!r}|{row_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_rank_cursor(cursor: str) -> tuple[float, int]:
+    """
+    Decode a cursor produced by encode_rank_cursor.
+    Raises ValueError if the cursor is malformed.
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        raw = base64.urlsafe_b64decode(padded.encode()).decode()
+        rank, row_id = raw.rsplit('|', 1)
+        return float(rank), int(row_id)
+    except Exception:
+        raise ValueError('Invalid cursor')
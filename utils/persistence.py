@@ -0,0 +1,287 @@
+"""
+Write-behind message persistence.
+
+When enabled, send_message no longer writes to the database inline. Each
+message is given its id up front, acknowledged and fanned out immediately,
+and queued for a background writer that group-commits queued messages in
+batches, bounded by size and by a time window. A batch that keeps failing
+is split until the rows at fault are found; those are kept in
+failed_messages and their senders are told.
+"""
+import queue
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Optional
+
+from sqlalchemy import func
+
+from models import db, Message
+from utils.database import save_messages_batch, save_failed_message, reserve_message_ids
+from utils.log import log_event
+
+
+class PipelineFull(Exception):
+    """Raised when the write queue stays full for longer than the enqueue timeout"""
+
+
+class PendingMessage:
+    """A message that has an id and timestamp but may not be committed yet"""
+
+    __slots__ = ('id', 'conversation_id', 'sender_id', 'content', 'sent_at', 'delivered_at')
+
+    def __init__(self, id, conversation_id, sender_id, content, sent_at, delivered_at=None):
+        self.id = id
+        self.conversation_id = conversation_id
+        self.sender_id = sender_id
+        self.content = content
+        self.sent_at = sent_at
+        self.delivered_at = delivered_at
+
+    def to_row(self) -> dict:
+        return {
+            'id': self.id,
+            'conversation_id': self.conversation_id,
+            'sender_id': self.sender_id,
+            'content': self.content,
+            'sent_at': self.sent_at,
+            'delivered_at': self.delivered_at,
+        }
+
+
+class IdAllocator:
+    """
+    Hands out message ids ahead of the INSERT.
+    On PostgreSQL ids are reserved in blocks from the messages id sequence, so
+    several workers can allocate safely. Other databases fall back to a
+    process-local counter seeded from MAX(id), which is only safe with a
+    single writer process and as long as every message insert takes its id
+    from here (bulk sends and imports do while write-behind is on).
+    """
+
+    def __init__(self, block_size: int = 1000):
+        self.block_size = block_size
+        self._lock = threading.Lock()
+        self._ids: list[int] = []
+        self._next_local: Optional[int] = None
+
+    def next_id(self) -> int:
+        with self._lock:
+            if not self._ids:
+                self._ids = self._reserve(self.block_size)
+            return self._ids.pop()
+
+    def next_ids(self, count: int) -> list[int]:
+        """`count` ids in ascending order, for bulk sends and imports while write-behind is on"""
+        with self._lock:
+            if len(self._ids) < count:
+                # A new block is above everything left in the current one, which is handed out first
+                self._ids = self._reserve(max(self.block_size, count - len(self._ids))) + self._ids
+            ids = self._ids[-count:][::-1]
+            del self._ids[len(self._ids) - count:]
+            return ids
+
+    def _reserve(self, count: int) -> list[int]:
+        """A block of `count` new ids, descending so that pop() hands them out in order"""
+        if db.engine.dialect.name == 'postgresql':
+            rows = reserve_message_ids(count)
+            db.session.commit()
+            return rows[::-1]
+
+        if self._next_local is None:
+            self._next_local = (db.session.query(func.max(Message.id)).scalar() or 0) + 1
+        start = self._next_local
+        self._next_local += count
+        return list(range(start + count - 1, start - 1, -1))
+
+
+class MessageWriter:
+    """
+    Background writer that drains a bounded queue of PendingMessages and
+    saves them with save_messages_batch.
+    """
+
+    def __init__(self, app, batch_size: int = 500, flush_interval: float = 0.02,
+                 max_queue: int = 10000, enqueue_timeout: float = 0.1,
+                 start_task: Optional[Callable] = None, on_failed: Optional[Callable] = None):
+        self.app = app
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.enqueue_timeout = enqueue_timeout
+        self.ids = IdAllocator(block_size=max(batch_size, 100))
+        self.batches_written = 0
+        self.messages_written = 0
+        self.failed = 0
+        self.dead_lettered = 0
+        self._on_failed = on_failed
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queue)
+        self._start_task = start_task or self._start_thread
+        self._stopping = False
+        self._stopped = threading.Event()
+        self._started = False
+
+    @staticmethod
+    def _start_thread(target):
+        thread = threading.Thread(target=target, name='message-writer', daemon=True)
+        thread.start()
+        return thread
+
+    def start(self):
+        if not self._started:
+            self._started = True
+            self._start_task(self._run)
+
+    def submit(self, conversation_id: int, sender_id: int, content: str,
+               delivered: bool = False) -> PendingMessage:
+        """
+        Assign an id and queue the message for writing.
+        Blocks for at most enqueue_timeout when the queue is full, then raises
+        PipelineFull so the caller can shed load.
+        Must be called inside an app context (id reservation may hit the database).
+        """
+        if self._stopping:
+            raise PipelineFull('Message writer is shutting down')
+
+        now = datetime.utcnow()
+        message = PendingMessage(
+            self.ids.next_id(), conversation_id, sender_id, content, now,
+            delivered_at=now if delivered else None
+        )
+        try:
+            self._queue.put(message, timeout=self.enqueue_timeout)
+        except queue.Full:
+            raise PipelineFull('Message queue is full')
+        return message
+
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    def flush(self):
+        """Block until every message queued so far has been written"""
+        self._queue.join()
+
+    def stop(self, timeout: float = 10.0):
+        """Stop accepting messages and drain the queue"""
+        if not self._started or self._stopping:
+            return
+        self._stopping = True
+        self._stopped.wait(timeout)
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if batch:
+                self._write(batch)
+                for _ in batch:
+                    self._queue.task_done()
+            elif self._stopping:
+                break
+        self._stopped.set()
+
+    def _collect(self) -> list[PendingMessage]:
+        """Wait for a first message, then gather more until the batch is full or the window closes"""
+        try:
+            batch = [self._queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch: list[PendingMessage], attempts: int = 3):
+        """
+        Save a batch, retrying it `attempts` times. If it still fails it is
+        written in halves, once each, down to single rows, so a bad row
+        (e.g. content PostgreSQL refuses) only costs itself.
+        """
+        rows = [message.to_row() for message in batch]
+        error = None
+        for attempt in range(1, attempts + 1):
+            with self.app.app_context():
+                try:
+                    save_messages_batch(rows)
+                    self.batches_written += 1
+                    self.messages_written += len(rows)
+                    return
+                except Exception as e:
+                    db.session.rollback()
+                    error = e
+            if attempt < attempts:
+                time.sleep(0.05 * attempt)
+
+        if len(batch) > 1:
+            middle = len(batch) // 2
+            self._write(batch[:middle], attempts=1)
+            self._write(batch[middle:], attempts=1)
+        else:
+            self._dead_letter(batch[0], error)
+
+    def _dead_letter(self, message: PendingMessage, error: Exception):
+        """Keep a message that cannot be saved in failed_messages and tell its sender"""
+        # The driver's own message; the wrapper's repeats the SQL and its parameters
+        reason = str(getattr(error, 'orig', None) or error).replace('\x00', '')[:1000]
+        self.failed += 1
+        kept = False
+        with self.app.app_context():
+            try:
+                save_failed_message(message.to_row(), reason)
+                self.dead_lettered += 1
+                kept = True
+            except Exception:
+                db.session.rollback()
+        log_event('persist_failed', 'error', message_id=message.id, sender_id=message.sender_id,
+                  conversation_id=message.conversation_id, dead_lettered=kept, error=reason)
+
+        if self._on_failed:
+            try:
+                self._on_failed(message, reason)
+            except Exception as e:
+                log_event('persist_failed_notify', 'error', message_id=message.id, error=str(e))
+
+    def stats(self) -> dict:
+        return {
+            'queued': self.pending(),
+            'batches_written': self.batches_written,
+            'messages_written': self.messages_written,
+            'failed': self.failed,
+            'dead_lettered': self.dead_lettered,
+        }
+
+
+_writer: Optional[MessageWriter] = None
+
+
+def init_message_writer(app, start_task: Optional[Callable] = None,
+                        on_failed: Optional[Callable] = None) -> Optional[MessageWriter]:
+    """
+    Create and start the process-wide writer if WRITE_BEHIND_ENABLED is set.
+    on_failed(message, error) is called for each message that could not be saved.
+    """
+    global _writer
+    config = app.config
+    if not config.get('WRITE_BEHIND_ENABLED'):
+        return None
+
+    _writer = MessageWriter(
+        app,
+        batch_size=config['WRITE_BEHIND_BATCH_SIZE'],
+        flush_interval=config['WRITE_BEHIND_FLUSH_INTERVAL_MS'] / 1000,
+        max_queue=config['WRITE_BEHIND_MAX_QUEUE'],
+        enqueue_timeout=config['WRITE_BEHIND_ENQUEUE_TIMEOUT_MS'] / 1000,
+        start_task=start_task,
+        on_failed=on_failed
+    )
+    _writer.start()
+    return _writer
+
+
+def get_message_writer() -> Optional[MessageWriter]:
+    return _writer
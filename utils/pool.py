@@ -0,0 +1,179 @@
+"""
+Database connection pools: settings and instrumentation.
+
+configure_engines(app) runs before db.init_app and gives the primary and
+every replica bind the same pool settings (Flask-SQLAlchemy applies
+SQLALCHEMY_ENGINE_OPTIONS to the default bind only):
+
+  - DB_POOL_SIZE / DB_MAX_OVERFLOW / DB_POOL_TIMEOUT: connections kept open,
+    extra ones allowed under load, and how long a checkout waits for one
+    before raising
+  - DB_POOL_PRE_PING / DB_POOL_RECYCLE: test connections on checkout and
+    replace them after N seconds, so restarts and idle timeouts on the
+    server side do not surface as errors
+  - DB_STATEMENT_TIMEOUT_MS: PostgreSQL statement_timeout for every session
+  - DB_QUERY_CACHE_SIZE: SQLAlchemy's compiled-statement cache per engine
+
+Pools are TimedQueuePools: every checkout is timed into
+chat_db_pool_wait_seconds (waiting for a free connection, or opening a new
+one) and timeouts are counted. pool_stats() reports size, use, checkouts
+in progress and saturation per pool.
+
+Under eventlet with monkey patching (e.g. gunicorn -k eventlet) psycopg2 is
+switched to a wait callback that yields to the hub, so a greenlet blocked
+on a query no longer stalls every other greenlet, including the ones
+that would return a connection to the pool. psycopg2 does not allow COPY
+with a wait callback, so imports fall back to INSERT there.
+"""
+import threading
+import time
+
+from sqlalchemy import exc
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import QueuePool
+
+from utils.log import log_event
+from utils.metrics import metrics
+
+pool_wait_seconds = metrics.histogram(
+    'chat_db_pool_wait_seconds', 'Time spent waiting for a pooled database connection', ('pool',),
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0))
+pool_timeouts_total = metrics.counter(
+    'chat_db_pool_timeouts_total', 'Checkouts that gave up after DB_POOL_TIMEOUT', ('pool',))
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that times checkouts and keeps totals for pool_stats()"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.name = getattr(self, 'logging_name', None) or 'primary'
+        self._stats_lock = threading.Lock()
+        self._in_checkout = threading.local()
+        self.waiting = 0
+        self.checkouts = 0
+        self.wait_seconds = 0.0
+        self.max_wait = 0.0
+        self.timeouts = 0
+
+    def _do_get(self):
+        # QueuePool._do_get retries by calling itself; time the outer call only
+        if getattr(self._in_checkout, 'active', False):
+            return super()._do_get()
+
+        self._in_checkout.active = True
+        with self._stats_lock:
+            self.waiting += 1
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            with self._stats_lock:
+                self.timeouts += 1
+            pool_timeouts_total.inc(self.name)
+            log_event('db_pool_timeout', 'warning', pool=self.name, size=self.size(),
+                      overflow=self.overflow(), timeout=self._timeout)
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            self._in_checkout.active = False
+            with self._stats_lock:
+                self.waiting -= 1
+                self.checkouts += 1
+                self.wait_seconds += elapsed
+                self.max_wait = max(self.max_wait, elapsed)
+            pool_wait_seconds.observe(elapsed, self.name)
+
+    def capacity(self) -> int:
+        return self.size() + max(self._max_overflow, 0)
+
+    def stats(self) -> dict:
+        checked_out = self.checkedout()
+        with self._stats_lock:
+            return {
+                'size': self.size(),
+                'capacity': self.capacity(),
+                'checked_out': checked_out,
+                # QueuePool reports negative overflow until the pool has filled
+                'overflow': max(self.overflow(), 0),
+                'waiting': self.waiting,
+                'saturation': round(checked_out / self.capacity(), 3) if self.capacity() else 0.0,
+                'checkouts': self.checkouts,
+                'wait_seconds': round(self.wait_seconds, 6),
+                'max_wait_seconds': round(self.max_wait, 6),
+                'timeouts': self.timeouts,
+            }
+
+
+def engine_options(url: str, config: dict, name: str) -> dict:
+    """Engine keyword arguments for one database URL"""
+    options = {'query_cache_size': config['DB_QUERY_CACHE_SIZE']}
+    parsed = make_url(url)
+    # In-memory SQLite lives in a single connection; keep SQLAlchemy's pool for it
+    if parsed.get_backend_name() == 'sqlite' and parsed.database in (None, '', ':memory:'):
+        return options
+
+    options.update(
+        poolclass=TimedQueuePool,
+        pool_logging_name=name,
+        pool_size=config['DB_POOL_SIZE'],
+        max_overflow=config['DB_MAX_OVERFLOW'],
+        pool_timeout=config['DB_POOL_TIMEOUT'],
+        pool_pre_ping=config['DB_POOL_PRE_PING'],
+        pool_recycle=config['DB_POOL_RECYCLE'],
+    )
+    if parsed.get_backend_name() == 'postgresql' and config['DB_STATEMENT_TIMEOUT_MS']:
+        options['connect_args'] = {'options': f"-c statement_timeout={config['DB_STATEMENT_TIMEOUT_MS']}"}
+    return options
+
+
+def configure_engines(app):
+    """Fill in the engine options of the primary and the replica binds. Call before db.init_app."""
+    config = app.config
+    primary = engine_options(config['SQLALCHEMY_DATABASE_URI'], config, 'primary')
+    primary.update(config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+    config['SQLALCHEMY_ENGINE_OPTIONS'] = primary
+
+    config['SQLALCHEMY_BINDS'] = {
+        key: dict(engine_options(value, config, key), url=value) if isinstance(value, str) else value
+        for key, value in (config.get('SQLALCHEMY_BINDS') or {}).items()
+    }
+
+    if make_url(config['SQLALCHEMY_DATABASE_URI']).get_backend_name() == 'postgresql':
+        _green_psycopg2()
+
+
+def _green_psycopg2():
+    """Make psycopg2 yield to the eventlet hub while it waits on the server"""
+    try:
+        import eventlet.patcher
+        import psycopg2.extensions
+    except ImportError:
+        return
+    if not eventlet.patcher.is_monkey_patched('socket'):
+        return
+
+    from eventlet.hubs import trampoline
+
+    def wait(conn, timeout=None):
+        while True:
+            state = conn.poll()
+            if state == psycopg2.extensions.POLL_OK:
+                return
+            if state == psycopg2.extensions.POLL_READ:
+                trampoline(conn.fileno(), read=True)
+            elif state == psycopg2.extensions.POLL_WRITE:
+                trampoline(conn.fileno(), write=True)
+            else:
+                raise psycopg2.OperationalError(f'Bad result from poll: {state}')
+
+    psycopg2.extensions.set_wait_callback(wait)
+
+
+def pool_stats(engines: dict) -> dict[str, dict]:
+    """Stats of every instrumented pool, keyed by pool name"""
+    return {
+        pool.name: pool.stats()
+        for pool in (engine.pool for engine in engines.values())
+        if isinstance(pool, TimedQueuePool)
+    }
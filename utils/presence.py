@@ -0,0 +1,225 @@
+"""
+Typing indicators and presence updates, throttled and coalesced.
+
+Clients may send `typing` as often as they like: each connection gets at
+most one accepted update per conversation per TYPING_THROTTLE_MS (a change
+between typing and stopped always gets through), for at most
+TYPING_MAX_TARGETS conversations at a time. Accepted updates and
+cluster-wide online/offline changes are buffered and sent out every
+PRESENCE_FLUSH_INTERVAL_MS as one batched event per recipient:
+
+  - typing goes to the other participant (1:1) or the group's room
+  - presence goes only to connections that subscribed to that user
+
+Last-seen times are kept in memory and written to users.last_seen_at with
+one bulk UPDATE every LAST_SEEN_FLUSH_INTERVAL seconds, not per disconnect.
+"""
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Optional
+
+from utils.database import save_last_seen
+from utils.log import log_event
+from utils.metrics import events_total
+from utils.routing import Router, conversation_room, router
+
+# ('user', user_id) for 1:1 typing, ('room', conversation_id) for groups
+Target = tuple[str, int]
+
+
+class PresenceBroadcaster:
+    def __init__(self, router: Router, typing_throttle: float = 2.0, flush_interval: float = 0.25,
+                 last_seen_interval: float = 30.0, max_subscriptions: int = 500, max_typing_targets: int = 50):
+        self.router = router
+        self.typing_throttle = typing_throttle
+        self.max_typing_targets = max_typing_targets
+        self.flush_interval = flush_interval
+        self.last_seen_interval = last_seen_interval
+        self.max_subscriptions = max_subscriptions
+        self.app = None
+        self._emit: Optional[Callable] = None
+        self._sleep: Callable[[float], None] = time.sleep
+        self._lock = threading.Lock()
+
+        # sid -> target -> (monotonic time of last accepted update, typing, conversation_id)
+        self._typing_by_sid: dict[str, dict[Target, tuple[float, bool, Optional[int]]]] = {}
+        # target -> (user_id, conversation_id or None) -> typing, waiting for the next flush
+        self._pending_typing: dict[Target, dict[tuple[int, Optional[int]], bool]] = {}
+
+        # user_id -> sids watching them, and the reverse index
+        self._watchers: dict[int, set[str]] = {}
+        self._watching: dict[str, set[int]] = {}
+        # user_id -> latest update, waiting for the next flush
+        self._pending_presence: dict[int, dict] = {}
+
+        # user_id -> went offline at, not yet written to the database
+        self._last_seen: dict[int, datetime] = {}
+        self._last_seen_flushed = time.monotonic()
+
+        self._running = False
+
+    def init_app(self, app, socketio):
+        config = app.config
+        self.app = app
+        self.typing_throttle = config['TYPING_THROTTLE_MS'] / 1000
+        self.max_typing_targets = config['TYPING_MAX_TARGETS']
+        self.flush_interval = config['PRESENCE_FLUSH_INTERVAL_MS'] / 1000
+        self.last_seen_interval = config['LAST_SEEN_FLUSH_INTERVAL']
+        self.max_subscriptions = config['PRESENCE_MAX_SUBSCRIPTIONS']
+        self._emit = socketio.emit
+        self._sleep = socketio.sleep
+        if not self._running:
+            self._running = True
+            self.router.on_presence_change(self.presence_changed)
+            socketio.start_background_task(self._run)
+
+    def stop(self):
+        """Stop the flush loop and write out pending last-seen times"""
+        self._running = False
+        self.flush_last_seen()
+
+    # Typing
+
+    def typing(self, sid: str, user_id: int, target: Target, is_typing: bool,
+               conversation_id: Optional[int] = None) -> bool:
+        """Record a typing update from a connection. Returns False if it was throttled."""
+        now = time.monotonic()
+        with self._lock:
+            states = self._typing_by_sid.setdefault(sid, {})
+            previous = states.get(target)
+            if previous and previous[1] == is_typing and now - previous[0] < self.typing_throttle:
+                events_total.inc('typing', 'throttled')
+                return False
+            if previous is None and len(states) >= self.max_typing_targets:
+                # Stopped targets outside the throttle window no longer matter
+                for key, (updated, typing, _) in list(states.items()):
+                    if not typing and now - updated >= self.typing_throttle:
+                        del states[key]
+                if len(states) >= self.max_typing_targets:
+                    events_total.inc('typing', 'too_many_targets')
+                    return False
+            states[target] = (now, is_typing, conversation_id)
+            self._pending_typing.setdefault(target, {})[(user_id, conversation_id)] = is_typing
+        events_total.inc('typing', 'accepted')
+        return True
+
+    def is_typing(self, sid: str, target: Target) -> bool:
+        """Whether the connection's last accepted update for this target was 'typing'"""
+        with self._lock:
+            state = self._typing_by_sid.get(sid, {}).get(target)
+        return bool(state and state[1])
+
+    # Presence
+
+    def subscribe(self, sid: str, user_ids: list[int]) -> list[int]:
+        """Watch users' presence from a connection. Returns the ids actually added."""
+        with self._lock:
+            watching = self._watching.setdefault(sid, set())
+            room = max(self.max_subscriptions - len(watching), 0)
+            added = [user_id for user_id in dict.fromkeys(user_ids) if user_id not in watching][:room]
+            for user_id in added:
+                watching.add(user_id)
+                self._watchers.setdefault(user_id, set()).add(sid)
+        return added
+
+    def unsubscribe(self, sid: str, user_ids: list[int]):
+        with self._lock:
+            watching = self._watching.get(sid, set())
+            for user_id in user_ids:
+                if user_id in watching:
+                    watching.discard(user_id)
+                    self._unwatch(user_id, sid)
+
+    def presence_changed(self, user_id: int, online: bool):
+        """Router callback for cluster-wide online/offline changes"""
+        now = datetime.utcnow()
+        with self._lock:
+            if not online:
+                self._last_seen[user_id] = now
+            if user_id in self._watchers:
+                self._pending_presence[user_id] = {
+                    'user_id': user_id,
+                    'online': online,
+                    'last_seen': None if online else now.isoformat(),
+                }
+
+    def pending_last_seen(self, user_ids: list[int]) -> dict[int, datetime]:
+        """Last-seen times that are newer than the database"""
+        with self._lock:
+            return {user_id: self._last_seen[user_id] for user_id in user_ids if user_id in self._last_seen}
+
+    def disconnected(self, sid: str, user_id: Optional[int]):
+        """Drop a connection's throttle state and subscriptions; stop its typing indicators"""
+        with self._lock:
+            states = self._typing_by_sid.pop(sid, {})
+            if user_id is not None:
+                for target, (_, is_typing, conversation_id) in states.items():
+                    if is_typing:
+                        self._pending_typing.setdefault(target, {})[(user_id, conversation_id)] = False
+            for watched in self._watching.pop(sid, ()):
+                self._unwatch(watched, sid)
+
+    def _unwatch(self, user_id: int, sid: str):
+        sids = self._watchers.get(user_id)
+        if sids:
+            sids.discard(sid)
+            if not sids:
+                del self._watchers[user_id]
+
+    # Flushing
+
+    def _run(self):
+        while self._running:
+            self._sleep(self.flush_interval)
+            try:
+                self.flush()
+                if time.monotonic() - self._last_seen_flushed >= self.last_seen_interval:
+                    self.flush_last_seen()
+            except Exception as e:
+                log_event('presence_flush_failed', 'error', error=str(e))
+
+    def flush(self):
+        """Send one batched event per typing target and per subscribed connection"""
+        with self._lock:
+            typing, self._pending_typing = self._pending_typing, {}
+            presence, self._pending_presence = self._pending_presence, {}
+            by_sid: dict[str, list[dict]] = {}
+            for user_id, update in presence.items():
+                for sid in self._watchers.get(user_id, ()):
+                    by_sid.setdefault(sid, []).append(update)
+
+        for (kind, key), updates in typing.items():
+            payload = {'updates': [
+                {'user_id': user_id, 'conversation_id': conversation_id, 'typing': is_typing}
+                for (user_id, conversation_id), is_typing in updates.items()
+            ]}
+            if kind == 'room':
+                self.router.broadcast(conversation_room(key), 'typing', payload)
+            else:
+                self.router.deliver(key, 'typing', payload)
+
+        for sid, updates in by_sid.items():
+            self._emit('presence', {'updates': updates}, to=sid)
+
+    def flush_last_seen(self):
+        """Write buffered last-seen times with a single bulk UPDATE"""
+        with self._lock:
+            seen, self._last_seen = self._last_seen, {}
+            self._last_seen_flushed = time.monotonic()
+        if not seen or self.app is None:
+            return
+
+        try:
+            with self.app.app_context():
+                save_last_seen(seen)
+        except Exception as e:
+            # Keep them for the next round unless newer times arrived meanwhile
+            with self._lock:
+                for user_id, seen_at in seen.items():
+                    self._last_seen.setdefault(user_id, seen_at)
+            log_event('last_seen_flush_failed', 'error', users=len(seen), error=str(e))
+
+
+# Process-wide broadcaster used by the Socket.IO handlers
+presence = PresenceBroadcaster(router)
@@ -0,0 +1,199 @@
+"""
+Token-bucket rate limiting for socket events.
+
+A bucket holds up to `burst` tokens and refills at `rate` tokens per
+second; each event spends one token (or `cost`). When the bucket is empty
+the event is refused with the time until enough tokens are back.
+
+MemoryRateLimiter keeps buckets in-process (single node, tests, and the
+per-connection buckets, which are node-local anyway). RedisRateLimiter
+keeps them in Redis so a user's limit holds across every worker.
+"""
+import math
+import threading
+import time
+from typing import Optional
+
+from utils.cache import LRUCache
+from utils.log import log_event
+
+
+class RateLimiter:
+    """Interface shared by the limiter backends"""
+
+    def hit(self, key: str, rate: float, burst: int, cost: int = 1) -> tuple[bool, float]:
+        """Spend `cost` tokens. Returns (allowed, retry_after_seconds)."""
+        raise NotImplementedError
+
+    def reset(self, key: str):
+        raise NotImplementedError
+
+
+def _refill(tokens: float, elapsed: float, rate: float, burst: int) -> float:
+    return min(float(burst), tokens + elapsed * rate)
+
+
+class MemoryRateLimiter(RateLimiter):
+    def __init__(self, maxsize: int = 100000):
+        self._lock = threading.Lock()
+        # key -> (tokens, monotonic time); entries expire once they would be full again
+        self._buckets = LRUCache(maxsize=maxsize)
+
+    def hit(self, key: str, rate: float, burst: int, cost: int = 1) -> tuple[bool, float]:
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key) or (float(burst), now)
+            tokens = _refill(tokens, now - updated, rate, burst)
+
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            self._buckets.set(key, (tokens, now), ttl=(burst - tokens) / rate + 1)
+
+        if allowed:
+            return True, 0.0
+        return False, (cost - tokens) / rate
+
+    def reset(self, key: str):
+        self._buckets.pop(key)
+
+
+class RedisRateLimiter(RateLimiter):
+    """Buckets in Redis hashes, updated atomically by a Lua script using the server clock"""
+
+    KEY = 'chat:ratelimit:{key}'
+
+    SCRIPT = """
+    local rate, burst, cost = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+    local clock = redis.call('TIME')
+    local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+    local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+    local tokens = tonumber(state[1]) or burst
+    local ts = tonumber(state[2]) or now
+    tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+    local allowed = 0
+    if tokens >= cost then
+        tokens = tokens - cost
+        allowed = 1
+    end
+    redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+    redis.call('PEXPIRE', KEYS[1], math.ceil((burst - tokens) / rate * 1000) + 1000)
+    return {allowed, tostring(tokens)}
+    """
+
+    def __init__(self, url: str):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError('RATE_LIMIT_BACKEND=redis requires the redis package (pip install redis)')
+
+        self.redis = redis.Redis.from_url(url, decode_responses=True)
+        self._script = self.redis.register_script(self.SCRIPT)
+
+    def hit(self, key: str, rate: float, burst: int, cost: int = 1) -> tuple[bool, float]:
+        try:
+            allowed, tokens = self._script(keys=[self.KEY.format(key=key)], args=[rate, burst, cost])
+        except Exception as e:
+            # Fail open: losing Redis should not stop everyone from chatting
+            log_event('rate_limit_backend_error', 'error', error=str(e))
+            return True, 0.0
+
+        if allowed:
+            return True, 0.0
+        return False, (cost - float(tokens)) / rate
+
+    def reset(self, key: str):
+        self.redis.delete(self.KEY.format(key=key))
+
+
+def create_rate_limiter(backend: str, redis_url: Optional[str] = None) -> RateLimiter:
+    if backend == 'redis':
+        return RedisRateLimiter(redis_url or 'redis://localhost:6379')
+    if backend == 'memory':
+        return MemoryRateLimiter()
+    raise ValueError(f'Unknown RATE_LIMIT_BACKEND: {backend}')
+
+
+class SendLimits:
+    """
+    The limits applied to send_message: one bucket per connection (always
+    in memory) and one per user (on the configured backend). Bulk sends and
+    imports spend one token per message from a third, per-user bucket.
+    Typing updates have their own connection bucket of the same size.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.user_rate, self.user_burst = 10.0, 30
+        self.connection_rate, self.connection_burst = 5.0, 20
+        self.bulk_rate, self.bulk_burst = 200.0, 5000
+        self.users: RateLimiter = MemoryRateLimiter()
+        self.connections: RateLimiter = MemoryRateLimiter()
+
+    def init_app(self, app):
+        config = app.config
+        self.enabled = config['RATE_LIMIT_ENABLED']
+        self.user_rate = config['RATE_LIMIT_USER_RATE']
+        self.user_burst = config['RATE_LIMIT_USER_BURST']
+        self.connection_rate = config['RATE_LIMIT_CONNECTION_RATE']
+        self.connection_burst = config['RATE_LIMIT_CONNECTION_BURST']
+        self.bulk_rate = config['RATE_LIMIT_BULK_RATE']
+        self.bulk_burst = config['RATE_LIMIT_BULK_BURST']
+        self.users = create_rate_limiter(config['RATE_LIMIT_BACKEND'], config.get('REDIS_URL'))
+
+    def check(self, user_id: int, sid: str, cost: int = 1) -> Optional[dict]:
+        """
+        Spend tokens for a send. Returns None when allowed, otherwise the
+        payload for a `rate_limited` event.
+        """
+        if not self.enabled:
+            return None
+
+        allowed, retry_after = self.connections.hit(f'sid:{sid}', self.connection_rate,
+                                                    self.connection_burst, cost)
+        scope = 'connection'
+        if allowed:
+            allowed, retry_after = self.users.hit(f'user:{user_id}', self.user_rate, self.user_burst, cost)
+            scope = 'user'
+        if allowed:
+            return None
+
+        return {
+            'event': 'send_message',
+            'scope': scope,
+            # Rounded up to whole milliseconds so clients never retry too early
+            'retry_after': math.ceil(retry_after * 1000) / 1000,
+        }
+
+    def check_bulk(self, user_id: int, count: int, event: str = 'send_messages') -> Optional[dict]:
+        """
+        Spend `count` tokens from the user's bulk bucket, which is separate
+        from the per-message buckets so one batch cannot exceed their burst.
+        Same return value as check().
+        """
+        if not self.enabled:
+            return None
+
+        allowed, retry_after = self.users.hit(f'bulk:{user_id}', self.bulk_rate, self.bulk_burst, count)
+        if allowed:
+            return None
+        return {
+            'event': event,
+            'scope': 'bulk',
+            'retry_after': math.ceil(retry_after * 1000) / 1000,
+        }
+
+    def check_typing(self, sid: str) -> bool:
+        """Spend a token from the connection's typing bucket. Returns False when it is empty."""
+        if not self.enabled:
+            return True
+        allowed, _ = self.connections.hit(f'typing:{sid}', self.connection_rate, self.connection_burst)
+        return allowed
+
+    def forget_connection(self, sid: str):
+        self.connections.reset(f'sid:{sid}')
+        self.connections.reset(f'typing:{sid}')
+
+
+# Process-wide limits used by the Socket.IO handlers
+send_limits = SendLimits()
@@ -0,0 +1,146 @@
+"""
+Read replicas for the list, history and search endpoints.
+
+Replicas are the SQLAlchemy binds replica_0, replica_1, ... built from
+DATABASE_REPLICA_URLS. Inside `with replicas.reading(user_id):` the
+session's SELECTs go to a replica (models.database.RoutingSession);
+writes and flushes always go to the primary. Sync, the offline flush,
+access checks and every write path stay on the primary.
+
+A replica serves a read only when
+  - its lag is at most REPLICA_MAX_LAG_SECONDS. Lag comes from the change
+    log: the age of the oldest change on the primary the replica does not
+    have yet, 0 when it has them all. It is measured at most every
+    REPLICA_LAG_CHECK_SECONDS; an unreachable replica counts as lagging
+    until the next check.
+  - the user has not written on this node within READ_YOUR_WRITES_SECONDS,
+    or the replica's lag plus one check interval if that is longer. Whoever
+    just sent a message reads it back from the primary.
+Otherwise the block reads from the primary.
+"""
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Iterable, Optional
+
+from sqlalchemy import func, select
+
+from models.database import db, read_engine
+from models.rows import changes_table
+from utils.cache import LRUCache
+from utils.log import log_event
+from utils.metrics import metrics
+
+replica_reads_total = metrics.counter(
+    'chat_replica_reads_total', 'Routed reads by target and reason (replica, lagging, recent_write)',
+    ('target', 'reason'))
+
+
+class ReplicaRouter:
+    def __init__(self, tracked_writers: int = 100000):
+        self.keys: list[str] = []
+        self.max_lag = 2.0
+        self.check_interval = 1.0
+        self.read_your_writes = 5.0
+        self._lock = threading.Lock()
+        # replica key -> (lag in seconds or None if unreachable, monotonic time of the check)
+        self._lag: dict[str, tuple[Optional[float], float]] = {}
+        self._round_robin = itertools.count()
+        # user_id -> monotonic time of the user's last write on this node
+        self._writes = LRUCache(maxsize=tracked_writers)
+
+    def init_app(self, app):
+        self.keys = sorted(key for key in app.config.get('SQLALCHEMY_BINDS') or {} if key.startswith('replica_'))
+        self.max_lag = app.config['REPLICA_MAX_LAG_SECONDS']
+        self.check_interval = app.config['REPLICA_LAG_CHECK_SECONDS']
+        self.read_your_writes = app.config['READ_YOUR_WRITES_SECONDS']
+        self._lag = {}
+        self._writes.clear()
+        # Past this a write no longer keeps anyone on the primary: lagging replicas are skipped anyway
+        self._writes.ttl = max(self.read_your_writes, self.max_lag + self.check_interval)
+
+    def note_write(self, user_ids: Iterable[int]):
+        """Keep these users' reads on the primary until replicas have caught up with their write"""
+        if not self.keys:
+            return
+        now = time.monotonic()
+        for user_id in user_ids:
+            self._writes.set(user_id, now)
+
+    def _measure(self, key: str) -> Optional[float]:
+        try:
+            with db.engines[key].connect() as conn:
+                replica_seq = conn.execute(select(func.max(changes_table.c.seq))).scalar() or 0
+            with db.engine.connect() as conn:
+                oldest_missing = conn.execute(
+                    select(changes_table.c.created_at)
+                    .where(changes_table.c.seq > replica_seq)
+                    .order_by(changes_table.c.seq).limit(1)
+                ).scalar()
+        except Exception as e:
+            log_event('replica_unavailable', 'warning', replica=key, error=str(e))
+            return None
+        if oldest_missing is None:
+            return 0.0
+        return max((datetime.utcnow() - oldest_missing).total_seconds(), 0.0)
+
+    def lag(self, key: str) -> Optional[float]:
+        """The replica's last measured lag, measured again once it is older than the check interval"""
+        lag, checked_at = self._lag.get(key, (None, float('-inf')))
+        if time.monotonic() - checked_at < self.check_interval:
+            return lag
+        # One greenlet measures; the others keep using the previous value meanwhile
+        if not self._lock.acquire(blocking=False):
+            return lag
+        try:
+            lag = self._measure(key)
+            self._lag[key] = (lag, time.monotonic())
+        finally:
+            self._lock.release()
+        return lag
+
+    def lags(self) -> dict[str, float]:
+        """Last measured lag per replica, -1 for unreachable ones (for the metrics gauge)"""
+        return {key: -1 if lag is None else lag for key, (lag, _) in self._lag.items()}
+
+    def pick(self, user_id: int) -> tuple[Optional[str], str]:
+        """(replica key or None for the primary, reason)"""
+        lags = {key: self.lag(key) for key in self.keys}
+        fresh = [key for key, lag in lags.items() if lag is not None and lag <= self.max_lag]
+        if not fresh:
+            return None, 'lagging'
+
+        last_write = self._writes.get(user_id)
+        if last_write is not None:
+            since_write = time.monotonic() - last_write
+            fresh = [key for key in fresh
+                     if since_write >= max(self.read_your_writes, lags[key] + self.check_interval)]
+            if not fresh:
+                return None, 'recent_write'
+
+        return fresh[next(self._round_robin) % len(fresh)], 'replica'
+
+    @contextmanager
+    def reading(self, user_id: int):
+        """Route the block's SELECTs to a replica when one may serve this user. Yields its key or None."""
+        if not self.keys:
+            yield None
+            return
+
+        key, reason = self.pick(user_id)
+        replica_reads_total.inc(key or 'primary', reason)
+        if key is None:
+            yield None
+            return
+
+        token = read_engine.set(db.engines[key])
+        try:
+            yield key
+        finally:
+            read_engine.reset(token)
+
+
+# Process-wide router used by the REST read endpoints
+replicas = ReplicaRouter()
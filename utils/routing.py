@@ -0,0 +1,230 @@
+"""
+Cluster-wide delivery of socket events.
+
+Every node keeps its own ConnectionRegistry. The Router delivers to the
+sockets it holds locally and forwards the event over the bus to each other
+node that holds a socket for the recipient, so a message reaches the user
+whichever process they are connected to.
+
+Group conversations use Socket.IO rooms: every member socket joins the
+conversation's room, and one broadcast per node reaches all of them.
+
+Deliveries that carry `track` (the messages they contain) are handed to
+the delivery tracker of the node that holds the sockets, which waits for
+an ack (utils/delivery.py).
+
+On buses with heartbeats (Redis) each node refreshes its own every
+NODE_HEARTBEAT_SECONDS and reaps the presence of nodes that stopped
+sending theirs, announcing the users that leaves offline.
+"""
+import os
+import socket
+from typing import Callable, Optional
+
+from utils.bus import LocalBus, MessageBus, create_bus
+from utils.connections import ConnectionRegistry, connections
+from utils.log import log_event
+
+DELIVER_CHANNEL = 'chat:node:{node_id}'
+PRESENCE_CHANNEL = 'chat:presence'
+ROOM_CHANNEL = 'chat:rooms'
+
+
+def conversation_room(conversation_id: int) -> str:
+    return f'conversation:{conversation_id}'
+
+
+class Router:
+    def __init__(self, registry: ConnectionRegistry, bus: Optional[MessageBus] = None,
+                 node_id: Optional[str] = None, emit: Optional[Callable] = None):
+        self.registry = registry
+        self.node_id = node_id or f'{socket.gethostname()}-{os.getpid()}'
+        self.bus: MessageBus = bus or LocalBus()
+        self._emit = emit
+        self._enter_room: Optional[Callable[[str, str], None]] = None
+        self._leave_room: Optional[Callable[[str, str], None]] = None
+        self._presence_listeners: list[Callable[[int, bool], None]] = []
+        self._track: Optional[Callable] = None
+        self._heartbeat_interval = 10.0
+        self._subscribed = False
+        if emit:
+            self._subscribe()
+
+    def init_app(self, app, socketio):
+        """Build the configured bus and start listening for this node's deliveries"""
+        config = app.config
+        self.node_id = config.get('NODE_ID') or self.node_id
+        self.bus = create_bus(config.get('BUS_BACKEND', 'local'), config.get('REDIS_URL'),
+                              config.get('NODE_TIMEOUT_SECONDS', 30))
+        self._heartbeat_interval = config.get('NODE_HEARTBEAT_SECONDS', 10)
+        if hasattr(self.bus, 'heartbeat'):
+            self.heartbeat()
+        if hasattr(self.bus, 'clear_node'):
+            self._announce_offline(self.bus.clear_node(self.node_id), self.node_id)
+        self._emit = socketio.emit
+        self._enter_room = lambda sid, room: socketio.server.enter_room(sid, room, namespace='/')
+        self._leave_room = lambda sid, room: socketio.server.leave_room(sid, room, namespace='/')
+        self._subscribed = False
+        self._subscribe()
+        self.bus.start(socketio.start_background_task)
+        if hasattr(self.bus, 'heartbeat'):
+            socketio.start_background_task(self._keep_alive, socketio.sleep)
+
+    def _subscribe(self):
+        if self._subscribed:
+            return
+        self._subscribed = True
+        self.bus.subscribe(DELIVER_CHANNEL.format(node_id=self.node_id), self._on_delivery)
+        self.bus.subscribe(PRESENCE_CHANNEL, self._on_presence)
+        self.bus.subscribe(ROOM_CHANNEL, self._on_room)
+
+    # Presence
+
+    def user_connected(self, user_id: int, sid: str) -> bool:
+        """Register a socket locally and cluster-wide. Returns True if the user just came online."""
+        self.registry.add(user_id, sid)
+        online = self.bus.presence_add(user_id, self.node_id)
+        if online:
+            self.bus.publish(PRESENCE_CHANNEL, {'user_id': user_id, 'online': True, 'node_id': self.node_id})
+        return online
+
+    def user_disconnected(self, sid: str) -> tuple[Optional[int], bool]:
+        """Unregister a socket. Returns (user_id, went_offline_cluster_wide)."""
+        user_id, _ = self.registry.remove(sid)
+        if user_id is None:
+            return None, False
+        offline = self.bus.presence_remove(user_id, self.node_id)
+        if offline:
+            self.bus.publish(PRESENCE_CHANNEL, {'user_id': user_id, 'online': False, 'node_id': self.node_id})
+        return user_id, offline
+
+    def is_online(self, user_id: int) -> bool:
+        if self.registry.is_online(user_id):
+            return True
+        return bool(self.bus.presence_nodes(user_id))
+
+    def online_among(self, user_ids) -> set[int]:
+        """Get which of the given users are online, with one bus query for the non-local ones"""
+        online = {user_id for user_id in user_ids if self.registry.is_online(user_id)}
+        rest = [user_id for user_id in user_ids if user_id not in online]
+        if rest:
+            online |= self.bus.presence_online(rest)
+        return online
+
+    def heartbeat(self):
+        """Refresh this node's heartbeat, re-register it if it was reaped, and reap dead nodes"""
+        rejoined, dead = self.bus.heartbeat(self.node_id)
+        if rejoined:
+            # Another node took this one for dead (e.g. it stalled): put its sockets back
+            counts = {user_id: len(self.registry.sids_for(user_id)) for user_id in self.registry.online_users()}
+            if counts:
+                for user_id in self.bus.presence_restore(self.node_id, counts):
+                    self.bus.publish(PRESENCE_CHANNEL, {'user_id': user_id, 'online': True, 'node_id': self.node_id})
+        for node_id in dead:
+            offline = self.bus.reap_node(node_id)
+            if offline:
+                log_event('node_reaped', node_id=node_id, users_offline=len(offline))
+            self._announce_offline(offline, node_id)
+
+    def _keep_alive(self, sleep: Callable):
+        while True:
+            sleep(self._heartbeat_interval)
+            try:
+                self.heartbeat()
+            except Exception as e:
+                log_event('heartbeat_failed', 'error', node_id=self.node_id, error=str(e))
+
+    def _announce_offline(self, user_ids: list[int], node_id: str):
+        for user_id in user_ids:
+            self.bus.publish(PRESENCE_CHANNEL, {'user_id': user_id, 'online': False, 'node_id': node_id})
+
+    def on_presence_change(self, listener: Callable[[int, bool], None]):
+        """Register a callback(user_id, online) for cluster-wide presence changes"""
+        self._presence_listeners.append(listener)
+
+    def _on_presence(self, message: dict):
+        for listener in self._presence_listeners:
+            listener(message['user_id'], message['online'])
+
+    # Delivery
+
+    def track_deliveries(self, track: Callable):
+        """Register track(user_id, sids, event, payload, messages) for deliveries that need an ack"""
+        self._track = track
+
+    def deliver(self, user_id: int, event: str, payload: dict, track: Optional[list] = None) -> bool:
+        """
+        Send an event to every socket the user has open, on any node.
+        `track` lists the (message_id, sender_id) pairs the event carries;
+        each node then waits for one of the user's sockets to acknowledge it.
+        Returns True if the user had at least one socket somewhere.
+        """
+        delivered = self._emit_local(user_id, event, payload, track)
+
+        for node_id in self.bus.presence_nodes(user_id):
+            if node_id == self.node_id:
+                continue
+            self.bus.publish(DELIVER_CHANNEL.format(node_id=node_id), {
+                'user_id': user_id,
+                'event': event,
+                'payload': payload,
+                'track': track,
+                'origin': self.node_id,
+            })
+            delivered = True
+
+        return delivered
+
+    def _emit_local(self, user_id: int, event: str, payload: dict, track: Optional[list] = None) -> bool:
+        sids = self.registry.sids_for(user_id)
+        if sids and track and self._track is not None:
+            self._track(user_id, sids, event, payload, [tuple(message) for message in track])
+            return True
+        for sid in sids:
+            self._emit(event, payload, to=sid)
+        return bool(sids)
+
+    def _on_delivery(self, message: dict):
+        self._emit_local(message['user_id'], message['event'], message['payload'], message.get('track'))
+
+    # Rooms
+
+    def broadcast(self, room: str, event: str, payload: dict, skip_sid: Optional[str] = None):
+        """Emit an event once per node to every socket in a room"""
+        self._emit(event, payload, to=room, skip_sid=skip_sid)
+        self.bus.publish(ROOM_CHANNEL, {
+            'room': room,
+            'event': event,
+            'payload': payload,
+            'skip_sid': skip_sid,
+            'origin': self.node_id,
+        })
+
+    def join_room(self, user_id: int, room: str):
+        """Put every socket the user has open, on any node, into a room"""
+        self._change_room_local(user_id, room, join=True)
+        self.bus.publish(ROOM_CHANNEL, {'user_id': user_id, 'room': room, 'join': True, 'origin': self.node_id})
+
+    def leave_room(self, user_id: int, room: str):
+        self._change_room_local(user_id, room, join=False)
+        self.bus.publish(ROOM_CHANNEL, {'user_id': user_id, 'room': room, 'join': False, 'origin': self.node_id})
+
+    def _change_room_local(self, user_id: int, room: str, join: bool):
+        change = self._enter_room if join else self._leave_room
+        if change is None:
+            return
+        for sid in self.registry.sids_for(user_id):
+            change(sid, room)
+
+    def _on_room(self, message: dict):
+        if message['origin'] == self.node_id:
+            return
+        if 'event' in message:
+            self._emit(message['event'], message['payload'], to=message['room'], skip_sid=message['skip_sid'])
+        else:
+            self._change_room_local(message['user_id'], message['room'], message['join'])
+
+
+# Process-wide router used by the Socket.IO handlers
+router = Router(connections)
+
@@ -0,0 +1,117 @@
+"""
+Full-text search over message history.
+
+PostgreSQL: the GIN index ix_messages_search on to_tsvector('simple', content)
+is kept current by Postgres itself on every INSERT and DELETE of messages.
+Queries use websearch_to_tsquery (quoted phrases, OR, -exclusions) and are
+ranked with ts_rank_cd.
+
+SQLite (local testing): messages_fts is an FTS5 table keyed by message id.
+The save paths call index_messages() and the archive job unindex_messages()
+in the same transaction as the rows they write or delete. Queries match all
+of their words and are ranked with bm25.
+
+Either way results are ordered by (rank, id) descending so they can be paged
+with a keyset cursor. Archived messages leave the index with their rows:
+search covers the hot window (ARCHIVE_AFTER_DAYS).
+"""
+import re
+from typing import Iterable, Optional
+
+from sqlalchemy import Double, and_, cast, column, delete, func, insert, literal_column, or_, select, table
+
+from models import db
+from models.rows import MessageRow, MESSAGE_COLUMNS, messages_table
+
+# Text search configuration of ix_messages_search; no stemming or stop words, chat is multilingual
+TS_CONFIG = "'simple'"
+
+messages_fts = table('messages_fts', column('rowid'), column('content'), column('conversation_id'))
+
+_WORD = re.compile(r'\w+')
+
+
+def _dialect() -> str:
+    return db.session.get_bind().dialect.name
+
+
+def index_messages(entries: Iterable[tuple[int, int, str]]):
+    """
+    Add (message_id, conversation_id, content) entries to the index.
+    Does not commit. A no-op on PostgreSQL, where the GIN index follows the table.
+    """
+    if _dialect() != 'sqlite':
+        return
+    rows = [{'rowid': message_id, 'conversation_id': conversation_id, 'content': content}
+            for message_id, conversation_id, content in entries]
+    if rows:
+        db.session.execute(insert(messages_fts), rows)
+
+
+def unindex_messages(message_ids: list[int]):
+    """Remove messages from the index. Does not commit."""
+    if _dialect() != 'sqlite' or not message_ids:
+        return
+    db.session.execute(delete(messages_fts).where(messages_fts.c.rowid.in_(message_ids)))
+
+
+def _ranked_postgresql(scope, query: str):
+    document = func.to_tsvector(literal_column(TS_CONFIG), messages_table.c.content)
+    tsquery = func.websearch_to_tsquery(literal_column(TS_CONFIG), query)
+    return select(
+        # ts_rank_cd is a real; as double precision the value round-trips exactly through a cursor
+        messages_table.c.id, cast(func.ts_rank_cd(document, tsquery), Double).label('rank')
+    ).where(
+        messages_table.c.conversation_id.in_(scope),
+        document.op('@@')(tsquery)
+    ).subquery()
+
+
+def _ranked_sqlite(scope, query: str):
+    words = _WORD.findall(query)
+    if not words:
+        return None
+    fts = literal_column('messages_fts')
+    # Every word quoted, so FTS5 query syntax in user input is matched literally
+    match = ' '.join('"{}"'.format(word) for word in words)
+    return select(
+        messages_fts.c.rowid.label('id'), (-func.bm25(fts)).label('rank')
+    ).where(
+        fts.match(match),
+        messages_fts.c.conversation_id.in_(scope)
+    ).subquery()
+
+
+def search_messages(scope, query: str, limit: int = 20,
+                    after: Optional[tuple[float, int]] = None) -> tuple[list[tuple[MessageRow, float]], bool]:
+    """
+    Find messages matching `query` in the conversations of `scope` (a list
+    of ids or a SELECT of them), most relevant first. `after` is the
+    (rank, id) of the last result of the previous page.
+    Returns ([(row, rank)], has_more).
+    """
+    dialect = _dialect()
+    if dialect == 'postgresql':
+        ranked = _ranked_postgresql(scope, query)
+    elif dialect == 'sqlite':
+        ranked = _ranked_sqlite(scope, query)
+    else:
+        raise RuntimeError(f'Message search is not supported on {dialect}')
+    if ranked is None:
+        return [], False
+
+    statement = select(*MESSAGE_COLUMNS, ranked.c.rank).join_from(
+        ranked, messages_table, messages_table.c.id == ranked.c.id
+    )
+    if after:
+        rank, message_id = after
+        statement = statement.where(or_(
+            ranked.c.rank < rank,
+            and_(ranked.c.rank == rank, ranked.c.id < message_id)
+        ))
+
+    rows = db.session.execute(
+        statement.order_by(ranked.c.rank.desc(), ranked.c.id.desc()).limit(limit + 1)
+    ).all()
+    results = [(MessageRow(*row[:-1]), row[-1]) for row in rows[:limit]]
+    return results, len(rows) > limit
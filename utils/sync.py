@@ -0,0 +1,133 @@
+"""
+Change log for delta sync.
+
+Every write a reconnecting client needs to hear about appends a row to
+`changes` in the same transaction:
+
+  - message         a new message (save_message, save_messages_batch)
+  - delivered       user_id received every message the other participant
+                    sent up to (sent_at, message_id)
+  - read            user_id read the conversation up to (sent_at, message_id)
+  - member_added    user_id joined a group
+  - member_removed  user_id left or was removed from a group
+  - history         older messages were imported (import_messages); one
+                    row per conversation and import, refetch its pages
+
+`seq` is the cursor. A sync reads the user's conversations past the cursor
+through ix_changes_conversation_seq, so it costs what changed, not the size
+of the history. Group delivery watermarks are not logged: they move for
+every online member on every message.
+
+Sequence values are taken at insert but become visible at commit, so a
+slow transaction can commit a lower seq after a reader has seen a higher
+one. The returned cursor therefore stops short of changes younger than
+SYNC_SETTLE_SECONDS; they are sent again on the next sync and clients
+apply changes idempotently.
+"""
+from datetime import datetime, timedelta
+from typing import Iterable, Optional
+
+from sqlalchemy import and_, delete, func, insert, select
+
+from models import db
+from models.rows import changes_table
+
+# (conversation_id, kind, user_id, message_id, sent_at of message_id)
+ChangeEntry = tuple[int, str, Optional[int], Optional[int], Optional[datetime]]
+
+
+def record_changes(entries: Iterable[ChangeEntry]):
+    """Append entries to the change log. Does not commit."""
+    now = datetime.utcnow()
+    rows = [{'conversation_id': conversation_id, 'kind': kind, 'user_id': user_id,
+             'message_id': message_id, 'sent_at': sent_at, 'created_at': now}
+            for conversation_id, kind, user_id, message_id, sent_at in entries]
+    if rows:
+        db.session.execute(insert(changes_table), rows)
+
+
+def current_seq() -> int:
+    return db.session.execute(select(func.max(changes_table.c.seq))).scalar() or 0
+
+
+def oldest_seq() -> Optional[int]:
+    return db.session.execute(select(func.min(changes_table.c.seq))).scalar()
+
+
+def read_changes(scope, user_id: int, since: int, limit: int) -> list:
+    """
+    Up to `limit` changes past `since`, in seq order: those of the
+    conversations in `scope` (a SELECT of ids) plus the user's own removals.
+    """
+    changes = changes_table
+    visible = scope.subquery()
+    in_scope = select(changes).join_from(
+        visible, changes, and_(changes.c.conversation_id == visible.c.id, changes.c.seq > since)
+    )
+    removed = select(changes).where(
+        changes.c.kind == 'member_removed', changes.c.user_id == user_id, changes.c.seq > since
+    )
+    combined = in_scope.union(removed).subquery()
+    return db.session.execute(
+        select(combined).order_by(combined.c.seq).limit(limit)
+    ).all()
+
+
+def settled_cursor(changes: list, since: int, settle_seconds: float, page_full: bool) -> int:
+    """
+    The cursor to hand back: the last change old enough that no lower seq
+    can still be in flight. A full page always advances, or a busy client
+    would fetch the same page forever.
+    """
+    if page_full and changes:
+        return changes[-1].seq
+
+    settle_before = datetime.utcnow() - timedelta(seconds=settle_seconds)
+    cursor = since
+    for change in changes:
+        if change.created_at > settle_before:
+            break
+        cursor = change.seq
+    return cursor
+
+
+def latest_change(scope, user_id: int):
+    """
+    (seq, created_at) of the newest change visible to the user, or None.
+    Takes the max per conversation, one backward index probe each, so the
+    cost does not grow with the length of the log.
+    """
+    changes = changes_table
+    visible = scope.subquery()
+    newest_in = select(func.max(changes.c.seq)).where(
+        changes.c.conversation_id == visible.c.id
+    ).scalar_subquery()
+    seq = max(filter(None, (
+        db.session.execute(select(func.max(newest_in)).select_from(visible)).scalar(),
+        db.session.execute(select(func.max(changes.c.seq)).where(
+            changes.c.kind == 'member_removed', changes.c.user_id == user_id
+        )).scalar(),
+    )), default=None)
+    if seq is None:
+        return None
+    return db.session.execute(select(changes.c.seq, changes.c.created_at).where(changes.c.seq == seq)).one()
+
+
+def latest_conversation_change(conversation_id: int):
+    """(seq, created_at) of the conversation's newest change, or None"""
+    changes = changes_table
+    return db.session.execute(
+        select(changes.c.seq, changes.c.created_at)
+        .where(changes.c.conversation_id == conversation_id)
+        .order_by(changes.c.seq.desc()).limit(1)
+    ).one_or_none()
+
+
+def prune_changes(cutoff: datetime, dry_run: bool = False) -> int:
+    """Drop change log entries older than cutoff. Returns how many."""
+    condition = changes_table.c.created_at < cutoff
+    if dry_run:
+        return db.session.execute(select(func.count()).where(condition)).scalar()
+    result = db.session.execute(delete(changes_table).where(condition))
+    db.session.commit()
+    return result.rowcount